@@ -1,9 +1,17 @@
+from typing import Callable, Dict
 from tinygrad.tensor import Tensor, Function
 from tinygrad.lazy import LazyBuffer, Device, create_lazybuffer, LazyOp
 from tinygrad.ops import BinaryOps, ASTRunner, LoadOps
 from tinygrad.helpers import dtypes, prod
 from tinygrad.shape.shapetracker import ShapeTracker
 
+from ameo_activation_np import (
+    leaky_ameo_np,
+    leaky_ameo_grad_np,
+    interpolated_ameo_np,
+    interpolated_ameo_grad_np,
+)
+
 
 def where_raw(cond: LazyBuffer, input_: LazyBuffer, other: LazyBuffer):
     inv_cond = cond.binary_op(BinaryOps.CMPEQ, cond.const_like(0.0))
@@ -31,6 +39,159 @@ def ameo_grad(x: Tensor):
     )
 
 
+LEAKY_AMEO_KERNEL_BODY = """
+    float x = a[idx];
+    float y = 1.0;
+    if (x <= -3.0) {
+        y = -1.0 + (x + 3.0) * LEAKYNESS;
+    } else if (x <= -1.0) {
+        y = x + 2.0;
+    } else if (x <= 1.0) {
+        y = -x;
+    } else if (x <= 3.0) {
+        y = x - 2.0;
+    } else {
+        y = 1.0 + (x - 3.0) * LEAKYNESS;
+    }
+    c[idx] = y;
+"""
+
+LEAKY_AMEO_GRAD_KERNEL_BODY = """
+    float x = a[idx];
+    float y = LEAKYNESS;
+    if (x <= -3.0) {
+        y = LEAKYNESS;
+    } else if (x <= -1.0) {
+        y = 1.0;
+    } else if (x <= 1.0) {
+        y = -1.0;
+    } else if (x <= 3.0) {
+        y = 1.0;
+    }
+    outbuf[idx] = y * grad_output[idx];
+"""
+
+INTERPOLATED_AMEO_KERNEL_BODY = """
+    float x = a[idx];
+
+    float y0 = 1.0;
+    if (x <= -3.0) {
+        y0 = -1.0 + (x + 3.0) * LEAKYNESS;
+    } else if (x <= -1.0) {
+        y0 = x + 2.0;
+    } else if (x <= 1.0) {
+        y0 = -x;
+    } else if (x <= 3.0) {
+        y0 = x - 2.0;
+    } else {
+        y0 = 1.0 + (x - 3.0) * LEAKYNESS;
+    }
+
+    x *= 0.5;
+    x -= 0.5;
+    float y1 = 1.0;
+
+    if (x <= -2.0) {
+        y1 = LEAKYNESS * (x + 2.0);
+    } else if (x <= -1.5) {
+        float xPlus2 = x + 2.0;
+        y1 = 8.0 * (xPlus2 * xPlus2 * xPlus2 * xPlus2);
+    } else if (x <= -0.5) {
+        y1 = -8.0 * (x * x * x * x) - 32.0 * (x * x * x) - 48.0 * (x * x) - 32.0 * x - 7.0;
+    } else if (x <= 0.5) {
+        y1 = 8.0 * (x * x * x * x);
+    } else if (x <= 1.0) {
+        y1 = -8.0 * (x * x * x * x) + 32.0 * (x * x * x) - 48.0 * (x * x) + 32.0 * x - 7.0;
+    } else {
+        y1 = LEAKYNESS * (x - 1.0) + 1.0;
+    }
+
+    y1 = (y1 - 0.5) * 2.0;
+
+    c[idx] = y0 * FACTOR + (1.0 - FACTOR) * y1;
+"""
+
+INTERPOLATED_AMEO_GRAD_KERNEL_BODY = """
+    float x = a[idx];
+    float y0 = LEAKYNESS;
+    if (x <= -3.0) {
+        y0 = LEAKYNESS;
+    } else if (x <= -1.0) {
+        y0 = 1.0;
+    } else if (x <= 1.0) {
+        y0 = -1.0;
+    } else if (x <= 3.0) {
+        y0 = 1.0;
+    }
+
+    x *= 0.5;
+    x -= 0.5;
+    float y1 = 1.0;
+
+    if (x <= -2.0 || x >= 1.0) {
+        y1 = LEAKYNESS;
+    } else if (x <= -1.5) {
+        float xPlus2 = x + 2.0;
+        y1 = 32.0 * (xPlus2 * xPlus2 * xPlus2);
+    } else if (x <= -0.5) {
+        y1 = -32.0 * (x * x * x) - 96.0 * (x * x) - 96.0 * x - 32.0;
+    } else if (x <= 0.5) {
+        y1 = 32.0 * (x * x * x);
+    } else if (x <= 1.0) {
+        y1 = -32.0 * (x * x * x) + 96.0 * (x * x) - 96.0 * x + 32.0;
+    }
+
+    outbuf[idx] = (y0 * FACTOR + (1.0 - FACTOR) * y1) * grad_output[idx];
+"""
+
+
+def gpu_kernel_src(name: str, args: str, body: str) -> str:
+    return f"""
+    __kernel void {name}({", ".join(f"global float *{arg}" for arg in args.split(","))}) {{
+    int idx = get_global_id(0);
+    {body}
+    }}
+    """
+
+
+def clang_kernel_src(name: str, args: str, body: str, size: int) -> str:
+    # The clang runtime calls the kernel exactly once with no global size, so the kernel loops
+    # over every element itself.
+    return f"""
+    void {name}({", ".join(f"float *restrict {arg}" for arg in args.split(","))}) {{
+    for (int idx = 0; idx < {size}; idx++) {{
+    {body}
+    }}
+    }}
+    """
+
+
+_clang_runner_cache: Dict[str, ASTRunner] = {}
+
+
+def run_clang_kernel(name: str, src: str, ret: LazyBuffer, *inputs: LazyBuffer):
+    ret.realized = Device[ret.device].buffer(prod(ret.shape), ret.dtype)
+    # `ClangProgram` caches the compiled object on disk but reloads it on every build, so keep built
+    # runners around to avoid a `dlopen` for every activation call
+    runner = _clang_runner_cache.get(src)
+    if runner is None:
+        runner = ASTRunner(name, src, global_size=[prod(ret.shape)]).build(
+            Device[ret.device].runtime
+        )
+        _clang_runner_cache[src] = runner
+    runner.exec([ret, *inputs])
+    return ret.realized
+
+
+def select_kernel(device: str, kernels: Dict[str, Callable]) -> Callable:
+    kernel = kernels.get(device.split(":")[0])
+    if kernel is None:
+        raise NotImplementedError(
+            f"no ameo kernel for device {device}; supported devices: {', '.join(kernels.keys())}"
+        )
+    return kernel
+
+
 def mk_leaky_ameo_gpu(leakyness: float):
     def ameo_gpu(ret: LazyBuffer, x: LazyBuffer):
         assert x.device == "GPU", "gpu function requires GPUBuffers"
@@ -38,25 +199,7 @@ def mk_leaky_ameo_gpu(leakyness: float):
         ret.realized = Device[ret.device].buffer(prod(ret.shape), ret.dtype)
         ASTRunner(
             "ameo_gpu",
-            """
-        __kernel void ameo_gpu(global float *c, global float *a) {
-        int idx = get_global_id(0);
-        float x = a[idx];
-        float y = 1.0;
-        if (x <= -3.0) {
-            y = -1.0 + (x + 3.0) * LEAKYNESS;
-        } else if (x <= -1.0) {
-            y = x + 2.0;
-        } else if (x <= 1.0) {
-            y = -x;
-        } else if (x <= 3.0) {
-            y = x - 2.0;
-        } else {
-            y = 1.0 + (x - 3.0) * LEAKYNESS;
-        }
-        c[idx] = y;
-        }
-        """.replace(
+            gpu_kernel_src("ameo_gpu", "c,a", LEAKY_AMEO_KERNEL_BODY).replace(
                 "LEAKYNESS", str(leakyness)
             ),
             global_size=[prod(ret.shape)],
@@ -75,25 +218,9 @@ def mk_leaky_ameo_grad_gpu(leakyness: float):
         ret.realized = Device[ret.device].buffer(prod(ret.shape), ret.dtype)
         ASTRunner(
             "ameo_grad_gpu",
-            """
-        __kernel void ameo_grad_gpu(global float *outbuf, global float *a, global float *grad_output) {
-          int idx = get_global_id(0);
-          float x = a[idx];
-          float y = LEAKYNESS;
-          if (x <= -3.0) {
-            y = LEAKYNESS;
-          } else if (x <= -1.0) {
-            y = 1.0;
-          } else if (x <= 1.0) {
-            y = -1.0;
-          } else if (x <= 3.0) {
-            y = 1.0;
-          }
-          outbuf[idx] = y * grad_output[idx];
-        }
-        """.replace(
-                "LEAKYNESS", str(leakyness)
-            ),
+            gpu_kernel_src(
+                "ameo_grad_gpu", "outbuf,a,grad_output", LEAKY_AMEO_GRAD_KERNEL_BODY
+            ).replace("LEAKYNESS", str(leakyness)),
             global_size=[prod(ret.shape)],
         ).build(Device[ret.device].runtime).exec([ret, x, grad_output])
         return ret.realized
@@ -101,6 +228,57 @@ def mk_leaky_ameo_grad_gpu(leakyness: float):
     return leaky_ameo_grad_gpu
 
 
+def mk_leaky_ameo_clang(leakyness: float):
+    def ameo_clang(ret: LazyBuffer, x: LazyBuffer):
+        assert x.device == "CLANG", "clang function requires ClangBuffers"
+        assert x.dtype == dtypes.float32, "clang function only supports float32"
+        src = clang_kernel_src("ameo_clang", "c,a", LEAKY_AMEO_KERNEL_BODY, prod(ret.shape))
+        return run_clang_kernel("ameo_clang", src.replace("LEAKYNESS", str(leakyness)), ret, x)
+
+    return ameo_clang
+
+
+def mk_leaky_ameo_grad_clang(leakyness: float):
+    def leaky_ameo_grad_clang(ret: LazyBuffer, x: LazyBuffer, grad_output: LazyBuffer):
+        assert (
+            x.device == "CLANG" and grad_output.device == "CLANG"
+        ), "clang function requires ClangBuffers"
+        assert (
+            x.dtype == dtypes.float32 and grad_output.dtype == dtypes.float32
+        ), "clang function only supports float32"
+        src = clang_kernel_src(
+            "ameo_grad_clang", "outbuf,a,grad_output", LEAKY_AMEO_GRAD_KERNEL_BODY, prod(ret.shape)
+        )
+        return run_clang_kernel(
+            "ameo_grad_clang", src.replace("LEAKYNESS", str(leakyness)), ret, x, grad_output
+        )
+
+    return leaky_ameo_grad_clang
+
+
+def mk_leaky_ameo_cpu(leakyness: float):
+    def ameo_cpu(ret: LazyBuffer, x: LazyBuffer):
+        assert x.device == "CPU", "cpu function requires CPUBuffers"
+        assert x.dtype == dtypes.float32, "cpu function only supports float32"
+        a = x.realized.toCPU().reshape(ret.shape)
+        return Device[ret.device].buffer.fromCPU(leaky_ameo_np(a, leakyness))
+
+    return ameo_cpu
+
+
+def mk_leaky_ameo_grad_cpu(leakyness: float):
+    def leaky_ameo_grad_cpu(ret: LazyBuffer, x: LazyBuffer, grad_output: LazyBuffer):
+        assert x.device == "CPU" and grad_output.device == "CPU", "cpu function requires CPUBuffers"
+        assert (
+            x.dtype == dtypes.float32 and grad_output.dtype == dtypes.float32
+        ), "cpu function only supports float32"
+        a = x.realized.toCPU().reshape(ret.shape)
+        g = grad_output.realized.toCPU().reshape(ret.shape)
+        return Device[ret.device].buffer.fromCPU(leaky_ameo_grad_np(a, g, leakyness))
+
+    return leaky_ameo_grad_cpu
+
+
 def mk_leaky_ameo(leakyness: float = 0.1) -> Function:
     class LeakyAmeo(Function):
         def forward(self, x: LazyBuffer) -> LazyBuffer:
@@ -108,7 +286,14 @@ def mk_leaky_ameo(leakyness: float = 0.1) -> Function:
             ast = LazyOp(
                 LoadOps.CUSTOM,
                 (x.contiguous(),),
-                {"GPU": mk_leaky_ameo_gpu(leakyness)}[x.device],
+                select_kernel(
+                    x.device,
+                    {
+                        "GPU": mk_leaky_ameo_gpu(leakyness),
+                        "CLANG": mk_leaky_ameo_clang(leakyness),
+                        "CPU": mk_leaky_ameo_cpu(leakyness),
+                    },
+                ),
             )
             return create_lazybuffer(x.device, ShapeTracker(x.shape), LoadOps, ast, x.dtype)
 
@@ -123,7 +308,14 @@ def mk_leaky_ameo(leakyness: float = 0.1) -> Function:
             ast = LazyOp(
                 LoadOps.CUSTOM,
                 (self.x.contiguous(), grad.contiguous()),
-                {"GPU": mk_leaky_ameo_grad_gpu(leakyness)}[self.x.device],
+                select_kernel(
+                    self.x.device,
+                    {
+                        "GPU": mk_leaky_ameo_grad_gpu(leakyness),
+                        "CLANG": mk_leaky_ameo_grad_clang(leakyness),
+                        "CPU": mk_leaky_ameo_grad_cpu(leakyness),
+                    },
+                ),
             )
             return create_lazybuffer(
                 self.x.device,
@@ -143,53 +335,9 @@ def mk_interpolated_ameo_gpu(factor: float, leakyness: float):
         ret.realized = Device[ret.device].buffer(prod(ret.shape), ret.dtype)
         ASTRunner(
             "interpolated_ameo_gpu",
-            """
-        __kernel void interpolated_ameo_gpu(global float *c, global float *a) {
-            int idx = get_global_id(0);
-            float x = a[idx];
-
-            float y0 = 1.0;
-            if (x <= -3.0) {
-                y0 = -1.0 + (x + 3.0) * LEAKYNESS;
-            } else if (x <= -1.0) {
-                y0 = x + 2.0;
-            } else if (x <= 1.0) {
-                y0 = -x;
-            } else if (x <= 3.0) {
-                y0 = x - 2.0;
-            } else {
-                y0 = 1.0 + (x - 3.0) * LEAKYNESS;
-            }
-
-            x *= 0.5;
-            x -= 0.5;
-            float y1 = 1.0;
-
-            if (x <= -2.0) {
-                y1 = LEAKYNESS * (x + 2.0);
-            } else if (x <= -1.5) {
-                float xPlus2 = x + 2.0;
-                y1 = 8.0 * (xPlus2 * xPlus2 * xPlus2 * xPlus2);
-            } else if (x <= -0.5) {
-                y1 = -8.0 * (x * x * x * x) - 32.0 * (x * x * x) - 48.0 * (x * x) - 32.0 * x - 7.0;
-            } else if (x <= 0.5) {
-                y1 = 8.0 * (x * x * x * x);
-            } else if (x <= 1.0) {
-                y1 = -8.0 * (x * x * x * x) + 32.0 * (x * x * x) - 48.0 * (x * x) + 32.0 * x - 7.0;
-            } else {
-                y1 = LEAKYNESS * (x - 1.0) + 1.0;
-            }
-
-            y1 = (y1 - 0.5) * 2.0;
-
-
-            c[idx] = y0 * FACTOR + (1.0 - FACTOR) * y1;
-        }
-        """.replace(
-                "LEAKYNESS", str(leakyness)
-            ).replace(
-                "FACTOR", str(factor)
-            ),
+            gpu_kernel_src("interpolated_ameo_gpu", "c,a", INTERPOLATED_AMEO_KERNEL_BODY)
+            .replace("LEAKYNESS", str(leakyness))
+            .replace("FACTOR", str(factor)),
             global_size=[prod(ret.shape)],
         ).build(Device[ret.device].runtime).exec([ret, x])
         return ret.realized
@@ -206,45 +354,13 @@ def mk_interpolated_ameo_grad_gpu(factor: float, leakyness: float):
         ret.realized = Device[ret.device].buffer(prod(ret.shape), ret.dtype)
         ASTRunner(
             "interpolated_ameo_grad_gpu",
-            """
-        __kernel void interpolated_ameo_grad_gpu(global float *outbuf, global float *a, global float *grad_output) {
-            int idx = get_global_id(0);
-            float x = a[idx];
-            float y0 = LEAKYNESS;
-            if (x <= -3.0) {
-            y0 = LEAKYNESS;
-            } else if (x <= -1.0) {
-            y0 = 1.0;
-            } else if (x <= 1.0) {
-            y0 = -1.0;
-            } else if (x <= 3.0) {
-            y0 = 1.0;
-            }
-
-            x *= 0.5;
-            x -= 0.5;
-            float y1 = 1.0;
-
-            if (x <= -2.0 || x >= 1.0) {
-                y1 = LEAKYNESS;
-            } else if (x <= -1.5) {
-                float xPlus2 = x + 2.0;
-                y1 = 32.0 * (xPlus2 * xPlus2 * xPlus2);
-            } else if (x <= -0.5) {
-                y1 = -32.0 * (x * x * x) - 96.0 * (x * x) - 96.0 * x - 32.0;
-            } else if (x <= 0.5) {
-                y1 = 32.0 * (x * x * x);
-            } else if (x <= 1.0) {
-                y1 = -32.0 * (x * x * x) + 96.0 * (x * x) - 96.0 * x + 32.0;
-            }
-
-            outbuf[idx] = (y0 * FACTOR + (1.0 - FACTOR) * y1) * grad_output[idx];
-        }
-        """.replace(
-                "LEAKYNESS", str(leakyness)
-            ).replace(
-                "FACTOR", str(factor)
-            ),
+            gpu_kernel_src(
+                "interpolated_ameo_grad_gpu",
+                "outbuf,a,grad_output",
+                INTERPOLATED_AMEO_GRAD_KERNEL_BODY,
+            )
+            .replace("LEAKYNESS", str(leakyness))
+            .replace("FACTOR", str(factor)),
             global_size=[prod(ret.shape)],
         ).build(Device[ret.device].runtime).exec([ret, x, grad_output])
         return ret.realized
@@ -252,6 +368,68 @@ def mk_interpolated_ameo_grad_gpu(factor: float, leakyness: float):
     return interpolated_ameo_grad_gpu
 
 
+def mk_interpolated_ameo_clang(factor: float, leakyness: float):
+    def interpolated_ameo_clang(ret: LazyBuffer, x: LazyBuffer):
+        assert x.device == "CLANG", "clang function requires ClangBuffers"
+        assert x.dtype == dtypes.float32, "clang function only supports float32"
+        src = (
+            clang_kernel_src(
+                "interpolated_ameo_clang", "c,a", INTERPOLATED_AMEO_KERNEL_BODY, prod(ret.shape)
+            )
+            .replace("LEAKYNESS", str(leakyness))
+            .replace("FACTOR", str(factor))
+        )
+        return run_clang_kernel("interpolated_ameo_clang", src, ret, x)
+
+    return interpolated_ameo_clang
+
+
+def mk_interpolated_ameo_grad_clang(factor: float, leakyness: float):
+    def interpolated_ameo_grad_clang(ret: LazyBuffer, x: LazyBuffer, grad_output: LazyBuffer):
+        assert (
+            x.device == "CLANG" and grad_output.device == "CLANG"
+        ), "clang function requires ClangBuffers"
+        assert (
+            x.dtype == dtypes.float32 and grad_output.dtype == dtypes.float32
+        ), "clang function only supports float32"
+        src = (
+            clang_kernel_src(
+                "interpolated_ameo_grad_clang",
+                "outbuf,a,grad_output",
+                INTERPOLATED_AMEO_GRAD_KERNEL_BODY,
+                prod(ret.shape),
+            )
+            .replace("LEAKYNESS", str(leakyness))
+            .replace("FACTOR", str(factor))
+        )
+        return run_clang_kernel("interpolated_ameo_grad_clang", src, ret, x, grad_output)
+
+    return interpolated_ameo_grad_clang
+
+
+def mk_interpolated_ameo_cpu(factor: float, leakyness: float):
+    def interpolated_ameo_cpu(ret: LazyBuffer, x: LazyBuffer):
+        assert x.device == "CPU", "cpu function requires CPUBuffers"
+        assert x.dtype == dtypes.float32, "cpu function only supports float32"
+        a = x.realized.toCPU().reshape(ret.shape)
+        return Device[ret.device].buffer.fromCPU(interpolated_ameo_np(a, factor, leakyness))
+
+    return interpolated_ameo_cpu
+
+
+def mk_interpolated_ameo_grad_cpu(factor: float, leakyness: float):
+    def interpolated_ameo_grad_cpu(ret: LazyBuffer, x: LazyBuffer, grad_output: LazyBuffer):
+        assert x.device == "CPU" and grad_output.device == "CPU", "cpu function requires CPUBuffers"
+        assert (
+            x.dtype == dtypes.float32 and grad_output.dtype == dtypes.float32
+        ), "cpu function only supports float32"
+        a = x.realized.toCPU().reshape(ret.shape)
+        g = grad_output.realized.toCPU().reshape(ret.shape)
+        return Device[ret.device].buffer.fromCPU(interpolated_ameo_grad_np(a, g, factor, leakyness))
+
+    return interpolated_ameo_grad_cpu
+
+
 def mk_interpolated_ameo(factor: float, leakyness: float = 0.1) -> Function:
     class InterpolatedAmeo(Function):
         def forward(self, x: LazyBuffer) -> LazyBuffer:
@@ -259,7 +437,14 @@ def mk_interpolated_ameo(factor: float, leakyness: float = 0.1) -> Function:
             ast = LazyOp(
                 LoadOps.CUSTOM,
                 (x.contiguous(),),
-                {"GPU": mk_interpolated_ameo_gpu(factor, leakyness)}[x.device],
+                select_kernel(
+                    x.device,
+                    {
+                        "GPU": mk_interpolated_ameo_gpu(factor, leakyness),
+                        "CLANG": mk_interpolated_ameo_clang(factor, leakyness),
+                        "CPU": mk_interpolated_ameo_cpu(factor, leakyness),
+                    },
+                ),
             )
             return create_lazybuffer(x.device, ShapeTracker(x.shape), LoadOps, ast, x.dtype)
 
@@ -274,7 +459,14 @@ def mk_interpolated_ameo(factor: float, leakyness: float = 0.1) -> Function:
             ast = LazyOp(
                 LoadOps.CUSTOM,
                 (self.x.contiguous(), grad.contiguous()),
-                {"GPU": mk_interpolated_ameo_grad_gpu(factor, leakyness)}[self.x.device],
+                select_kernel(
+                    self.x.device,
+                    {
+                        "GPU": mk_interpolated_ameo_grad_gpu(factor, leakyness),
+                        "CLANG": mk_interpolated_ameo_grad_clang(factor, leakyness),
+                        "CPU": mk_interpolated_ameo_grad_cpu(factor, leakyness),
+                    },
+                ),
             )
             return create_lazybuffer(
                 self.x.device,
@@ -0,0 +1,75 @@
+import numpy as np
+
+
+def leaky_ameo_np(x: np.ndarray, leakyness: float) -> np.ndarray:
+    x = np.asarray(x, dtype=np.float32)
+    y = np.select(
+        [x <= -3.0, x <= -1.0, x <= 1.0, x <= 3.0],
+        [-1.0 + (x + 3.0) * leakyness, x + 2.0, -x, x - 2.0],
+        1.0 + (x - 3.0) * leakyness,
+    )
+    return y.astype(np.float32, copy=False)
+
+
+def leaky_ameo_grad_np(x: np.ndarray, grad_output: np.ndarray, leakyness: float) -> np.ndarray:
+    x = np.asarray(x, dtype=np.float32)
+    y = np.select(
+        [x <= -3.0, x <= -1.0, x <= 1.0, x <= 3.0],
+        [leakyness, 1.0, -1.0, 1.0],
+        leakyness,
+    )
+    return (y * grad_output).astype(np.float32, copy=False)
+
+
+def interpolated_ameo_np(x: np.ndarray, factor: float, leakyness: float) -> np.ndarray:
+    x = np.asarray(x, dtype=np.float32)
+    y0 = leaky_ameo_np(x, leakyness)
+
+    x = x * 0.5 - 0.5
+    x2 = x * x
+    x3 = x2 * x
+    x4 = x2 * x2
+    x_plus_2 = x + 2.0
+    y1 = np.select(
+        [x <= -2.0, x <= -1.5, x <= -0.5, x <= 0.5, x <= 1.0],
+        [
+            leakyness * x_plus_2,
+            8.0 * (x_plus_2 * x_plus_2 * x_plus_2 * x_plus_2),
+            -8.0 * x4 - 32.0 * x3 - 48.0 * x2 - 32.0 * x - 7.0,
+            8.0 * x4,
+            -8.0 * x4 + 32.0 * x3 - 48.0 * x2 + 32.0 * x - 7.0,
+        ],
+        leakyness * (x - 1.0) + 1.0,
+    )
+    y1 = (y1 - 0.5) * 2.0
+
+    return (y0 * factor + (1.0 - factor) * y1).astype(np.float32, copy=False)
+
+
+def interpolated_ameo_grad_np(
+    x: np.ndarray, grad_output: np.ndarray, factor: float, leakyness: float
+) -> np.ndarray:
+    x = np.asarray(x, dtype=np.float32)
+    y0 = np.select(
+        [x <= -3.0, x <= -1.0, x <= 1.0, x <= 3.0],
+        [leakyness, 1.0, -1.0, 1.0],
+        leakyness,
+    )
+
+    x = x * 0.5 - 0.5
+    x2 = x * x
+    x3 = x2 * x
+    x_plus_2 = x + 2.0
+    y1 = np.select(
+        [(x <= -2.0) | (x >= 1.0), x <= -1.5, x <= -0.5, x <= 0.5, x <= 1.0],
+        [
+            leakyness,
+            32.0 * (x_plus_2 * x_plus_2 * x_plus_2),
+            -32.0 * x3 - 96.0 * x2 - 96.0 * x - 32.0,
+            32.0 * x3,
+            -32.0 * x3 + 96.0 * x2 - 96.0 * x + 32.0,
+        ],
+        1.0,
+    )
+
+    return ((y0 * factor + (1.0 - factor) * y1) * grad_output).astype(np.float32, copy=False)
@@ -0,0 +1,248 @@
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+from tinygrad.lazy import Device
+from tinygrad.tensor import Tensor
+
+from objective import build_objective
+from run_config import load_run_config
+from trainer import Trainer
+from validate import run_validation
+
+CONFIGS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "configs")
+
+# Cell stacks to benchmark, by name.  `4x2` is the default run in `driver.py` and `16x10x2` is the
+# gated FSM run from `notes.txt`.
+CELL_STACKS = {
+    "4x2": os.path.join(CONFIGS_DIR, "replace_1_to_111.yaml"),
+    "16x10x2": os.path.join(CONFIGS_DIR, "gated_fsm_16x10.yaml"),
+}
+
+# Activations to run every cell with; `config` keeps whatever the config uses
+ACTIVATIONS: Dict[str, Any] = {
+    "config": None,
+    "tanh": "tanh",
+    "leaky_ameo": {"id": "leaky_ameo", "leakyness": 0.01},
+    "interpolated_ameo": {"id": "interpolated_ameo", "factor": 0.5, "leakyness": 0.01},
+}
+
+PHASES = ["data", "forward", "train", "validate"]
+
+
+def peak_rss_mb() -> float:
+    # `ru_maxrss` is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def time_calls(
+    fn: Callable[[], Any], iterations: int, warmup: int, sequences_per_call: int
+) -> Dict[str, Any]:
+    """
+    Calls `fn` `warmup` times untimed and then `iterations` times timed, returning throughput and
+    latency stats
+    """
+    for _ in range(warmup):
+        fn()
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - start)
+
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "sequences_per_sec": sequences_per_call * iterations / sum(latencies),
+        "latency_ms": {
+            "mean": float(latencies_ms.mean()),
+            "p50": float(np.percentile(latencies_ms, 50)),
+            "p90": float(np.percentile(latencies_ms, 90)),
+            "p99": float(np.percentile(latencies_ms, 99)),
+            "max": float(latencies_ms.max()),
+        },
+    }
+
+
+def build_case_config(case: Dict[str, Any]) -> Dict[str, Any]:
+    overrides = [
+        f"batch_size={case['batch_size']}",
+        f"seq_len={case['seq_len']}",
+        # Each benchmarked batch is trained as one step
+        "tbptt_chunk_len=null",
+    ]
+    config = load_run_config(CELL_STACKS[case["cells"]], overrides)
+    activation = ACTIVATIONS[case["activation"]]
+    if activation is not None:
+        for cell in config["cells"]:
+            cell["output_activation"] = activation
+            cell["recurrent_activation"] = activation
+    return config
+
+
+def run_case(case: Dict[str, Any], phases: List[str], iterations: int, warmup: int):
+    """
+    Benchmarks one point of the matrix.  Meant to be run in its own process so that its peak
+    memory usage and JIT state are independent of every other case.
+    """
+    config = build_case_config(case)
+    batch_size, seq_len = case["batch_size"], case["seq_len"]
+    np.random.seed(config["seed"])
+    Tensor.manual_seed(config["seed"])
+
+    objective = build_objective(config["objective"])
+    trainer = Trainer(config, objective)
+    x, y = objective.one_batch_examples(batch_size, seq_len)
+    result = {**case, "baseline_rss_mb": peak_rss_mb(), "phases": {}}
+
+    if "data" in phases:
+        result["phases"]["data"] = time_calls(
+            lambda: objective.one_batch_examples(batch_size, seq_len),
+            iterations,
+            warmup,
+            batch_size,
+        )
+    if "forward" in phases:
+        result["phases"]["forward"] = time_calls(
+            lambda: trainer.forward(Tensor(x)).numpy(), iterations, warmup, batch_size
+        )
+    if "train" in phases:
+        train_one_batch = trainer.mk_train_one_batch()
+        # The first calls run and capture the jitted step, so there are always enough warmup
+        # calls for the timed ones to be replays
+        result["phases"]["train"] = time_calls(
+            lambda: train_one_batch(Tensor(x), Tensor(y)).numpy(),
+            iterations,
+            max(warmup, 2),
+            batch_size,
+        )
+    if "validate" in phases:
+        # One validation run over `iterations` batches, reported per batch
+        start = time.perf_counter()
+        run_validation(
+            objective.one_batch_examples,
+            trainer.forward,
+            seq_len,
+            test_count=batch_size * iterations,
+            batch_size=batch_size,
+        )
+        elapsed = time.perf_counter() - start
+        result["phases"]["validate"] = {
+            "sequences_per_sec": batch_size * iterations / elapsed,
+            "latency_ms": {"mean": elapsed * 1000 / iterations},
+        }
+
+    result["peak_rss_mb"] = peak_rss_mb()
+    return result
+
+
+def run_case_worker(conn, case: Dict[str, Any], *args):
+    try:
+        conn.send(run_case(case, *args))
+    except Exception as e:
+        conn.send({**case, "error": repr(e)})
+
+
+def run_case_in_process(case: Dict[str, Any], *args) -> Dict[str, Any]:
+    recv_conn, send_conn = multiprocessing.Pipe(duplex=False)
+    proc = multiprocessing.Process(target=run_case_worker, args=(send_conn, case, *args))
+    proc.start()
+    # Otherwise the pipe stays open in this process and `recv` never sees EOF if the child dies
+    send_conn.close()
+    try:
+        result = recv_conn.recv()
+    except EOFError:
+        # Killed (e.g. by the OOM killer) or crashed before it could send a result
+        proc.join()
+        return {**case, "error": f"exit code {proc.exitcode}"}
+    proc.join()
+    return result
+
+
+def get_environment() -> Dict[str, Any]:
+    try:
+        commit: Optional[str] = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "commit": commit,
+        "device": Device.DEFAULT,
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def parse_list(value: str, cast=str) -> List[Any]:
+    return [cast(item) for item in value.split(",") if item]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark data generation, inference, training, and validation throughput "
+        "across a matrix of model and batch shapes"
+    )
+    parser.add_argument("--batch-sizes", default="256,1024")
+    parser.add_argument("--seq-lens", default="20,40")
+    parser.add_argument(
+        "--cells", default=",".join(CELL_STACKS), help=f"any of {', '.join(CELL_STACKS)}"
+    )
+    parser.add_argument("--activations", default="config", help=f"any of {', '.join(ACTIVATIONS)}")
+    parser.add_argument("--phases", default=",".join(PHASES), help=f"any of {', '.join(PHASES)}")
+    parser.add_argument("--iterations", type=int, default=10, help="timed calls per phase")
+    parser.add_argument("--warmup", type=int, default=3, help="untimed calls before timing")
+    parser.add_argument("--output", help="path to write the JSON results to; printed if unset")
+    args = parser.parse_args()
+
+    phases = parse_list(args.phases)
+    for phase in phases:
+        if phase not in PHASES:
+            raise ValueError(f"Unknown phase: {phase}")
+    cases = [
+        {"batch_size": batch_size, "seq_len": seq_len, "cells": cells, "activation": activation}
+        for batch_size, seq_len, cells, activation in itertools.product(
+            parse_list(args.batch_sizes, int),
+            parse_list(args.seq_lens, int),
+            parse_list(args.cells),
+            parse_list(args.activations),
+        )
+    ]
+    for case in cases:
+        if case["cells"] not in CELL_STACKS:
+            raise ValueError(f"Unknown cell stack: {case['cells']}")
+        if case["activation"] not in ACTIVATIONS:
+            raise ValueError(f"Unknown activation: {case['activation']}")
+
+    results = []
+    for case_ix, case in enumerate(cases):
+        result = run_case_in_process(case, phases, args.iterations, args.warmup)
+        results.append(result)
+        summary = ", ".join(
+            f"{phase}: {stats['sequences_per_sec']:.0f} seq/s"
+            for phase, stats in result.get("phases", {}).items()
+        )
+        print(f"[{case_ix + 1}/{len(cases)}] {case}: {result.get('error', summary)}")
+
+    output = {"environment": get_environment(), "results": results}
+    if args.output is None:
+        print(json.dumps(output, indent=2))
+    else:
+        with open(args.output, "wt") as f:
+            json.dump(output, f, indent=2)
+        print(f"Saved results to {args.output}")
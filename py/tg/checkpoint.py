@@ -0,0 +1,210 @@
+import glob
+import os
+import queue
+import threading
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+from tinygrad.nn import Linear
+from tinygrad.nn.optim import LAMB
+from tinygrad.tensor import Tensor
+
+from checkpoint_format import load_arrays, save_arrays, split_model_arrays
+from custom_rnn import CustomRNN
+
+
+def get_named_tensors(
+    rnn: CustomRNN, post_layers: List[Tuple[Linear, Union[str, Dict[str, Any]]]]
+) -> Tuple[Dict[str, Any], Dict[str, Tensor]]:
+    """
+    Returns the model description stored in checkpoints along with every weight tensor of the
+    model keyed by the name it's stored under
+    """
+    tensors: Dict[str, Tensor] = {}
+    model = split_model_arrays(rnn.get_weights_dict(post_layers, lambda t: t), tensors)
+    return model, tensors
+
+
+def snapshot_training_state(
+    rnn: CustomRNN,
+    post_layers: List[Tuple[Linear, Union[str, Dict[str, Any]]]],
+    opt: LAMB,
+    step: int,
+    schedule: Dict[str, Any],
+    losses: Optional[np.ndarray] = None,
+) -> Tuple[Dict[str, np.ndarray], Dict[str, Any]]:
+    """
+    Copies everything needed to resume training into host memory, returning the `(arrays,
+    metadata)` to write with `save_arrays`: the weights, the Adam moments and step count, the
+    current learning rate, the global NumPy and tinygrad RNG state, and optionally the loss
+    history.
+
+    `schedule` holds any other training state that changes over the course of a run, such as the
+    regularizer intensity.  The model is also described in the metadata, so it can be exported as
+    JSON for the web viewer with `checkpoint_format.py`.
+    """
+    model, tensors = get_named_tensors(rnn, post_layers)
+    # Copied since the arrays returned by `numpy()` may share memory with device buffers that keep
+    # getting updated while a checkpoint is being written in the background
+    arrays = {name: t.numpy().copy() for name, t in tensors.items()}
+
+    names_by_tensor = {id(t): name for name, t in tensors.items()}
+    for param, m, v in zip(opt.params, opt.m, opt.v):
+        if id(param) not in names_by_tensor:
+            raise ValueError(f"Optimizer param with shape {param.shape} is not part of the model")
+        name = names_by_tensor[id(param)]
+        arrays[f"adam.m.{name}"] = m.numpy().copy()
+        arrays[f"adam.v.{name}"] = v.numpy().copy()
+    arrays["adam.t"] = opt.t.numpy().copy()
+    arrays["adam.lr"] = opt.lr.numpy().copy()
+
+    np_rng_state = np.random.get_state(legacy=False)
+    arrays["rng.numpy.key"] = np_rng_state["state"]["key"]
+    if losses is not None:
+        arrays["losses"] = np.array(losses, dtype=np.float32)
+
+    metadata = {
+        "model": model,
+        "step": step,
+        "schedule": schedule,
+        "rng": {
+            "numpy_pos": np_rng_state["state"]["pos"],
+            "numpy_has_gauss": np_rng_state["has_gauss"],
+            "numpy_gauss": np_rng_state["gauss"],
+            "tinygrad_seed": Tensor._seed,
+        },
+    }
+    return arrays, metadata
+
+
+def save_training_checkpoint(
+    path: str,
+    rnn: CustomRNN,
+    post_layers: List[Tuple[Linear, Union[str, Dict[str, Any]]]],
+    opt: LAMB,
+    step: int,
+    schedule: Dict[str, Any],
+    losses: Optional[np.ndarray] = None,
+):
+    """
+    Saves the state returned by `snapshot_training_state` to a binary checkpoint at `path`
+    """
+    save_arrays(path, *snapshot_training_state(rnn, post_layers, opt, step, schedule, losses))
+
+
+def checkpoint_path(checkpoint_dir: str, step: int) -> str:
+    return os.path.join(checkpoint_dir, f"checkpoint-{step:08d}.bin")
+
+
+def list_checkpoints(checkpoint_dir: str) -> List[str]:
+    """
+    Returns the paths of the checkpoints in `checkpoint_dir`, oldest first
+    """
+    return sorted(glob.glob(os.path.join(checkpoint_dir, "checkpoint-*.bin")))
+
+
+def latest_checkpoint(checkpoint_dir: str) -> Optional[str]:
+    checkpoints = list_checkpoints(checkpoint_dir)
+    return checkpoints[-1] if checkpoints else None
+
+
+class AsyncCheckpointer:
+    """
+    Writes checkpoints to `checkpoint_dir` on a background thread, keeping only the newest
+    `keep` of them.
+
+    The state is snapshotted into host memory on the caller's thread so that it's consistent, but
+    the training loop never waits on disk unless a write is already queued up behind another one.
+    """
+
+    def __init__(self, checkpoint_dir: str, keep=3):
+        if keep < 1:
+            raise ValueError(f"keep must be at least 1, got {keep}")
+        self.checkpoint_dir = checkpoint_dir
+        self.keep = keep
+        os.makedirs(checkpoint_dir, exist_ok=True)
+
+        self.pending: queue.Queue = queue.Queue(maxsize=1)
+        self.error: Optional[Exception] = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, step: int, arrays: Dict[str, np.ndarray], metadata: Dict[str, Any]):
+        if self.error is not None:
+            raise self.error
+        self.pending.put((step, arrays, metadata))
+
+    def run(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                return
+
+            step, arrays, metadata = item
+            try:
+                save_arrays(checkpoint_path(self.checkpoint_dir, step), arrays, metadata)
+                for path in list_checkpoints(self.checkpoint_dir)[: -self.keep]:
+                    os.remove(path)
+            except Exception as e:
+                self.error = e
+
+    def close(self):
+        """
+        Waits for any queued checkpoints to be written, re-raising the error if one failed
+        """
+        self.pending.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+
+def restore_training_checkpoint(
+    path: str,
+    rnn: CustomRNN,
+    post_layers: List[Tuple[Linear, Union[str, Dict[str, Any]]]],
+    opt: LAMB,
+) -> Tuple[Dict[str, Any], Dict[str, np.ndarray]]:
+    """
+    Loads a checkpoint written by `save_training_checkpoint` into an already constructed model and
+    optimizer with the same architecture, and restores the global RNG state.
+
+    Returns `(metadata, arrays)`, where `metadata` holds the `step` and `schedule` that were saved
+    and `arrays` holds the memory-mapped contents of the checkpoint, including `losses` if saved.
+    """
+    arrays, metadata = load_arrays(path)
+    _, tensors = get_named_tensors(rnn, post_layers)
+
+    def assign(t: Tensor, name: str):
+        if name not in arrays:
+            raise ValueError(f"Checkpoint at {path} is missing {name}")
+        arr = arrays[name]
+        if tuple(t.shape) != arr.shape:
+            raise ValueError(
+                f"Checkpoint has shape {arr.shape} for {name} but the model has {t.shape}"
+            )
+        # Copied so the model never ends up backed by the read-only memory-mapped file
+        t.assign(Tensor(np.array(arr))).realize()
+
+    for name, t in tensors.items():
+        assign(t, name)
+
+    names_by_tensor = {id(t): name for name, t in tensors.items()}
+    for param, m, v in zip(opt.params, opt.m, opt.v):
+        name = names_by_tensor[id(param)]
+        assign(m, f"adam.m.{name}")
+        assign(v, f"adam.v.{name}")
+    assign(opt.t, "adam.t")
+    assign(opt.lr, "adam.lr")
+
+    rng = metadata["rng"]
+    np.random.set_state(
+        {
+            "bit_generator": "MT19937",
+            "state": {"key": np.array(arrays["rng.numpy.key"]), "pos": rng["numpy_pos"]},
+            "has_gauss": rng["numpy_has_gauss"],
+            "gauss": rng["numpy_gauss"],
+        }
+    )
+    Tensor._seed = rng["tinygrad_seed"]
+
+    return metadata, arrays
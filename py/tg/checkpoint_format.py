@@ -0,0 +1,159 @@
+import argparse
+import json
+import mmap
+import os
+import struct
+from typing import Any, Dict, Tuple
+
+import numpy as np
+
+CHECKPOINT_FORMAT_VERSION = 1
+# Tensor data offsets are aligned to this many bytes so that every array can be viewed in place
+ALIGNMENT = 64
+
+# Fields of the weights format written by `CustomRNN.dump_weights` that hold weight tensors
+CELL_WEIGHT_KEYS = [
+    "output_kernel",
+    "output_bias",
+    "recurrent_kernel",
+    "recurrent_bias",
+    "initial_state",
+]
+POST_LAYER_WEIGHT_KEYS = ["weights", "bias"]
+
+
+def save_arrays(path: str, arrays: Dict[str, np.ndarray], metadata: Dict[str, Any]):
+    """
+    Writes named arrays to a single binary file along with JSON metadata.
+
+    The layout is similar to safetensors: an 8-byte little-endian header length, a JSON header
+    giving the dtype, shape, and offset of every array along with `metadata`, then the raw array
+    data.  The file is written to a temporary path first and then moved into place, so a reader
+    never sees a partially written checkpoint.
+    """
+    tensors = {}
+    offset = 0
+    for name, arr in arrays.items():
+        arr = np.ascontiguousarray(arr)
+        tensors[name] = {"dtype": arr.dtype.str, "shape": list(arr.shape), "offset": offset}
+        offset += -(-arr.nbytes // ALIGNMENT) * ALIGNMENT
+
+    header = json.dumps(
+        {"version": CHECKPOINT_FORMAT_VERSION, "tensors": tensors, "metadata": metadata}
+    ).encode("utf-8")
+    # Pad the header with spaces so that the data section starts aligned
+    header += b" " * (-(8 + len(header)) % ALIGNMENT)
+    data_start = 8 + len(header)
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        for name, arr in arrays.items():
+            f.seek(data_start + tensors[name]["offset"])
+            f.write(np.ascontiguousarray(arr).tobytes())
+        f.truncate(data_start + offset)
+    os.replace(tmp_path, path)
+
+
+def load_arrays(path: str) -> Tuple[Dict[str, np.ndarray], Dict[str, Any]]:
+    """
+    Loads a file written by `save_arrays`, returning `(arrays, metadata)`.  The arrays are read-only
+    views directly into the memory-mapped file, so nothing is read until it's used.
+    """
+    with open(path, "rb") as f:
+        (header_len,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_len))
+        if header["version"] != CHECKPOINT_FORMAT_VERSION:
+            raise ValueError(f"Unsupported checkpoint version {header['version']} at {path}")
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    data_start = 8 + header_len
+    arrays = {}
+    for name, info in header["tensors"].items():
+        dtype = np.dtype(info["dtype"])
+        arrays[name] = np.frombuffer(
+            buf,
+            dtype=dtype,
+            count=int(np.prod(info["shape"])),
+            offset=data_start + info["offset"],
+        ).reshape(info["shape"])
+    return arrays, header["metadata"]
+
+
+def split_model_arrays(weights: Dict[str, Any], arrays: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Moves the weights out of a model in the format returned by `CustomRNN.get_weights_dict` into
+    `arrays`, returning the rest of the model with each weight replaced by the name it's stored
+    under
+    """
+
+    def split(name: str, value):
+        if value is None:
+            return None
+        arrays[name] = value
+        return {"tensor": name}
+
+    model = {**weights, "cells": [], "post_layers": []}
+    for cell_ix, cell in enumerate(weights["cells"]):
+        model["cells"].append(
+            {
+                key: split(f"cells.{cell_ix}.{key}", value) if key in CELL_WEIGHT_KEYS else value
+                for key, value in cell.items()
+            }
+        )
+    for layer_ix, layer in enumerate(weights["post_layers"]):
+        model["post_layers"].append(
+            {
+                key: (
+                    split(f"post_layers.{layer_ix}.{key}", value)
+                    if key in POST_LAYER_WEIGHT_KEYS
+                    else value
+                )
+                for key, value in layer.items()
+            }
+        )
+    return model
+
+
+def join_model_arrays(model: Dict[str, Any], arrays: Dict[str, np.ndarray]) -> Dict[str, Any]:
+    """
+    Inverse of `split_model_arrays`, putting the arrays back into the model
+    """
+
+    def join(value):
+        if isinstance(value, dict) and "tensor" in value:
+            return arrays[value["tensor"]]
+        return value
+
+    return {
+        **model,
+        "cells": [{key: join(value) for key, value in cell.items()} for cell in model["cells"]],
+        "post_layers": [
+            {key: join(value) for key, value in layer.items()} for layer in model["post_layers"]
+        ],
+    }
+
+
+def load_model_weights(path: str) -> Dict[str, Any]:
+    """
+    Loads the model from a checkpoint in the format written by `CustomRNN.dump_weights`, but with
+    memory-mapped arrays in place of nested lists.  This can be passed directly to `NumpyRNN` or
+    `CustomRNN.from_weights_dict`.
+    """
+    arrays, metadata = load_arrays(path)
+    return join_model_arrays(metadata["model"], arrays)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Export the model in a binary checkpoint as JSON for the web viewer"
+    )
+    parser.add_argument("checkpoint")
+    parser.add_argument("output", help="path to write the weights JSON to")
+    args = parser.parse_args()
+
+    weights = load_model_weights(args.checkpoint)
+    with open(args.output, "wt") as f:
+        json.dump(weights, f, indent=2, default=lambda arr: arr.tolist())
+    print(f"Exported weights to {args.output}")
@@ -0,0 +1,115 @@
+import numpy as np
+from tinygrad.nn import Linear
+from tinygrad.nn.optim import Adam
+from tinygrad.tensor import Tensor
+
+from checkpoint import restore_training_checkpoint, save_training_checkpoint
+from checkpoint_format import ALIGNMENT, load_arrays, load_model_weights, save_arrays
+from custom_rnn import CustomRNN, CustomRNNCell
+
+
+def build_model(seed: int):
+    Tensor.manual_seed(seed)
+    cells = [
+        CustomRNNCell((1,), 4, 3, trainable_initial_weights=True, cell_ix=0),
+        CustomRNNCell((4,), 2, 2, trainable_initial_weights=True, cell_ix=1),
+    ]
+    rnn = CustomRNN(*cells)
+    dense = Linear(2, 1)
+    post_layers = [(dense, "linear")]
+    opt = Adam(rnn.get_trainable_params() + [dense.weight, dense.bias], 0.01)
+    return rnn, post_layers, opt
+
+
+def train_step(rnn: CustomRNN, post_layers, opt: Adam, x: np.ndarray, y: np.ndarray) -> float:
+    dense = post_layers[0][0]
+    loss = (dense(rnn(Tensor(x))) - Tensor(y)).pow(2).mean()
+    opt.zero_grad()
+    loss.backward()
+    opt.step()
+    return float(loss.numpy())
+
+
+def random_batch(rng: np.random.Generator):
+    x = rng.choice([-1.0, 1.0], size=(8, 5, 1)).astype(np.float32)
+    return x, np.roll(x, 1, axis=1)
+
+
+def test_arrays_round_trip(tmp_path):
+    path = str(tmp_path / "arrays.bin")
+    arrays = {
+        "scalar": np.array(3.5, dtype=np.float32),
+        "matrix": np.arange(12, dtype=np.float32).reshape(3, 4),
+        "odd_sized": np.arange(7, dtype=np.int64),
+        "key": np.arange(5, dtype=np.uint32),
+    }
+    save_arrays(path, arrays, {"step": 12, "nested": {"a": [1, 2]}})
+
+    loaded, metadata = load_arrays(path)
+    assert metadata == {"step": 12, "nested": {"a": [1, 2]}}
+    assert list(loaded.keys()) == list(arrays.keys())
+    for name, arr in arrays.items():
+        assert loaded[name].dtype == arr.dtype
+        np.testing.assert_array_equal(loaded[name], arr)
+        # Views into the mapped file, aligned so they can be used in place
+        assert not loaded[name].flags.writeable
+        assert loaded[name].__array_interface__["data"][0] % ALIGNMENT == 0
+
+
+def test_training_checkpoint_round_trip(tmp_path):
+    path = str(tmp_path / "checkpoint.bin")
+    rng = np.random.default_rng(0)
+    rnn, post_layers, opt = build_model(seed=1)
+    np.random.seed(2)
+    for _ in range(2):
+        train_step(rnn, post_layers, opt, *random_batch(rng))
+    losses = np.array([[0.5, 0.1], [0.4, 0.1]], dtype=np.float32)
+    save_training_checkpoint(path, rnn, post_layers, opt, 2, {"reg_intensity": 0.25}, losses)
+    expected_m = [m.numpy().copy() for m in opt.m]
+    expected_v = [v.numpy().copy() for v in opt.v]
+    expected_t = opt.t.numpy().copy()
+
+    # What the original run does next
+    expected_np_draw = np.random.random()
+    expected_tinygrad_draw = Tensor.rand(3).numpy()
+    next_batch = random_batch(rng)
+    expected_loss = train_step(rnn, post_layers, opt, *next_batch)
+
+    restored_rnn, restored_post_layers, restored_opt = build_model(seed=3)
+    metadata, arrays = restore_training_checkpoint(
+        path, restored_rnn, restored_post_layers, restored_opt
+    )
+    assert metadata["step"] == 2
+    assert metadata["schedule"] == {"reg_intensity": 0.25}
+    np.testing.assert_array_equal(arrays["losses"], losses)
+
+    for m, v, restored_m, restored_v in zip(expected_m, expected_v, restored_opt.m, restored_opt.v):
+        np.testing.assert_array_equal(restored_m.numpy(), m)
+        np.testing.assert_array_equal(restored_v.numpy(), v)
+    np.testing.assert_array_equal(restored_opt.t.numpy(), expected_t)
+    np.testing.assert_array_equal(restored_opt.lr.numpy(), opt.lr.numpy())
+
+    # Resuming continues exactly where the original run left off
+    assert np.random.random() == expected_np_draw
+    np.testing.assert_array_equal(Tensor.rand(3).numpy(), expected_tinygrad_draw)
+    assert train_step(restored_rnn, restored_post_layers, restored_opt, *next_batch) == (
+        expected_loss
+    )
+    for param, restored_param in zip(opt.params, restored_opt.params):
+        np.testing.assert_array_equal(param.numpy(), restored_param.numpy())
+
+
+def test_model_weights_match_json_export(tmp_path):
+    path = str(tmp_path / "checkpoint.bin")
+    rnn, post_layers, opt = build_model(seed=1)
+    save_training_checkpoint(path, rnn, post_layers, opt, 0, {})
+
+    expected = rnn.get_weights_dict(post_layers, lambda t: t.numpy().tolist())
+    weights = load_model_weights(path)
+    assert weights["input_dim"] == expected["input_dim"]
+    for cell, expected_cell in zip(weights["cells"], expected["cells"]):
+        for key, value in expected_cell.items():
+            if isinstance(value, list):
+                np.testing.assert_array_equal(cell[key], np.array(value, dtype=np.float32))
+            else:
+                assert cell[key] == value
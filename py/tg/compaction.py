@@ -0,0 +1,187 @@
+import argparse
+import json
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+from np_inference import to_array
+
+
+def to_list(arr: Optional[np.ndarray]):
+    if arr is None:
+        return None
+    return arr.tolist()
+
+
+def live_state_units(
+    output_kernel: np.ndarray,
+    recurrent_kernel: np.ndarray,
+    input_dim: int,
+    live_outputs: np.ndarray,
+) -> np.ndarray:
+    """
+    Finds the state units that can influence any live output of a cell, either directly or through
+    other state units over later timesteps.
+    """
+    state_reads_output = output_kernel[input_dim:][:, live_outputs] != 0
+    state_reads_state = recurrent_kernel[input_dim:] != 0
+
+    live_states = state_reads_output.any(axis=1)
+    while True:
+        next_live_states = live_states | state_reads_state[:, live_states].any(axis=1)
+        if (next_live_states == live_states).all():
+            return live_states
+        live_states = next_live_states
+
+
+def compact_weights(
+    data: Dict[str, Any], threshold: float
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Compacts a model in the format written by `CustomRNN.dump_weights`.
+
+    Kernel weights with a magnitude below `threshold` are set to zero.  Then every neuron and state
+    unit whose value can't reach the model's outputs through a nonzero weight is removed, along
+    with all of the weights attached to it.  Removing dead neurons doesn't change the outputs, so
+    pruning is the only source of error.  The model's input and output dims are left unchanged.
+
+    Returns the compacted model in the same format, so it can be exported to the web viewer or
+    loaded by `NumpyRNN`, along with some stats about what was removed.
+    """
+
+    def prune(kernel: np.ndarray) -> np.ndarray:
+        return np.where(np.abs(kernel) < threshold, 0.0, kernel).astype(np.float32)
+
+    cells = [
+        {
+            "output_kernel": prune(to_array(cell["output_kernel"])),
+            "output_bias": to_array(cell["output_bias"]),
+            "recurrent_kernel": (
+                prune(to_array(cell["recurrent_kernel"])) if cell["state_size"] > 0 else None
+            ),
+            "recurrent_bias": to_array(cell["recurrent_bias"]),
+            "initial_state": to_array(cell["initial_state"]),
+        }
+        for cell in data["cells"]
+    ]
+    # Post layer weights are stored as `(output_dim, input_dim)`
+    post_layers = [
+        {"weights": prune(to_array(layer["weights"])), "bias": to_array(layer["bias"])}
+        for layer in data["post_layers"]
+    ]
+    stats = {
+        "params_before": count_params(data),
+        "nonzero_weights_after_pruning": sum(
+            np.count_nonzero(cell[name])
+            for cell in cells
+            for name in ["output_kernel", "recurrent_kernel"]
+            if cell[name] is not None
+        )
+        + sum(np.count_nonzero(layer["weights"]) for layer in post_layers),
+    }
+
+    # Walk backwards from the model outputs, finding the live inputs of each layer from the live
+    # outputs that read them
+    live_outputs = np.ones(data["output_dim"], dtype=bool)
+    for layer in reversed(post_layers):
+        layer["weights"] = layer["weights"][live_outputs]
+        if layer["bias"] is not None:
+            layer["bias"] = layer["bias"][live_outputs]
+        live_inputs = (layer["weights"] != 0).any(axis=0)
+        layer["weights"] = layer["weights"][:, live_inputs]
+        live_outputs = live_inputs
+
+    for cell_ix in reversed(range(len(cells))):
+        cell = cells[cell_ix]
+        input_dim = data["input_dim"] if cell_ix == 0 else data["cells"][cell_ix - 1]["output_dim"]
+
+        output_kernel = cell["output_kernel"]
+        recurrent_kernel = cell["recurrent_kernel"]
+        if recurrent_kernel is None:
+            recurrent_kernel = np.zeros((output_kernel.shape[0], 0), dtype=np.float32)
+        live_states = live_state_units(output_kernel, recurrent_kernel, input_dim, live_outputs)
+
+        input_reads = (output_kernel[:input_dim][:, live_outputs] != 0).any(axis=1) | (
+            recurrent_kernel[:input_dim][:, live_states] != 0
+        ).any(axis=1)
+        # The model's own inputs are kept even if unused so that its interface doesn't change
+        live_inputs = input_reads if cell_ix > 0 else np.ones(input_dim, dtype=bool)
+        live_rows = np.concatenate([live_inputs, live_states])
+
+        cell["output_kernel"] = output_kernel[live_rows][:, live_outputs]
+        if cell["output_bias"] is not None:
+            cell["output_bias"] = cell["output_bias"][live_outputs]
+        if live_states.any():
+            cell["recurrent_kernel"] = recurrent_kernel[live_rows][:, live_states]
+            if cell["recurrent_bias"] is not None:
+                cell["recurrent_bias"] = cell["recurrent_bias"][live_states]
+            cell["initial_state"] = cell["initial_state"][live_states]
+        else:
+            cell["recurrent_kernel"] = None
+            cell["recurrent_bias"] = None
+            cell["initial_state"] = None
+
+        live_outputs = live_inputs
+
+    compacted = {
+        "input_dim": data["input_dim"],
+        "output_dim": data["output_dim"],
+        "cells": [
+            {
+                "state_size": 0 if cell["initial_state"] is None else len(cell["initial_state"]),
+                "output_dim": cell["output_kernel"].shape[1],
+                "output_kernel": to_list(cell["output_kernel"]),
+                "output_bias": to_list(cell["output_bias"]),
+                "recurrent_kernel": to_list(cell["recurrent_kernel"]),
+                "recurrent_bias": to_list(cell["recurrent_bias"]),
+                "initial_state": to_list(cell["initial_state"]),
+                "recurrent_activation": cell_data["recurrent_activation"],
+                "output_activation": cell_data["output_activation"],
+            }
+            for cell, cell_data in zip(cells, data["cells"])
+        ],
+        "post_layers": [
+            {
+                "input_dim": layer["weights"].shape[1],
+                "output_dim": layer["weights"].shape[0],
+                "weights": to_list(layer["weights"]),
+                "bias": to_list(layer["bias"]),
+                "activation": layer_data["activation"],
+            }
+            for layer, layer_data in zip(post_layers, data["post_layers"])
+        ],
+    }
+    stats["params_after"] = count_params(compacted)
+    stats["cell_dims_before"] = [(c["output_dim"], c["state_size"]) for c in data["cells"]]
+    stats["cell_dims_after"] = [(c["output_dim"], c["state_size"]) for c in compacted["cells"]]
+    return compacted, stats
+
+
+def count_params(data: Dict[str, Any]) -> int:
+    def size(values) -> int:
+        return 0 if values is None else np.size(values)
+
+    return sum(
+        size(cell[name])
+        for cell in data["cells"]
+        for name in ["output_kernel", "output_bias", "recurrent_kernel", "recurrent_bias"]
+    ) + sum(size(layer["weights"]) + size(layer["bias"]) for layer in data["post_layers"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Prune small weights and remove dead neurons from exported weights"
+    )
+    parser.add_argument("input", help="weights JSON written by `CustomRNN.dump_weights`")
+    parser.add_argument("output", help="path to write the compacted weights JSON to")
+    parser.add_argument("--threshold", type=float, default=0.01)
+    args = parser.parse_args()
+
+    with open(args.input, "rt") as f:
+        data = json.load(f)
+    compacted, stats = compact_weights(data, args.threshold)
+    with open(args.output, "wt") as f:
+        json.dump(compacted, f, indent=2)
+
+    for key, value in stats.items():
+        print(f"{key}: {value}")
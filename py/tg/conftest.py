@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Modules here import each other by bare name, as they do when run as scripts from this directory
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
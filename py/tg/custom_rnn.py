@@ -155,6 +155,10 @@ class CustomRNNCell:
         if self.initial_state is not None and not self.trainable_initial_weights:
             self.initial_state.requires_grad = False
 
+        # When both activations are the same, the output and recurrent kernels can be applied as a
+        # single matmul + activation over their concatenation, with the result split afterwards.
+        self.can_fuse = self.state_size > 0 and output_activation_id == recurrent_activation_id
+
     def add_weight(
         self,
         shape,
@@ -167,12 +171,39 @@ class CustomRNNCell:
             self.trainable_weights.append(t)
         return t
 
-    def __call__(self, inputs: Tensor, prev_state: Tensor):
+    def get_fused_params(self) -> Tuple[Tensor, Optional[Tensor]]:
+        """
+        Returns the output and recurrent kernels and biases concatenated along the output axis.
+
+        This should be computed once per sequence rather than once per timestep.  Gradients flow
+        back through the concatenation to the separate weights, so those stay the source of truth
+        for the optimizer, regularizers, and `dump_weights`.
+        """
+        kernel = self.output_kernel.cat(self.recurrent_kernel, dim=1)
+        bias = (
+            self.output_bias.cat(self.recurrent_bias, dim=0)
+            if self.output_bias is not None
+            else None
+        )
+        return kernel, bias
+
+    def __call__(
+        self,
+        inputs: Tensor,
+        prev_state: Tensor,
+        fused_params: Optional[Tuple[Tensor, Optional[Tensor]]] = None,
+    ):
         if prev_state is not None and len(prev_state.shape) == 1:
             raise "prev_state must be a batch of states"
             # prev_state = prev_state.unsqueeze(0).repeat([inputs.shape[0], 1])
 
         combined_inputs = inputs.cat(prev_state, dim=-1) if prev_state is not None else inputs
+
+        if fused_params is not None:
+            fused_kernel, fused_bias = fused_params
+            combined = self.output_activation(combined_inputs.linear(fused_kernel, fused_bias))
+            return combined[:, : self.output_dim], combined[:, self.output_dim :]
+
         output = combined_inputs.linear(self.output_kernel, self.output_bias)
         output = self.output_activation(output)
 
@@ -184,6 +215,54 @@ class CustomRNNCell:
 
         return output, new_state
 
+    def project_inputs(
+        self,
+        inputs: Tensor,
+        fused_params: Optional[Tuple[Tensor, Optional[Tensor]]] = None,
+    ) -> Tuple[Tensor, ...]:
+        """
+        Applies the input rows of the kernels, along with the biases, to a whole
+        `(batch, seq_len, input_dim)` sequence in one batched matmul.  None of this depends on the
+        state, so only the state rows are left to be applied per timestep by `call_projected`.
+        """
+        if fused_params is not None:
+            fused_kernel, fused_bias = fused_params
+            return (inputs.linear(fused_kernel[: self.input_dim], fused_bias),)
+
+        output_proj = inputs.linear(self.output_kernel[: self.input_dim], self.output_bias)
+        if self.state_size == 0:
+            return (output_proj,)
+        recurrent_proj = inputs.linear(self.recurrent_kernel[: self.input_dim], self.recurrent_bias)
+        return (output_proj, recurrent_proj)
+
+    def call_projected(
+        self,
+        projected_inputs: Tuple[Tensor, ...],
+        prev_state: Tensor,
+        fused_params: Optional[Tuple[Tensor, Optional[Tensor]]] = None,
+    ):
+        """
+        Equivalent to `__call__` for a single timestep of inputs that have already been passed
+        through `project_inputs`.
+        """
+        if fused_params is not None:
+            fused_kernel, _ = fused_params
+            combined = projected_inputs[0] + prev_state.dot(fused_kernel[self.input_dim :])
+            combined = self.output_activation(combined)
+            return combined[:, : self.output_dim], combined[:, self.output_dim :]
+
+        output = projected_inputs[0]
+        if self.state_size == 0:
+            return self.output_activation(output), None
+
+        output = output + prev_state.dot(self.output_kernel[self.input_dim :])
+        output = self.output_activation(output)
+
+        new_state = projected_inputs[1] + prev_state.dot(self.recurrent_kernel[self.input_dim :])
+        new_state = self.recurrent_activation(new_state)
+
+        return output, new_state
+
     def get_initial_state(self, batch_size, dtype=None) -> Tensor:
         if self.initial_state is None:
             return None
@@ -205,21 +284,71 @@ class CustomRNNCell:
 
 
 class CustomRNN:
-    def __init__(self, *cells: CustomRNNCell, return_sequences=True, return_state=False, **kwargs):
+    def __init__(
+        self,
+        *cells: CustomRNNCell,
+        return_sequences=True,
+        return_state=False,
+        fuse_kernels=True,
+        hoist_input_projection=True,
+        **kwargs,
+    ):
         CustomRNN.validate_cells(cells)
         self.cells = cells
         self.return_sequences = return_sequences
         self.return_state = return_state
+        self.fuse_kernels = fuse_kernels
+        # The first cell's inputs don't depend on any state, so their projection through its
+        # kernels can be computed for all timesteps up front in one large matmul rather than
+        # `seq_len` small ones
+        self.hoist_input_projection = hoist_input_projection
+
+    def __call__(self, inputs: Tensor, initial_states: Optional[List[Optional[Tensor]]] = None):
+        output, states = self.forward_with_state(inputs, initial_states)
+        if self.return_state:
+            return output, states
+        else:
+            return output
 
-    def __call__(self, inputs: Tensor):
+    def forward_with_state(
+        self, inputs: Tensor, initial_states: Optional[List[Optional[Tensor]]] = None
+    ) -> Tuple[Tensor, List[Optional[Tensor]]]:
+        """
+        Runs the cells over `inputs`, starting from `initial_states` if provided (one batch of
+        states per cell, as returned from a previous call) or from the cells' initial states
+        otherwise.  Returns the output along with the final state of each cell.
+        """
         batch_size, seq_len = (inputs.shape[0], inputs.shape[1])
-        states = [cell.get_initial_state(batch_size) for cell in self.cells]
+        states = (
+            list(initial_states)
+            if initial_states is not None
+            else [cell.get_initial_state(batch_size) for cell in self.cells]
+        )
+        fused_params = [
+            cell.get_fused_params() if self.fuse_kernels and cell.can_fuse else None
+            for cell in self.cells
+        ]
+        projected_inputs = (
+            self.cells[0].project_inputs(inputs, fused_params[0])
+            if self.hoist_input_projection
+            else None
+        )
         outputs = []
         for seq_ix in range(seq_len):
-            inputs_for_timestep = inputs[:, seq_ix, :]
             new_states = []
-            for cell, state in zip(self.cells, states):
-                output, new_state = cell(inputs_for_timestep, state)
+            for cell_ix, (cell, state, cell_fused_params) in enumerate(
+                zip(self.cells, states, fused_params)
+            ):
+                if cell_ix == 0 and projected_inputs is not None:
+                    output, new_state = cell.call_projected(
+                        tuple(proj[:, seq_ix, :] for proj in projected_inputs),
+                        state,
+                        cell_fused_params,
+                    )
+                else:
+                    if cell_ix == 0:
+                        inputs_for_timestep = inputs[:, seq_ix, :]
+                    output, new_state = cell(inputs_for_timestep, state, cell_fused_params)
                 inputs_for_timestep = output
                 new_states.append(new_state)
             outputs.append(inputs_for_timestep)
@@ -230,10 +359,7 @@ class CustomRNN:
         else:
             output = outputs[-1]
 
-        if self.return_state:
-            return output, states
-        else:
-            return output
+        return output, states
 
     def get_trainable_params(self):
         trainable_params = []
@@ -277,30 +403,37 @@ class CustomRNN:
             print("dense weights:", dense.weight.numpy())
             print("dense bias:", dense.bias.numpy())
 
-    def dump_weights(self, post_layers: List[Tuple[Linear, Union[str, Dict[str, Any]]]], path: str):
+    def get_weights_dict(
+        self,
+        post_layers: List[Tuple[Linear, Union[str, Dict[str, Any]]]],
+        convert: Callable[[Tensor], Any],
+    ) -> Dict[str, Any]:
         """
-        Dumps weights as JSON to path
+        Returns the model in the format written by `dump_weights`, with each weight tensor passed
+        through `convert`
         """
 
-        def tensor_to_list(t: Tensor):
+        def convert_optional(t: Optional[Tensor]):
             if t is None:
                 return None
-            return t.numpy().tolist()
+            return convert(t)
 
-        data = {
+        return {
             "input_dim": self.cells[0].input_dim,
-            "output_dim": post_layers[-1][0].weight.shape[0]
-            if len(post_layers) > 0
-            else self.cells[-1].output_dim,
+            "output_dim": (
+                post_layers[-1][0].weight.shape[0]
+                if len(post_layers) > 0
+                else self.cells[-1].output_dim
+            ),
             "cells": [
                 {
                     "state_size": cell.state_size,
                     "output_dim": cell.output_dim,
-                    "output_kernel": tensor_to_list(cell.output_kernel),
-                    "output_bias": tensor_to_list(cell.output_bias),
-                    "recurrent_kernel": tensor_to_list(cell.recurrent_kernel),
-                    "recurrent_bias": tensor_to_list(cell.recurrent_bias),
-                    "initial_state": tensor_to_list(cell.initial_state),
+                    "output_kernel": convert_optional(cell.output_kernel),
+                    "output_bias": convert_optional(cell.output_bias),
+                    "recurrent_kernel": convert_optional(cell.recurrent_kernel),
+                    "recurrent_bias": convert_optional(cell.recurrent_bias),
+                    "initial_state": convert_optional(cell.initial_state),
                     "recurrent_activation": cell.recurrent_activation_id,
                     "output_activation": cell.output_activation_id,
                 }
@@ -310,14 +443,82 @@ class CustomRNN:
                 {
                     "input_dim": layer.weight.shape[1],
                     "output_dim": layer.weight.shape[0],
-                    "weights": tensor_to_list(layer.weight),
-                    "bias": tensor_to_list(layer.bias),
+                    "weights": convert_optional(layer.weight),
+                    "bias": convert_optional(layer.bias),
                     "activation": activation_id,
                 }
                 for layer, activation_id in post_layers
             ],
         }
+
+    def dump_weights(self, post_layers: List[Tuple[Linear, Union[str, Dict[str, Any]]]], path: str):
+        """
+        Dumps weights as JSON to path
+        """
+        data = self.get_weights_dict(post_layers, lambda t: t.numpy().tolist())
         with open(path, "wt") as f:
             json.dump(data, f, indent=2)
 
         print(f"Dumped weights to {path}")
+
+    def load_weights(
+        path: str,
+    ) -> Tuple["CustomRNN", List[Tuple[Linear, Union[str, Dict[str, Any]]]]]:
+        """
+        Loads a model written by `dump_weights`, returning the RNN along with its post layers
+        """
+        with open(path, "rt") as f:
+            return CustomRNN.from_weights_dict(json.load(f))
+
+    def from_weights_dict(
+        data: Dict[str, Any],
+    ) -> Tuple["CustomRNN", List[Tuple[Linear, Union[str, Dict[str, Any]]]]]:
+        """
+        Builds a model from the format returned by `get_weights_dict`, where the weights are
+        either nested lists or arrays
+        """
+
+        def assign(t: Tensor, values):
+            t.assign(Tensor(np.array(values, dtype=np.float32))).realize()
+
+        cells = []
+        input_dim = data["input_dim"]
+        for cell_ix, cell_data in enumerate(data["cells"]):
+            cell = CustomRNNCell(
+                input_shape=(input_dim,),
+                output_dim=cell_data["output_dim"],
+                state_size=cell_data["state_size"],
+                output_activation_id=cell_data["output_activation"],
+                recurrent_activation_id=cell_data["recurrent_activation"],
+                use_bias=cell_data["output_bias"] is not None,
+                kernel_initializer="zeros",
+                recurrent_initializer="zeros",
+                bias_initializer="zeros",
+                initial_state_initializer="zeros",
+                cell_ix=cell_ix,
+            )
+            for name in [
+                "output_kernel",
+                "output_bias",
+                "recurrent_kernel",
+                "recurrent_bias",
+                "initial_state",
+            ]:
+                if cell_data[name] is not None:
+                    assign(getattr(cell, name), cell_data[name])
+            cells.append(cell)
+            input_dim = cell.output_dim
+
+        post_layers = []
+        for layer_data in data["post_layers"]:
+            layer = Linear(
+                layer_data["input_dim"],
+                layer_data["output_dim"],
+                bias=layer_data["bias"] is not None,
+            )
+            assign(layer.weight, layer_data["weights"])
+            if layer_data["bias"] is not None:
+                assign(layer.bias, layer_data["bias"])
+            post_layers.append((layer, layer_data["activation"]))
+
+        return CustomRNN(*cells), post_layers
@@ -0,0 +1,145 @@
+import argparse
+import json
+import os
+from typing import Any, Dict, Optional, Tuple, Union
+
+import numpy as np
+
+from objective import batch_rng, build_objective
+
+DATASET_FORMAT_VERSION = 1
+
+
+def materialize_dataset(
+    path: str,
+    objective_id: Union[str, Dict[str, Any]],
+    batch_count: int,
+    batch_size: int,
+    seq_len: int,
+    seed: int,
+):
+    """
+    Generates `batch_count` batches for an objective and writes them to the directory at `path`.
+
+    The directory contains `x.npy` and `y.npy` holding arrays of shape
+    `(batch_count, batch_size, seq_len, dim)` along with a `meta.json` header describing the task.
+    Batch `i` is generated from `batch_rng(seed, i)`, so it is identical to batch `i` of a streamed
+    run with the same seed.
+    """
+    objective = build_objective(objective_id)
+    os.makedirs(path, exist_ok=True)
+    # The header is removed first when rewriting a dataset and written again last, so that a
+    # partially written dataset is never picked up
+    meta_path = os.path.join(path, "meta.json")
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+
+    x = np.lib.format.open_memmap(
+        os.path.join(path, "x.npy"),
+        mode="w+",
+        dtype=np.float32,
+        shape=(batch_count, batch_size, seq_len, objective.input_dim),
+    )
+    y = np.lib.format.open_memmap(
+        os.path.join(path, "y.npy"),
+        mode="w+",
+        dtype=np.float32,
+        shape=(batch_count, batch_size, seq_len, objective.output_dim),
+    )
+    for batch_ix in range(batch_count):
+        objective.fill(batch_rng(seed, batch_ix), x[batch_ix], y[batch_ix])
+    x.flush()
+    y.flush()
+    del x, y
+
+    meta = {
+        "version": DATASET_FORMAT_VERSION,
+        "objective": objective_id,
+        "input_dim": objective.input_dim,
+        "output_dim": objective.output_dim,
+        "batch_count": batch_count,
+        "batch_size": batch_size,
+        "seq_len": seq_len,
+        "seed": seed,
+    }
+    with open(f"{meta_path}.tmp", "wt") as f:
+        json.dump(meta, f, indent=2)
+    os.replace(f"{meta_path}.tmp", meta_path)
+
+    print(f"Wrote {batch_count} batches of {objective.name} to {path}")
+
+
+class CachedDataset:
+    """
+    Streams batches from a dataset written by `materialize_dataset` via memory-mapped I/O.
+
+    Batches are visited in a shuffled order that is reshuffled every epoch.  The order is derived
+    from `shuffle_seed` and the epoch index, so the batch for any step can be looked up directly
+    when resuming a run.
+    """
+
+    def __init__(self, path: str, shuffle_seed=0, start_step=0):
+        with open(os.path.join(path, "meta.json"), "rt") as f:
+            self.meta = json.load(f)
+        if self.meta["version"] != DATASET_FORMAT_VERSION:
+            raise ValueError(f"Unsupported dataset version {self.meta['version']} at {path}")
+
+        self.x = np.load(os.path.join(path, "x.npy"), mmap_mode="r")
+        self.y = np.load(os.path.join(path, "y.npy"), mmap_mode="r")
+        self.batch_count = self.meta["batch_count"]
+        self.shuffle_seed = shuffle_seed
+        self.step = start_step
+        self.epoch_order: Optional[Tuple[int, np.ndarray]] = None
+
+    def check_compatible(self, objective_id: Union[str, Dict[str, Any]], batch_size, seq_len):
+        expected = {"objective": objective_id, "batch_size": batch_size, "seq_len": seq_len}
+        for key, value in expected.items():
+            if self.meta[key] != value:
+                raise ValueError(
+                    f"Cached dataset has {key}={self.meta[key]} but the run expects {value}"
+                )
+
+    def batch_ix_for_step(self, step: int) -> int:
+        epoch = step // self.batch_count
+        if self.epoch_order is None or self.epoch_order[0] != epoch:
+            order = np.random.default_rng([self.shuffle_seed, epoch]).permutation(self.batch_count)
+            self.epoch_order = (epoch, order)
+        return int(self.epoch_order[1][step % self.batch_count])
+
+    def get(self, timeout: Optional[float] = None) -> Tuple[None, int, np.ndarray, np.ndarray]:
+        """
+        Returns `(None, batch_ix, x, y)` for the next step, mirroring `SharedRingBuffer.get`.  `x`
+        and `y` are read-only views into the memory-mapped files.  Never blocks, so `timeout` is
+        unused.
+        """
+        batch_ix = self.batch_ix_for_step(self.step)
+        self.step += 1
+        return None, batch_ix, self.x[batch_ix], self.y[batch_ix]
+
+    def release(self, slot_ix: None):
+        pass
+
+    def close(self):
+        pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Materialize batches for an objective into a memory-mappable dataset"
+    )
+    parser.add_argument("path", help="output directory")
+    parser.add_argument(
+        "--objective",
+        default="replace_1_to_111",
+        help='objective id, either a name or a JSON object like \'{"id": "delay", "delay": 2}\'',
+    )
+    parser.add_argument("--batches", type=int, required=True)
+    parser.add_argument("--batch-size", type=int, default=1024)
+    parser.add_argument("--seq-len", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    objective_id = json.loads(args.objective) if args.objective.startswith("{") else args.objective
+    materialize_dataset(
+        args.path, objective_id, args.batches, args.batch_size, args.seq_len, args.seed
+    )
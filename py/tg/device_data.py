@@ -0,0 +1,154 @@
+import math
+from typing import Tuple
+
+import numpy as np
+from tinygrad.tensor import Tensor
+
+# Device-side generators
+#
+# Each `generate_*` function builds one batch of examples as `(batch_size, seq_len, dim)` tensors
+# from the batch's `BatchPositions` and a one-element `seed` tensor, so a whole batch can be
+# generated on the device by a few kernels.  `seed` should be created with
+# `scalar_tensor.mk_scalar` and updated in place for every batch so that jitted generators see new
+# values.
+#
+# tinygrad's `Tensor.rand` draws on the host and copies the result over (and would be baked into
+# a `TinyJit` as a constant buffer), so random values are instead computed by hashing each
+# element's position together with the seed.  The batches follow the same distributions as the
+# `fill_*` functions in `objective.py` but aren't the same values.
+
+# Coordinates passed to `hash_uniform` are kept below this.  Its first step, `fract(p * 0.1031)`,
+# repeats every 10000 and nearly repeats at 2871 and 7129.
+COORD_LIMIT = 2048
+# The largest batches that have been checked to have the expected number of distinct sequences
+# and no correlation between rows or timesteps
+MAX_BATCH_SIZE = 128 * COORD_LIMIT
+MAX_SEQUENCE_VALUES = COORD_LIMIT
+
+
+def fract(x: Tensor) -> Tensor:
+    """
+    Fractional part of `x`, which must be non-negative
+    """
+    return x - x.trunc()
+
+
+def hash_uniform(px: Tensor, py: Tensor, pz: Tensor) -> Tensor:
+    """
+    Hashes three non-negative coordinates below `COORD_LIMIT` to a value in `[0, 1)`, using only
+    float ops.  This is `hash13` from Dave Hoskins' "Hash without Sine" (MIT licensed).
+    """
+    x, y, z = fract(px * 0.1031), fract(py * 0.1031), fract(pz * 0.1031)
+    dot = x * (z + 31.32) + y * (y + 31.32) + z * (x + 31.32)
+    x, y, z = x + dot, y + dot, z + dot
+    return fract((x + y) * z)
+
+
+def check_batch_shape(batch_size: int, seq_len: int, dim: int):
+    """
+    Raises a `ValueError` if batches of this shape are too large to be generated on the device
+    """
+    if batch_size > MAX_BATCH_SIZE:
+        raise ValueError(
+            f"Device-side generation supports batch sizes up to {MAX_BATCH_SIZE}, got {batch_size}"
+        )
+    if seq_len * dim > MAX_SEQUENCE_VALUES:
+        raise ValueError(
+            f"Device-side generation supports up to {MAX_SEQUENCE_VALUES} values per sequence, "
+            f"got seq_len {seq_len} * dim {dim}"
+        )
+
+
+class BatchPositions:
+    """
+    The coordinates that `random_uniform` hashes for each element of a `(batch_size, seq_len,
+    dim)` batch.  The batch index is split into two coordinates so that each stays below
+    `COORD_LIMIT`.
+
+    These are realized once up front, since building them with `Tensor.arange` takes a
+    quadratic-size cumsum in this version of tinygrad.
+    """
+
+    def __init__(self, batch_size: int, seq_len: int, dim: int):
+        check_batch_shape(batch_size, seq_len, dim)
+        self.shape = (batch_size, seq_len, dim)
+        rows = np.arange(batch_size, dtype=np.float32).reshape(batch_size, 1, 1)
+        self.row_lo = Tensor(rows % COORD_LIMIT, requires_grad=False).realize()
+        self.row_hi = Tensor(rows // COORD_LIMIT, requires_grad=False).realize()
+        self.value_ix = Tensor(
+            np.arange(seq_len * dim, dtype=np.float32).reshape(1, seq_len, dim),
+            requires_grad=False,
+        ).realize()
+
+
+def random_uniform(positions: BatchPositions, seed: Tensor) -> Tensor:
+    """
+    Returns a tensor of the shape of `positions` with values uniform in `[0, 1)`, determined by
+    `seed`, which must be in `[0, COORD_LIMIT)`
+    """
+    shape = positions.shape
+    row_lo = positions.row_lo.expand(shape)
+    row_hi = positions.row_hi.expand(shape)
+    value_ix = positions.value_ix.expand(shape)
+    seed = seed.reshape(1, 1, 1).expand(shape)
+    # Each round mixes in a coordinate the previous one didn't see, with the previous hash
+    # scaled back up to a coordinate.  A single round leaves some pairs of timesteps noticeably
+    # correlated for some seeds.
+    h = hash_uniform(row_lo, value_ix, seed)
+    h = hash_uniform(h * COORD_LIMIT, row_hi, value_ix)
+    return hash_uniform(h * COORD_LIMIT, row_lo, seed)
+
+
+def random_signs(positions: BatchPositions, seed: Tensor, prob=0.5) -> Tensor:
+    """
+    Device version of `objective.fill_random_signs`
+    """
+    return (random_uniform(positions, seed) < prob).where(1.0, -1.0)
+
+
+def is_high(x: Tensor) -> Tensor:
+    """
+    Maps ±1 values to 1 and 0
+    """
+    return (x > 0.0).where(1.0, 0.0)
+
+
+def generate_replace_1_to_111(positions: BatchPositions, seed: Tensor) -> Tuple[Tensor, Tensor]:
+    seq_len = positions.shape[1]
+    inputs = random_signs(positions, seed)
+    # Every 1 in the input turns on the output for itself and the following two timesteps
+    hits = is_high(inputs).pad(((0, 0), (2, 0), (0, 0)))
+    window = hits[:, 2:, :] + hits[:, 1 : seq_len + 1, :] + hits[:, :seq_len, :]
+    return inputs, (window > 0.0).where(1.0, -1.0)
+
+
+def generate_delay(positions: BatchPositions, seed: Tensor, delay=1) -> Tuple[Tensor, Tensor]:
+    seq_len = positions.shape[1]
+    inputs = random_signs(positions, seed)
+    if delay >= seq_len:
+        # tinygrad doesn't support empty slices; these sequences are all -1
+        return inputs, inputs * 0.0 - 1.0
+    outputs = inputs[:, : seq_len - delay, :].pad(((0, 0), (delay, 0), (0, 0)), value=-1.0)
+    return inputs, outputs
+
+
+def generate_gated_fsm(
+    positions: BatchPositions, seed: Tensor, change_mode_prob=0.3
+) -> Tuple[Tensor, Tensor]:
+    batch_size, seq_len, _ = positions.shape
+    u = random_uniform(positions, seed)
+    inputs = (u[:, :, :1] < change_mode_prob).cat(u[:, :, 1:] < 0.5, dim=2).where(1.0, -1.0)
+
+    # Counts are small integers, which are exact in float32.  The gate cycles through XOR, AND,
+    # NOR, NAND like `objective.gated_fsm_targets`.
+    change_count = is_high(inputs[:, :, 0]).cumsum(axis=1)
+    mode_ix = change_count - (change_count / 4).trunc() * 4
+    a, b = is_high(inputs[:, :, 1]), is_high(inputs[:, :, 2])
+    gates = [a + b - a * b * 2, a * b, (1.0 - a) * (1.0 - b), 1.0 - a * b]
+    out_high = sum(((mode_ix - i).abs() < 0.5).where(gate, 0.0) for i, gate in enumerate(gates))
+    return inputs, (out_high * 2.0 - 1.0).reshape(batch_size, seq_len, 1)
+
+
+def generate_sin(positions: BatchPositions, seed: Tensor) -> Tuple[Tensor, Tensor]:
+    inputs = random_uniform(positions, seed) * 2.0 - 1.0
+    return inputs, (inputs * (2 * math.pi)).sin()
@@ -1,36 +1,39 @@
-from concurrent.futures import ProcessPoolExecutor
+import argparse
 import multiprocessing
 import os
-import queue
-from typing import Tuple
 import json
 
-from custom_rnn import CustomRNNCell, CustomRNN
 import numpy as np
 from tinygrad.tensor import Tensor
-from tinygrad.nn.optim import Adam
-from tinygrad.nn import Linear
-from tinygrad.jit import TinyJit
-from sparse_regularizer import SparseRegularizer
-from objective import one_batch_examples
-from validate import validate
-
-
-def data_gen_worker(
-    data_queue: queue.Queue[Tuple[np.ndarray, np.ndarray]],
-    done: queue.Queue[bool],
-    batch_size: int,
-    seq_len: int,
-):
+from run_config import load_run_config, scheduled_values
+from objective import Objective, batch_rng, build_objective
+from validate import run_exhaustive_validation, run_validation
+from scalar_tensor import assign_scalar
+from ring_buffer import SharedRingBuffer
+from dataset_cache import CachedDataset
+from trainer import Trainer
+from profiling import StepProfiler
+from loss_log import DeferredLossReader, LossLog
+from prefetch import DeviceBatchSource, DevicePrefetcher, can_prefetch
+from checkpoint import (
+    AsyncCheckpointer,
+    latest_checkpoint,
+    restore_training_checkpoint,
+    snapshot_training_state,
+)
+
+
+def data_gen_worker(ring: SharedRingBuffer, objective: Objective, seed: int):
     while True:
-        x, y = one_batch_examples(batch_size, seq_len)
-        while True:
-            try:
-                data_queue.put((x, y), block=True, timeout=0.1)
-                break
-            except queue.Full:
-                if not done.empty():
-                    return
+        claimed = ring.acquire()
+        if claimed is None:
+            return
+        slot_ix, batch_ix = claimed
+
+        # Generate directly into the shared slot so that batches are never copied or pickled
+        x, y = ring.slot_views(slot_ix)
+        objective.fill(batch_rng(seed, batch_ix), x, y)
+        ring.publish(slot_ix, batch_ix)
 
 
 class NumpyArrayEncoder(json.JSONEncoder):
@@ -41,147 +44,289 @@ class NumpyArrayEncoder(json.JSONEncoder):
 
 
 if __name__ == "__main__":
-    learning_rate = 0.01
-    seq_len = 20
-    input_dim = one_batch_examples(1, seq_len)[0].shape[-1]
-    output_dim = one_batch_examples(1, seq_len)[1].shape[-1]
-    batch_size = 1024 * 1
+    parser = argparse.ArgumentParser(description="Train an RNN")
+    parser.add_argument(
+        "--output-dir",
+        default="output",
+        help="directory to write checkpoints, weights, and losses to",
+    )
+    parser.add_argument(
+        "--checkpoint-every",
+        type=int,
+        default=500,
+        help="iterations between checkpoints; 0 to only checkpoint at the end",
+    )
+    parser.add_argument(
+        "--keep-checkpoints", type=int, default=3, help="number of most recent checkpoints to keep"
+    )
+    parser.add_argument(
+        "--resume",
+        help="checkpoint to resume training from, or a directory to resume from its latest one",
+    )
+    parser.add_argument(
+        "--config",
+        default=os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), "configs/replace_1_to_111.yaml"
+        ),
+        help="YAML or JSON run config; see `run_config.py` for the available settings",
+    )
+    parser.add_argument(
+        "--set",
+        dest="overrides",
+        action="append",
+        default=[],
+        metavar="KEY.PATH=VALUE",
+        help="override a config setting, like `--set cells.0.state_size=4`; may be repeated",
+    )
+    parser.add_argument(
+        "--stop-at",
+        type=int,
+        help="stop after this many iterations without changing the schedule, which is still "
+        "defined by the configured iteration count, so the run can be continued with --resume",
+    )
+    parser.add_argument(
+        "--no-validate", action="store_true", help="skip validation at the end of training"
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="time each phase of the training loop and print a summary periodically",
+    )
+    parser.add_argument(
+        "--profile-every", type=int, default=100, help="iterations between profile summaries"
+    )
+    parser.add_argument(
+        "--profile-trace", help="write a Chrome trace of the training loop to this path"
+    )
+    parser.add_argument(
+        "--profile-jsonl", help="write per-iteration profile records as JSON lines to this path"
+    )
+    parser.add_argument(
+        "--readback-every",
+        type=int,
+        default=10,
+        help="iterations to keep losses on the device before reading them back in one batch",
+    )
+    parser.add_argument(
+        "--loss-log",
+        help="append-only loss log to stream losses to while training; written as CSV if the path "
+        "ends in .csv and as packed binary records otherwise.  Defaults to losses.csv in the "
+        "output directory.",
+    )
+    args = parser.parse_args()
+    if args.keep_checkpoints < 1:
+        parser.error("--keep-checkpoints must be at least 1")
+
+    config = load_run_config(args.config, args.overrides)
+    os.makedirs(args.output_dir, exist_ok=True)
+    with open(os.path.join(args.output_dir, "config.json"), "wt") as f:
+        json.dump(config, f, indent=2)
+
+    objective = build_objective(config["objective"])
+    seq_len = config["seq_len"]
+    input_dim = objective.input_dim
+    output_dim = objective.output_dim
+    batch_size = config["batch_size"]
+    # Seeds both the initial weights and the training data stream
+    seed = config["seed"]
+    # Set to a directory written by `dataset_cache.py` to train from pre-generated batches instead
+    # of generating them on the fly
+    dataset_path = config["data"]["dataset_path"]
 
     np.set_printoptions(suppress=True)
+    np.random.seed(seed)
+    # Initializers like `glorot_uniform` draw from tinygrad's RNG, which is otherwise seeded from
+    # the current time
+    Tensor.manual_seed(seed)
 
-    init = "glorot_normal"
-    # init = {"id": "uniform", "low": -1, "high": 1}
-    # init = {"id": "normal", "mean": 0, "std": 1}
+    trainer = Trainer(config, objective)
+    rnn, dense, reg, opt = trainer.rnn, trainer.dense, trainer.reg, trainer.opt
+    post_layers = trainer.post_layers
 
-    reg = SparseRegularizer(intensity=0.05, threshold=0.025, steepness=10, l1=0.001)
-    activation = {"id": "interpolated_ameo", "factor": 0.5, "leakyness": 0.1}
+    start_step = 0
+    losses = []
+    if args.resume is not None:
+        resume_path = latest_checkpoint(args.resume) if os.path.isdir(args.resume) else args.resume
+        if resume_path is None:
+            raise ValueError(f"No checkpoints found in {args.resume}")
+        metadata, arrays = restore_training_checkpoint(resume_path, rnn, post_layers, opt)
+        # The schedule is a function of the iteration, so restoring the step resumes it where it
+        # left off
+        start_step = metadata["step"]
+        reg.intensity = metadata["schedule"]["reg_intensity"]
+        losses = list(np.array(arrays["losses"])) if "losses" in arrays else []
+        print(f"Resumed from {resume_path} at iteration {start_step}")
 
-    rnn = CustomRNN(
-        CustomRNNCell(
-            input_shape=(
-                batch_size,
-                seq_len,
-                input_dim,
-            ),
-            output_dim=4,
-            state_size=2,
-            output_activation_id=activation,
-            recurrent_activation_id=activation,
-            trainable_initial_weights=True,
-            use_bias=True,
-            output_kernel_regularizer=reg,
-            recurrent_kernel_regularizer=reg,
-            kernel_initializer=init,
-            bias_initializer=init,
-            initial_state_initializer=init,
-            # output_bias_regularizer=reg,
-            # recurrent_bias_regularizer=reg,
-            cell_ix=0,
-        ),
-        # CustomRNNCell(
-        #     input_shape=(
-        #         batch_size,
-        #         seq_len,
-        #         16,
-        #     ),
-        #     output_dim=4,
-        #     state_size=8,
-        #     output_activation_id=activation,
-        #     recurrent_activation_id=activation,
-        #     trainable_initial_weights=True,
-        #     use_bias=True,
-        #     output_kernel_regularizer=reg,
-        #     recurrent_kernel_regularizer=reg,
-        #     kernel_initializer="glorot_normal",
-        #     bias_initializer="glorot_normal",
-        #     initial_state_initializer="glorot_normal",
-        #     # output_bias_regularizer=reg,
-        #     # recurrent_bias_regularizer=reg,
-        #     cell_ix=1,
-        # ),
-    )
-
-    dense = (
-        Linear(rnn.cells[-1].output_dim, 1, bias=True)
-        if rnn.cells[-1].output_dim != output_dim
-        else None
-    )
+    multiprocessing.freeze_support()
 
-    def forward(x: Tensor) -> Tensor:
-        y = rnn(x)
-        if y.shape[-1] != output_dim:
-            y = dense(y)  # .tanh()
-        return y
+    generate_on_device = config["data"]["generate_on_device"]
+    if generate_on_device and objective.generate_on_device is None:
+        print(f"{objective} can't be generated on the device; generating batches on the host")
+        generate_on_device = False
 
-    def compute_loss(y_pred: Tensor, y_true: Tensor) -> Tensor:
-        return (y_pred - y_true).pow(2).mean()
+    if dataset_path is not None:
+        data_source = CachedDataset(dataset_path, shuffle_seed=seed, start_step=start_step)
+        data_source.check_compatible(objective.id, batch_size, seq_len)
+        workers = []
+    elif generate_on_device:
+        data_source = DeviceBatchSource(
+            objective, batch_size, seq_len, seed, start_batch_ix=start_step
+        )
+        workers = []
+    else:
+        data_gen_worker_count = config["data"]["workers"]
+        data_source = SharedRingBuffer(
+            slot_count=data_gen_worker_count + config["data"]["extra_slots"],
+            x_shape=(batch_size, seq_len, input_dim),
+            y_shape=(batch_size, seq_len, output_dim),
+            # Each iteration consumes one batch, so this picks the data stream up where it left off
+            start_batch_ix=start_step,
+        )
 
-    trainable_params = rnn.get_trainable_params() + ([dense.weight, dense.bias] if dense else [])
-    opt = Adam(
-        trainable_params,
-        learning_rate,
-    )
+        # Start data generation in worker processes
+        workers = [
+            multiprocessing.Process(
+                target=data_gen_worker, args=(data_source, objective, seed), daemon=True
+            )
+            for _ in range(data_gen_worker_count)
+        ]
+        for worker in workers:
+            worker.start()
+        data_source.watch_producers(workers)
 
-    def mk_train_one_batch():
-        @TinyJit
-        def train_one_batch(x: Tensor, y: Tensor) -> Tensor:
-            y_pred = forward(x)
-            raw_loss = compute_loss(y_pred, y)
-            reg_loss = rnn.get_regularization_loss() + reg(dense.weight)
-            loss = raw_loss + reg_loss
+    prefetcher = (
+        DevicePrefetcher(
+            data_source, (batch_size, seq_len, input_dim), (batch_size, seq_len, output_dim)
+        )
+        if config["data"]["prefetch"] and can_prefetch() and not generate_on_device
+        else None
+    )
+    batches = prefetcher or data_source
+    batches_on_device = prefetcher is not None or generate_on_device
 
-            opt.zero_grad()
-            loss.backward()
-            opt.step()
+    checkpointer = AsyncCheckpointer(
+        os.path.join(args.output_dir, "checkpoints"), args.keep_checkpoints
+    )
 
-            return raw_loss.reshape((1,)).cat(reg_loss.reshape((1,))).realize()
+    def checkpoint(step: int):
+        checkpointer.submit(
+            step,
+            *snapshot_training_state(
+                rnn,
+                post_layers,
+                opt,
+                step,
+                schedule={"reg_intensity": reg.intensity},
+                losses=np.array(losses),
+            ),
+        )
 
-        return train_one_batch
+    loss_log = LossLog(
+        args.loss_log or os.path.join(args.output_dir, "losses.csv"), start_step=start_step
+    )
 
-    multiprocessing.freeze_support()
+    def on_losses_read(steps, step_losses):
+        for i, loss in zip(steps, step_losses):
+            print(f"[{i}]: loss: {loss}")
+            losses.append(loss)
+        loss_log.append(steps, step_losses)
 
-    data_queue = multiprocessing.Manager().Queue(maxsize=10)
-    done = multiprocessing.Manager().Queue(maxsize=10)
-    data_gen_worker_count = 12
+    # Each step's batch stays in use until its losses are read back, so at most all but one of the
+    # ring buffer's slots can be held or the data workers would have nowhere to write the next batch
+    readback_every = args.readback_every
+    if isinstance(data_source, SharedRingBuffer):
+        readback_every = min(readback_every, data_source.slot_count - 1)
+    loss_reader = DeferredLossReader(readback_every, on_losses_read)
 
-    # Start data generation in worker threads
-    with ProcessPoolExecutor(max_workers=data_gen_worker_count) as executor:
-        for _ in range(data_gen_worker_count):
-            executor.submit(data_gen_worker, data_queue, done, batch_size, seq_len)
+    profiler = StepProfiler(
+        args.profile, args.profile_every, args.profile_trace, args.profile_jsonl
+    )
 
+    try:
         # Training loop
-        train_one_batch = mk_train_one_batch()
-        losses = []
-        for i in range(5000):
-            if i == 500:
-                reg.intensity *= 0.8
-                opt.lr *= 0.8
-                train_one_batch = mk_train_one_batch()
-            if i == 1000:
-                reg.intensity *= 0.6
-                opt.lr *= 0.6
-                train_one_batch = mk_train_one_batch()
-            if i == 2500:
-                # reg.intensity *= 0.5
-                opt.lr *= 0.5
-                train_one_batch = mk_train_one_batch()
-
-            x, y = data_queue.get()
-            x, y = Tensor(x), Tensor(y)
-            loss = train_one_batch(x, y).numpy()
-            print(f"[{i}]: loss: {loss}")
-            losses.append(loss)
+        train_one_batch = trainer.mk_train_one_batch()
+        current_lr = None
+        stop_at = config["iterations"] if args.stop_at is None else args.stop_at
+        # The number of iterations trained so far, which is what the final checkpoint resumes from
+        step = start_step
+        for i in range(start_step, min(stop_at, config["iterations"])):
+            profiler.begin_step(i)
+            with profiler.phase("schedule"):
+                # The learning rate and regularizer params are tensors read by the jitted step, so
+                # they're updated in place rather than rebuilding it
+                scheduled_lr, reg.intensity = scheduled_values(config, i)
+                if scheduled_lr != current_lr:
+                    current_lr = scheduled_lr
+                    assign_scalar(opt.lr, current_lr)
+
+            if profiler.enabled and isinstance(data_source, SharedRingBuffer):
+                profiler.sample("queue_depth", data_source.ready_count())
+            with profiler.phase("data_wait"):
+                slot_ix, _batch_ix, x, y = batches.get()
+            if not batches_on_device:
+                with profiler.phase("to_tensor"):
+                    # `x` and `y` are views into shared or memory-mapped memory; the slot is
+                    # handed back once the step's losses have been read back, at which point the
+                    # device is done with the batch
+                    x, y = Tensor(x), Tensor(y)
+            with profiler.phase("train_step"):
+                loss = train_one_batch(x, y)
+            with profiler.phase("readback"):
+                loss_reader.push(i, loss, lambda slot_ix=slot_ix: batches.release(slot_ix))
 
-        done.put(True)
+            if args.checkpoint_every > 0 and (i + 1) % args.checkpoint_every == 0:
+                with profiler.phase("checkpoint"):
+                    loss_reader.flush()
+                    checkpoint(i + 1)
+            profiler.end_step()
+            step = i + 1
+
+        loss_reader.flush()
+        if args.checkpoint_every <= 0 or step % args.checkpoint_every != 0:
+            checkpoint(step)
+    finally:
+        profiler.close()
+        loss_log.close()
+        if prefetcher is not None:
+            prefetcher.close()
+        data_source.close()
+        for worker in workers:
+            worker.join()
+        if isinstance(data_source, SharedRingBuffer):
+            data_source.unlink()
+        # Flushes any checkpoints still being written, even if training crashed.  This re-raises
+        # if a write failed, so it comes after everything else has been shut down.
+        checkpointer.close()
 
     print("Done training")
+    print(f"Saved checkpoints to {checkpointer.checkpoint_dir}")
     rnn.print_weights(dense)
-    homedir = os.path.expanduser("~")
-    rnn.dump_weights([(dense, "linear")] if dense else [], f"{homedir}/Downloads/weights.json")
+    rnn.dump_weights(post_layers, os.path.join(args.output_dir, "weights.json"))
     # Dump weights as JSON for easily rendering loss plots
     losses_json = json.dumps(np.array(losses), cls=NumpyArrayEncoder)
-    with open(f"{homedir}/Downloads/losses.json", "w") as f:
+    losses_path = os.path.join(args.output_dir, "losses.json")
+    with open(losses_path, "w") as f:
         f.write(losses_json)
-    print(f"Saved losses to {homedir}/Downloads/losses.json")
+    print(f"Saved losses to {losses_path} and {loss_log.path}")
+
+    if not args.no_validate:
+        print("\n\n\nRunning Validation...\n\n")
+        report = run_validation(
+            objective.one_batch_examples, trainer.forward, config["validation_seq_len"]
+        )
+        report.print_summary()
+        validation_path = os.path.join(args.output_dir, "validation.json")
+        with open(validation_path, "wt") as f:
+            json.dump(report.to_dict(), f, indent=2)
+        print(f"Saved validation report to {validation_path}")
 
-    validate(one_batch_examples, forward, 40)
+        if config["exhaustive_validation_seq_len"] is not None:
+            print("\nRunning exhaustive validation...\n")
+            report = run_exhaustive_validation(
+                objective, trainer.forward, config["exhaustive_validation_seq_len"]
+            )
+            report.print_summary()
+            validation_path = os.path.join(args.output_dir, "exhaustive_validation.json")
+            with open(validation_path, "wt") as f:
+                json.dump(report.to_dict(), f, indent=2)
+            print(f"Saved exhaustive validation report to {validation_path}")
@@ -0,0 +1,113 @@
+import csv
+import os
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+from tinygrad.tensor import Tensor
+
+from scalar_tensor import device_copy
+
+# Record layout of binary loss logs, which can be read with `np.fromfile(path, LOSS_RECORD_DTYPE)`
+LOSS_RECORD_DTYPE = np.dtype([("step", "<u4"), ("loss", "<f4"), ("reg_loss", "<f4")])
+CSV_HEADER = ["step", "loss", "reg_loss"]
+
+
+def read_loss_log(path: str) -> np.ndarray:
+    """
+    Reads a log written by `LossLog` as an array of `LOSS_RECORD_DTYPE` records
+    """
+    if path.endswith(".csv"):
+        with open(path, "rt", newline="") as f:
+            rows = [tuple(row) for row in csv.reader(f)][1:]
+        return np.array(
+            [(int(step), float(loss), float(reg_loss)) for step, loss, reg_loss in rows],
+            dtype=LOSS_RECORD_DTYPE,
+        )
+    return np.fromfile(path, dtype=LOSS_RECORD_DTYPE)
+
+
+class LossLog:
+    """
+    Append-only log of `(step, loss, reg_loss)` records that's flushed as it's written, so plots
+    can be rendered from it while training is still running.
+
+    Paths ending in `.csv` are written as CSV with a header row.  Anything else is written as a
+    flat array of 12-byte `LOSS_RECORD_DTYPE` records.
+
+    When resuming from `start_step`, records from the previous run at or after that step are
+    dropped since those steps are about to be trained again.
+    """
+
+    def __init__(self, path: str, start_step=0):
+        self.path = path
+        self.is_csv = path.endswith(".csv")
+
+        kept = None
+        if start_step > 0 and os.path.exists(path):
+            records = read_loss_log(path)
+            kept = records[records["step"] < start_step]
+
+        if self.is_csv:
+            self.file = open(path, "wt", newline="")
+            self.writer = csv.writer(self.file)
+            self.writer.writerow(CSV_HEADER)
+        else:
+            self.file = open(path, "wb")
+        if kept is not None and len(kept) > 0:
+            self.append(kept["step"], np.stack([kept["loss"], kept["reg_loss"]], axis=1))
+
+    def append(self, steps: np.ndarray, losses: np.ndarray):
+        """
+        Appends the `(raw_loss, reg_loss)` rows of `losses` for the given steps
+        """
+        if self.is_csv:
+            # NumPy floats are written with the shortest repr that round trips as float32
+            self.writer.writerows(
+                (int(step), np.float32(loss), np.float32(reg_loss))
+                for step, (loss, reg_loss) in zip(steps, losses)
+            )
+        else:
+            records = np.empty(len(steps), dtype=LOSS_RECORD_DTYPE)
+            records["step"] = steps
+            records["loss"] = losses[:, 0]
+            records["reg_loss"] = losses[:, 1]
+            self.file.write(records.tobytes())
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class DeferredLossReader:
+    """
+    Holds the losses returned by training steps on the device and reads them back in batches of up
+    to `interval` steps, so the training loop only waits on the device once per batch.
+
+    Each step can come with a `release` callback, which is called once its losses have been read
+    back.  Since reading back waits for all of the work queued before it, this is the point at
+    which the step's inputs are no longer in use.  Flushed losses are passed to `on_flush` as
+    `(steps, losses)` with `losses` of shape `(len(steps), 2)`.
+    """
+
+    def __init__(self, interval: int, on_flush: Callable[[List[int], np.ndarray], None]):
+        self.interval = max(interval, 1)
+        self.on_flush = on_flush
+        self.pending: List[Tuple[int, Tensor, Optional[Callable[[], None]]]] = []
+
+    def push(self, step: int, loss: Tensor, release: Optional[Callable[[], None]] = None):
+        # Copied on the device since jitted steps write their outputs into the same buffer every
+        # time they're called
+        self.pending.append((step, device_copy(loss), release))
+        if len(self.pending) >= self.interval:
+            self.flush()
+
+    def flush(self):
+        if len(self.pending) == 0:
+            return
+        steps = [step for step, _, _ in self.pending]
+        losses = Tensor.stack([loss for _, loss, _ in self.pending]).numpy()
+        for _, _, release in self.pending:
+            if release is not None:
+                release()
+        self.pending = []
+        self.on_flush(steps, losses)
@@ -0,0 +1,232 @@
+import json
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+from ameo_activation_np import leaky_ameo_np, interpolated_ameo_np
+from checkpoint_format import load_model_weights
+
+
+def build_activation_np(id: Union[str, Dict[str, Any]]) -> Callable[[np.ndarray], np.ndarray]:
+    if isinstance(id, dict):
+        if id["id"] == "leaky_ameo":
+            leakyness = id["leakyness"]
+            return lambda x: leaky_ameo_np(x, leakyness)
+        elif id["id"] == "interpolated_ameo":
+            factor = id["factor"]
+            leakyness = id["leakyness"]
+            return lambda x: interpolated_ameo_np(x, factor, leakyness)
+        else:
+            raise ValueError(f"Unknown activation: {id}")
+
+    if id == "tanh":
+        return np.tanh
+    elif id == "sigmoid":
+        return lambda x: 1.0 / (1.0 + np.exp(-x))
+    elif id == "relu":
+        return lambda x: np.maximum(x, 0.0)
+    elif id == "linear" or id is None:
+        return lambda x: x
+    elif id == "ameo":
+        return lambda x: leaky_ameo_np(x, 0.0)
+    else:
+        raise ValueError(f"Unknown activation: {id}")
+
+
+def to_array(values) -> Optional[np.ndarray]:
+    if values is None:
+        return None
+    return np.asarray(values, dtype=np.float32)
+
+
+# Above this fraction of nonzero weights, BLAS dense matmuls beat the sparse kernel.  Measured on
+# one core with batches of 1k-16k rows and 16x16 to 256x256 kernels: the sparse kernel is 1.8-3x
+# slower than dense at 10% density and breaks even at around 5%.  Models that are 90% zeros get
+# their speedup from `compaction.compact_weights` removing dead units, which shrinks the dense
+# matmuls, rather than from this kernel.
+SPARSE_MAX_DENSITY = 0.05
+
+
+class SparseKernel:
+    """
+    Kernel of shape `(input_dim, output_dim)` stored per output neuron as the indices of the inputs
+    it reads along with the weights for each of them, similar to CSC.
+
+    `x @ kernel` only visits live connections, so the work done scales with the number of nonzero
+    weights rather than with the dense size of the kernel.
+    """
+
+    # Makes numpy defer `ndarray @ SparseKernel` to `__rmatmul__` rather than trying to convert
+    # this into an array
+    __array_ufunc__ = None
+
+    def __init__(self, kernel: np.ndarray):
+        self.shape = kernel.shape
+        output_ixs, input_ixs = np.nonzero(kernel.T)
+        self.input_ixs = input_ixs.astype(np.int64)
+        self.weights = kernel[input_ixs, output_ixs].astype(np.float32)
+        self.indptr = np.searchsorted(output_ixs, np.arange(kernel.shape[1] + 1)).astype(np.int64)
+
+    def __rmatmul__(self, x: np.ndarray) -> np.ndarray:
+        # Imported here so that dense-only inference never loads numba
+        from sparse_matmul import sparse_matmul_kernel
+
+        flat_x = x.reshape(-1, self.shape[0])
+        out = np.empty((flat_x.shape[0], self.shape[1]), dtype=np.float32)
+        sparse_matmul_kernel(flat_x, self.indptr, self.input_ixs, self.weights, out)
+        return out.reshape(*x.shape[:-1], self.shape[1])
+
+
+def build_kernel(kernel: np.ndarray, sparse: bool) -> Union[np.ndarray, SparseKernel]:
+    kernel = np.ascontiguousarray(kernel)
+    if sparse and np.count_nonzero(kernel) <= SPARSE_MAX_DENSITY * kernel.size:
+        return SparseKernel(kernel)
+    return kernel
+
+
+class NumpyRNNCell:
+    def __init__(self, data: Dict[str, Any], input_dim: int, sparse=False):
+        self.input_dim = input_dim
+        self.output_dim = data["output_dim"]
+        self.state_size = data["state_size"]
+        self.output_activation = build_activation_np(data["output_activation"])
+        self.recurrent_activation = build_activation_np(data["recurrent_activation"])
+        self.initial_state = to_array(data["initial_state"])
+
+        output_kernel = to_array(data["output_kernel"])
+        output_bias = to_array(data["output_bias"])
+        recurrent_kernel = to_array(data["recurrent_kernel"])
+        recurrent_bias = to_array(data["recurrent_bias"])
+
+        # As in `CustomRNNCell`, when both activations match the output and recurrent kernels are
+        # applied as one matmul.  Kernels are split into the rows applied to the inputs, which are
+        # projected for the whole sequence at once, and the rows applied to the state.
+        self.fused = (
+            self.state_size > 0 and data["output_activation"] == data["recurrent_activation"]
+        )
+        if self.fused:
+            kernels = [np.concatenate([output_kernel, recurrent_kernel], axis=1)]
+            biases = [
+                np.concatenate([output_bias, recurrent_bias]) if output_bias is not None else None
+            ]
+        elif self.state_size > 0:
+            kernels = [output_kernel, recurrent_kernel]
+            biases = [output_bias, recurrent_bias]
+        else:
+            kernels = [output_kernel]
+            biases = [output_bias]
+
+        self.input_kernels = [build_kernel(kernel[:input_dim], sparse) for kernel in kernels]
+        self.state_kernels = [build_kernel(kernel[input_dim:], sparse) for kernel in kernels]
+        self.biases = biases
+
+    def get_initial_state(self, batch_size: int) -> Optional[np.ndarray]:
+        if self.initial_state is None:
+            return None
+        return np.broadcast_to(self.initial_state, (batch_size, self.state_size))
+
+    def project_inputs(self, inputs: np.ndarray) -> List[np.ndarray]:
+        projected = []
+        for kernel, bias in zip(self.input_kernels, self.biases):
+            proj = inputs @ kernel
+            if bias is not None:
+                proj += bias
+            projected.append(proj)
+        return projected
+
+    def call_projected(
+        self, projected: List[np.ndarray], prev_state: Optional[np.ndarray]
+    ) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        if self.state_size == 0:
+            return self.output_activation(projected[0]), None
+
+        pre_activations = [
+            proj + prev_state @ kernel for proj, kernel in zip(projected, self.state_kernels)
+        ]
+        if self.fused:
+            combined = self.output_activation(pre_activations[0])
+            return combined[:, : self.output_dim], combined[:, self.output_dim :]
+
+        return (
+            self.output_activation(pre_activations[0]),
+            self.recurrent_activation(pre_activations[1]),
+        )
+
+
+class NumpyRNN:
+    """
+    Dependency-free inference engine for models written by `CustomRNN.dump_weights`.
+
+    Only NumPy is needed, so this starts up in milliseconds and is suitable for evaluating large
+    batches of sequences outside of the training environment.
+
+    With `sparse=True`, kernels that are mostly zeros are run as `SparseKernel`s.  This pairs with
+    `compaction.compact_weights`, which prunes small weights and removes dead neurons.
+    """
+
+    def __init__(self, data: Dict[str, Any], sparse=False):
+        self.input_dim = data["input_dim"]
+        self.output_dim = data["output_dim"]
+
+        self.cells: List[NumpyRNNCell] = []
+        input_dim = self.input_dim
+        for cell_data in data["cells"]:
+            cell = NumpyRNNCell(cell_data, input_dim, sparse)
+            self.cells.append(cell)
+            input_dim = cell.output_dim
+
+        self.post_layers = [
+            (
+                build_kernel(to_array(layer["weights"]).T, sparse),
+                to_array(layer["bias"]),
+                build_activation_np(layer["activation"]),
+            )
+            for layer in data["post_layers"]
+        ]
+
+    def load(path: str, sparse=False) -> "NumpyRNN":
+        with open(path, "rt") as f:
+            return NumpyRNN(json.load(f), sparse)
+
+    def load_checkpoint(path: str, sparse=False) -> "NumpyRNN":
+        return NumpyRNN(load_model_weights(path), sparse)
+
+    def forward_with_state(
+        self, inputs: np.ndarray, initial_states: Optional[List[Optional[np.ndarray]]] = None
+    ) -> Tuple[np.ndarray, List[Optional[np.ndarray]]]:
+        """
+        Runs a batch of sequences with shape `(batch, seq_len, input_dim)` through the model,
+        starting from `initial_states` if given.  Returns outputs with shape
+        `(batch, seq_len, output_dim)` along with the final state of each cell.
+        """
+        inputs = np.asarray(inputs, dtype=np.float32)
+        batch_size, seq_len = inputs.shape[0], inputs.shape[1]
+        states = (
+            list(initial_states)
+            if initial_states is not None
+            else [cell.get_initial_state(batch_size) for cell in self.cells]
+        )
+
+        # The inputs to the first cell don't depend on state, so they're projected for every
+        # timestep at once
+        first_projected = self.cells[0].project_inputs(inputs)
+        outputs = np.empty((batch_size, seq_len, self.cells[-1].output_dim), dtype=np.float32)
+        for seq_ix in range(seq_len):
+            for cell_ix, cell in enumerate(self.cells):
+                if cell_ix == 0:
+                    projected = [proj[:, seq_ix, :] for proj in first_projected]
+                else:
+                    projected = cell.project_inputs(output)
+                output, states[cell_ix] = cell.call_projected(projected, states[cell_ix])
+            outputs[:, seq_ix, :] = output
+
+        for weights, bias, activation in self.post_layers:
+            outputs = outputs @ weights
+            if bias is not None:
+                outputs += bias
+            outputs = activation(outputs)
+
+        return outputs, states
+
+    def __call__(self, inputs: np.ndarray) -> np.ndarray:
+        return self.forward_with_state(inputs)[0]
@@ -1,5 +1,17 @@
+from functools import partial
+from typing import Any, Callable, Dict, Optional, Tuple, Union
+
 import numpy as np
-from numba import jit
+from numba import jit, prange
+from tinygrad.tensor import Tensor
+
+from device_data import (
+    BatchPositions,
+    generate_delay,
+    generate_gated_fsm,
+    generate_replace_1_to_111,
+    generate_sin,
+)
 
 
 @jit(nopython=True)
@@ -37,236 +49,287 @@ def nor(a, b):
     return -1 if a == 1 or b == 1 else 1
 
 
-# @jit(nopython=True)
-# def one_seq_examples(seq_len: int):
-#     inputs = np.zeros((seq_len, 3), dtype=np.float32)
-#     outputs = np.zeros((seq_len, 1), dtype=np.float32)
-
-#     XOR = -1
-#     AND = 1
-#     OR = -2
-#     NOR = 2
-#     NAND = -3
-#     XNOR = 3
-
-#     all_modes = [
-#         XOR,
-#         AND,
-#         NOR,
-#         NAND,
-#     ]
-#     mode = XOR
-#     mode_index = 0
-
-#     for i in range(seq_len):
-#         change_mode = one_val(0.3)
-#         # change_dir = one_val()
-#         if change_mode == 1:
-#             # mode_index += 1 if change_dir == 1 else -1
-#             mode_index += 1
-#             mode_index = len(all_modes) - 1 if mode_index < 0 else mode_index
-#             mode_index = 0 if mode_index >= len(all_modes) else mode_index
-#             mode = all_modes[mode_index]
-
-#         input_val = np.array(
-#             [
-#                 change_mode,
-#                 # change_dir,
-#                 one_val(),
-#                 one_val(),
-#             ]
-#         ).astype(np.float32)
-#         output_val = None
-#         if mode == XOR:
-#             output_val = np.array([xor(input_val[1], input_val[2])]).astype(np.float32)
-#         elif mode == AND:
-#             output_val = np.array([and_(input_val[1], input_val[2])]).astype(np.float32)
-#         elif mode == OR:
-#             output_val = np.array([or_(input_val[1], input_val[2])]).astype(np.float32)
-#         elif mode == NOR:
-#             output_val = np.array([nor(input_val[1], input_val[2])]).astype(np.float32)
-#         elif mode == NAND:
-#             output_val = np.array([nand(input_val[1], input_val[2])]).astype(np.float32)
-#         elif mode == XNOR:
-#             output_val = np.array([xnor(input_val[1], input_val[2])]).astype(np.float32)
-#         else:
-#             raise ValueError("Invalid mode")
-#         inputs[i] = input_val
-#         outputs[i] = output_val
-
-#     return inputs, outputs
+# Batched generators
+#
+# Each `fill_*` function writes one batch of examples directly into preallocated
+# `(batch_size, seq_len, dim)` float32 buffers.  Random draws are made for the whole batch at once
+# from the provided generator, and objectives that need sequential state are stepped in parallel
+# across the batch with `prange`.  The numba kernels never draw random numbers themselves, so a
+# batch is fully determined by the state of the generator it was filled from.
+
+
+def batch_rng(seed: int, batch_ix: int) -> np.random.Generator:
+    """
+    Returns the generator for batch `batch_ix` of the data stream seeded with `seed`.
+
+    Every batch gets its own independent stream keyed by its index, so the data for any point in a
+    run can be regenerated without replaying the batches before it and doesn't depend on how many
+    workers generated it or in what order.
+    """
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(batch_ix,)))
+
+
+def mk_batch_buffers(
+    batch_size: int, seq_len: int, input_dim: int, output_dim: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    return (
+        np.empty((batch_size, seq_len, input_dim), dtype=np.float32),
+        np.empty((batch_size, seq_len, output_dim), dtype=np.float32),
+    )
+
+
+def fill_random_signs(rng: np.random.Generator, out: np.ndarray, prob=0.5):
+    """
+    Fills `out` with 1 with probability `prob` and -1 otherwise; the batched version of `one_val`
+    """
+    np.copyto(out, np.where(rng.random(out.shape) < prob, 1.0, -1.0), casting="unsafe")
+
+
+# 3 inputs, 1 output.
+#
+# Inputs are `[change_mode, a, b]`.  The gate applied to `a` and `b` cycles through XOR, AND, NOR,
+# NAND, advancing each time `change_mode` is 1.
+GATED_FSM_MODES = 4
+
+
+def fill_gated_fsm(
+    rng: np.random.Generator, inputs: np.ndarray, outputs: np.ndarray, change_mode_prob=0.3
+):
+    fill_random_signs(rng, inputs[:, :, 0], change_mode_prob)
+    fill_random_signs(rng, inputs[:, :, 1:])
+    gated_fsm_targets(inputs, outputs)
+
+
+def gated_fsm_targets(inputs: np.ndarray, outputs: np.ndarray):
+    mode_ix = np.cumsum(inputs[:, :, 0] == 1.0, axis=1) % GATED_FSM_MODES
+    a_high = inputs[:, :, 1] == 1.0
+    b_high = inputs[:, :, 2] == 1.0
+    out_high = np.select(
+        [mode_ix == 0, mode_ix == 1, mode_ix == 2],
+        [a_high != b_high, a_high & b_high, ~(a_high | b_high)],
+        ~(a_high & b_high),
+    )
+    outputs[:, :, 0] = np.where(out_high, 1.0, -1.0)
+
 
 # 1 input, 1 output.
 #
 # Trained to estimate sin(2 * pi * x) for x in [-1, 1]
 # Learned quite well with few neurons:
 # {"inputLayer":{"neurons":[{"name":"input_0","activation":"linear","weights":[],"bias":0}]},"cells":[{"outputNeurons":[{"weights":[{"weight":-1.302258849143982,"index":0}],"bias":1.0418460369110107,"name":"layer_0_output_0","activation":{"type":"interpolatedAmeo","factor":0.5,"leakyness":0.01}},null,{"weights":[{"weight":0.44918179512023926,"index":0}],"bias":0.09361828863620758,"name":"layer_0_output_2","activation":{"type":"interpolatedAmeo","factor":0.5,"leakyness":0.01}},{"weights":[{"weight":-1.3898459672927856,"index":0}],"bias":-0.312580406665802,"name":"layer_0_output_3","activation":{"type":"interpolatedAmeo","factor":0.5,"leakyness":0.01}},{"weights":[{"weight":-0.5509219169616699,"index":0}],"bias":0.20590710639953613,"name":"layer_0_output_4","activation":{"type":"interpolatedAmeo","factor":0.5,"leakyness":0.01}},{"weights":[{"weight":-1.1935828924179077,"index":0}],"bias":0.34680449962615967,"name":"layer_0_output_5","activation":{"type":"interpolatedAmeo","factor":0.5,"leakyness":0.01}},{"weights":[],"bias":0.21351823210716248,"name":"layer_0_output_6","activation":{"type":"interpolatedAmeo","factor":0.5,"leakyness":0.01}},{"weights":[{"weight":-0.3268051743507385,"index":0}],"bias":-0.11300478875637054,"name":"layer_0_output_7","activation":{"type":"interpolatedAmeo","factor":0.5,"leakyness":0.01}}],"recurrentNeurons":[],"stateNeurons":[],"outputDim":8},{"outputNeurons":[{"weights":[{"weight":0.6328311562538147,"index":2},{"weight":0.47096630930900574,"index":6},{"weight":-0.6744097471237183,"index":7}],"bias":0.10299275070428848,"name":"layer_1_output_0","activation":{"type":"interpolatedAmeo","factor":0.5,"leakyness":0.01}},{"weights":[{"weight":-1.0202131271362305,"index":3},{"weight":-0.8832091689109802,"index":4},{"weight":0.49551820755004883,"index":6}],"bias":0.3467811644077301,"name":"layer_1_output_1","activation":{"type":"interpolatedAmeo","factor":0.5,"leakyness":0.01}},{"weights":[{"weight":0.7203356027603149,"index":0},{"weight":0.8442057371139526,"index":2},{"weight":-1.034474492073059,"index":3},{"weight":0.5440526604652405,"index":4},{"weight":-0.2977524697780609,"index":7}],"bias":-0.09384726732969284,"name":"layer_1_output_2","activation":{"type":"interpolatedAmeo","factor":0.5,"leakyness":0.01}},null,null,{"weights":[{"weight":1.2735137939453125,"index":0},{"weight":1.339267373085022,"index":5},{"weight":0.3336324393749237,"index":6}],"bias":0.5395767092704773,"name":"layer_1_output_5","activation":{"type":"interpolatedAmeo","factor":0.5,"leakyness":0.01}},null,null],"recurrentNeurons":[],"stateNeurons":[],"outputDim":8}],"postLayers":[{"neurons":[{"weights":[{"weight":-0.30023521184921265,"index":0},{"weight":0.6543983817100525,"index":1},{"weight":-0.6389914751052856,"index":2},{"weight":0.8249670267105103,"index":5}],"bias":-0.17620137333869934,"name":"post_layer_output_0","activation":"linear"}],"outputDim":1}],"outputs":{"neurons":[{"name":"output_0","activation":"linear","weights":[{"weight":1,"index":0}],"bias":0}]}}
-# @jit(nopython=True)
-# def one_seq_examples(seq_len: int):
-#     inputs = np.random.uniform(-1, 1, (seq_len, 1)).astype(np.float32)
-#     outputs = np.sin(2 * np.pi * inputs).astype(np.float32)
+def fill_sin(rng: np.random.Generator, inputs: np.ndarray, outputs: np.ndarray):
+    inputs[:] = rng.uniform(-1, 1, inputs.shape)
+    np.sin(2 * np.pi * inputs, out=outputs)
 
-#     return inputs, outputs
 
 # asm interpreter
-# @jit(nopython=True)
-# def one_seq_examples(seq_len: int):
-#     # inputs are instructions.
-#     # instruction format:
-#     # bit 0: opcode
-#     #          -1: store
-#     #          1: mov
-#     # bit 1: rx register
-#     # bit 2: tx register or immediate in the case of store
-#     # output is the value written to the rx register
-
-#     reg0 = -1
-#     reg1 = -1
-
-#     inputs = np.empty((seq_len, 3), dtype=np.float32)
-#     outputs = np.empty((seq_len, 1), dtype=np.float32)
-
-#     tx_regs = np.random.choice(np.array([-1, 1]), seq_len)
-#     rx_regs = np.random.choice(np.array([-1, 1]), seq_len)
-#     opcodes = np.random.choice(np.array([-1, 1]), seq_len)
-#     immediates = np.random.choice(np.array([-1, 1]), seq_len)
-
-#     for i in range(seq_len):
-#         opcode = opcodes[i]
-#         rx = rx_regs[i]
-#         tx = tx_regs[i]
-
-#         if opcode == -1:
-#             # store
-#             imm = immediates[i]
-#             if rx == -1:
-#                 reg0 = imm
-#             else:
-#                 reg1 = imm
-#             inputs[i] = np.array([opcode, rx, imm])
-#             outputs[i][0] = imm
-#         else:
-#             # mov
-#             val = reg0 if rx == -1 else reg1
-#             if tx == -1:
-#                 reg0 = val
-#             else:
-#                 reg1 = val
-#             inputs[i] = np.array([opcode, rx, tx])
-#             outputs[i][0] = val
-
-#     return inputs, outputs
-
-
-# @jit(nopython=True)
-# def one_seq_examples(seq_len: int, max_depth: int = 8):
-#     # Inputs are sequences of parentheses.
-#     # '(' is represented as -1, ')' is represented as 1.
-#     # Outputs are binary sequences indicating whether each prefix of the
-#     # input sequence is properly parenthesized.
-
-#     inputs = np.empty((seq_len, 1), dtype=np.float32)
-#     outputs = np.empty((seq_len, 1), dtype=np.float32)
-
-#     depth = 0  # Current parentheses depth
-
-#     for i in range(seq_len):
-#         # Choose next character. Generate '(' if depth < max_depth
-#         # and either depth is 0 (so we can't close yet) or with probability 0.5.
-#         # Otherwise, generate ')'.
-#         if depth < max_depth and (depth == 0 or np.random.choice(np.array([0, 1])) == 0):
-#             inputs[i] = -1  # '('
-#             depth += 1
-#         else:
-#             inputs[i] = 1  # ')'
-#             depth -= 1
-
-#         # Check if the prefix up to this point is valid (properly parenthesized).
-#         # It's valid if depth >= 0 (every ')' had a matching '(').
-#         outputs[i] = 1 if depth == 0 else -1
-
-#     return inputs, outputs
-
-
-# # debug: passthru inputs
-# def one_seq_examples(seq_len):
-#     inputs = []
-#     outputs = []
-#     for i in range(seq_len):
-#         input_val = np.array([one_val()]).astype(np.float32)
-#         output_val = input_val
-#         inputs.append(input_val)
-#         outputs.append(output_val)
-#     inputs = np.array(inputs)
-#     outputs = np.array(outputs)
-#     return inputs, outputs
+#
+# inputs are instructions.
+# instruction format:
+# bit 0: opcode
+#          -1: store
+#          1: mov
+# bit 1: rx register
+# bit 2: tx register or immediate in the case of store
+# output is the value written to the rx register
+@jit(nopython=True, parallel=True)
+def asm_interpreter_kernel(inputs: np.ndarray, outputs: np.ndarray):
+    for batch_ix in prange(inputs.shape[0]):
+        reg0 = -1.0
+        reg1 = -1.0
+
+        for i in range(inputs.shape[1]):
+            opcode = inputs[batch_ix, i, 0]
+            rx = inputs[batch_ix, i, 1]
+
+            if opcode == -1:
+                # store
+                imm = inputs[batch_ix, i, 2]
+                if rx == -1:
+                    reg0 = imm
+                else:
+                    reg1 = imm
+                outputs[batch_ix, i, 0] = imm
+            else:
+                # mov
+                tx = inputs[batch_ix, i, 2]
+                val = reg0 if rx == -1 else reg1
+                if tx == -1:
+                    reg0 = val
+                else:
+                    reg1 = val
+                outputs[batch_ix, i, 0] = val
+
+
+def fill_asm_interpreter(rng: np.random.Generator, inputs: np.ndarray, outputs: np.ndarray):
+    # The third input is the tx register for movs and the immediate for stores; both are uniform
+    # random signs so they can share a draw.
+    fill_random_signs(rng, inputs)
+    asm_interpreter_kernel(inputs, outputs)
+
+
+# Inputs are sequences of parentheses.
+# '(' is represented as -1, ')' is represented as 1.
+# Outputs are binary sequences indicating whether each prefix of the
+# input sequence is properly parenthesized.
+@jit(nopython=True, parallel=True)
+def balanced_parens_kernel(coins: np.ndarray, inputs: np.ndarray, outputs: np.ndarray, max_depth):
+    for batch_ix in prange(inputs.shape[0]):
+        depth = 0  # Current parentheses depth
+
+        for i in range(inputs.shape[1]):
+            # Choose next character. Generate '(' if depth < max_depth
+            # and either depth is 0 (so we can't close yet) or with probability 0.5.
+            # Otherwise, generate ')'.
+            if depth < max_depth and (depth == 0 or coins[batch_ix, i]):
+                inputs[batch_ix, i, 0] = -1  # '('
+                depth += 1
+            else:
+                inputs[batch_ix, i, 0] = 1  # ')'
+                depth -= 1
+
+            # Check if the prefix up to this point is valid (properly parenthesized).
+            # It's valid if depth >= 0 (every ')' had a matching '(').
+            outputs[batch_ix, i, 0] = 1 if depth == 0 else -1
+
+
+def fill_balanced_parens(
+    rng: np.random.Generator, inputs: np.ndarray, outputs: np.ndarray, max_depth=8
+):
+    coins = rng.random(inputs.shape[:2]) < 0.5
+    balanced_parens_kernel(coins, inputs, outputs, max_depth)
 
 
 # y_n =
-#   -1 if n = 0
-#   x_{n-1} otherwise
-# def one_seq_examples(seq_len):
-#     inputs = []
-#     outputs = []
-#     for i in range(seq_len):
-#         input_val = np.array([one_val()]).astype(np.float32)
-#         output_val = np.array([-1]).astype(np.float32) if i == 0 else inputs[-1]
-#         inputs.append(input_val)
-#         outputs.append(output_val)
-#     inputs = np.array(inputs)
-#     outputs = np.array(outputs)
-#     return inputs, outputs
+#   -1 if n < delay
+#   x_{n-delay} otherwise
+#
+# `delay=0` passes inputs through directly, which is useful for debugging.
+def fill_delay(rng: np.random.Generator, inputs: np.ndarray, outputs: np.ndarray, delay=1):
+    fill_random_signs(rng, inputs)
+    delay_targets(inputs, outputs, delay)
 
 
-# y_n =
-#   -1 if n < 2
-#   x_{n-2} otherwise
-# def one_seq_examples(seq_len):
-#     inputs = []
-#     outputs = []
-#     for i in range(seq_len):
-#         input_val = np.array([one_val()]).astype(np.float32)
-#         output_val = np.array([-1]).astype(np.float32) if i == 0 or i == 1 else inputs[-2]
-#         inputs.append(input_val)
-#         outputs.append(output_val)
-#     inputs = np.array(inputs)
-#     outputs = np.array(outputs)
-#     return inputs, outputs
+def delay_targets(inputs: np.ndarray, outputs: np.ndarray, delay=1):
+    # Sequences no longer than the delay are all -1
+    delay = min(delay, inputs.shape[1])
+    outputs[:, :delay] = -1
+    outputs[:, delay:] = inputs[:, : inputs.shape[1] - delay]
 
 
 # replace '1'->'111'
 # Training input  : -1, -1, 1, -1, -1, -1, 1
 # Expected outout : -1, -1, 1,  1,  1, -1, 1
-def one_seq_examples(seq_len):
-    inputs = []
-    outputs = []
-    replace_count = 0
-
-    for i in range(seq_len):
-        input_val = np.array([one_val()]).astype(np.float32)
-        output_val = input_val
-
-        if input_val == 1:
-            replace_count = 3
-
-        if replace_count > 0:
-            output_val = np.array([1]).astype(np.float32)
-            replace_count -= 1
-
-        inputs.append(input_val)
-        outputs.append(output_val)
-
-    inputs = np.array(inputs)
-    outputs = np.array(outputs)
-    return inputs, outputs
-
-
-@jit(forceobj=True)
-def one_batch_examples(batch_size: int, seq_len: int):
-    inputs = []
-    outputs = []
-    for _ in range(batch_size):
-        x, y = one_seq_examples(seq_len)
-        inputs.append(x)
-        outputs.append(y)
-    return np.array(inputs), np.array(outputs)
+def fill_replace_1_to_111(rng: np.random.Generator, inputs: np.ndarray, outputs: np.ndarray):
+    fill_random_signs(rng, inputs)
+    replace_1_to_111_targets(inputs, outputs)
+
+
+def replace_1_to_111_targets(inputs: np.ndarray, outputs: np.ndarray):
+    # Every 1 in the input turns on the output for itself and the following two timesteps
+    hits = inputs[:, :, 0] == 1.0
+    window = hits.copy()
+    window[:, 1:] |= hits[:, :-1]
+    window[:, 2:] |= hits[:, :-2]
+    outputs[:, :, 0] = np.where(window, 1.0, -1.0)
+
+
+class Objective:
+    def __init__(
+        self,
+        name: str,
+        input_dim: int,
+        output_dim: int,
+        fill: Callable[[np.random.Generator, np.ndarray, np.ndarray], None],
+        compute_targets: Optional[Callable[[np.ndarray, np.ndarray], None]] = None,
+        generate_on_device: Optional[
+            Callable[[BatchPositions, Tensor], Tuple[Tensor, Tensor]]
+        ] = None,
+    ):
+        self.name = name
+        self.input_dim = input_dim
+        self.output_dim = output_dim
+        self.fill = fill
+        # For objectives whose inputs are random signs and whose outputs are fully determined by
+        # them, writes the expected outputs for any given inputs.  This allows every possible
+        # input sequence to be checked by `validate.run_exhaustive_validation`.
+        self.compute_targets = compute_targets
+        # For objectives that can be expressed as tensor ops, builds `(inputs, outputs)` for a
+        # batch with the given `BatchPositions` on the device from a seed tensor; see
+        # `device_data.py`.  `fill` is used for everything else.
+        self.generate_on_device = generate_on_device
+        # The id this objective was built from; set by `build_objective`
+        self.id: Union[str, Dict[str, Any]] = name
+
+    def __repr__(self):
+        return f"Objective({self.name}, input_dim={self.input_dim}, output_dim={self.output_dim})"
+
+    def mk_buffers(self, batch_size: int, seq_len: int) -> Tuple[np.ndarray, np.ndarray]:
+        return mk_batch_buffers(batch_size, seq_len, self.input_dim, self.output_dim)
+
+    def one_batch_examples(
+        self, batch_size: int, seq_len: int, rng: Optional[np.random.Generator] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        inputs, outputs = self.mk_buffers(batch_size, seq_len)
+        self.fill(rng if rng is not None else np.random.default_rng(), inputs, outputs)
+        return inputs, outputs
+
+
+# Maps objective ids to factories.  Keyword arguments for the factories come from the non-`id`
+# fields of dict objective ids, so `{"id": "delay", "delay": 2}` builds a delay-by-2 objective.
+OBJECTIVES: Dict[str, Callable[..., Objective]] = {
+    "replace_1_to_111": lambda: Objective(
+        "replace_1_to_111",
+        1,
+        1,
+        fill_replace_1_to_111,
+        replace_1_to_111_targets,
+        generate_replace_1_to_111,
+    ),
+    "gated_fsm": lambda change_mode_prob=0.3: Objective(
+        "gated_fsm",
+        3,
+        1,
+        partial(fill_gated_fsm, change_mode_prob=change_mode_prob),
+        gated_fsm_targets,
+        partial(generate_gated_fsm, change_mode_prob=change_mode_prob),
+    ),
+    "asm_interpreter": lambda: Objective(
+        "asm_interpreter", 3, 1, fill_asm_interpreter, asm_interpreter_kernel
+    ),
+    "balanced_parens": lambda max_depth=8: Objective(
+        f"balanced_parens({max_depth})",
+        1,
+        1,
+        partial(fill_balanced_parens, max_depth=max_depth),
+    ),
+    "delay": lambda delay=1: Objective(
+        f"delay({delay})",
+        1,
+        1,
+        partial(fill_delay, delay=delay),
+        partial(delay_targets, delay=delay),
+        partial(generate_delay, delay=delay),
+    ),
+    "sin": lambda: Objective("sin", 1, 1, fill_sin, generate_on_device=generate_sin),
+}
+
+
+def build_objective(id: Union[str, Dict[str, Any]]) -> Objective:
+    if isinstance(id, dict):
+        params = {k: v for k, v in id.items() if k != "id"}
+        name = id["id"]
+    else:
+        params = {}
+        name = id
+
+    factory = OBJECTIVES.get(name)
+    if factory is None:
+        raise ValueError(f"Unknown objective: {name}")
+    objective = factory(**params)
+    objective.id = id
+    return objective
+
+
+def one_batch_examples(batch_size: int, seq_len: int, rng: Optional[np.random.Generator] = None):
+    return build_objective("replace_1_to_111").one_batch_examples(batch_size, seq_len, rng)
@@ -0,0 +1,512 @@
+import argparse
+import json
+import math
+import multiprocessing
+import os
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from tinygrad.jit import TinyJit
+from tinygrad.nn import Linear
+from tinygrad.nn.optim import Adam, LAMB
+from tinygrad.tensor import Tensor
+
+from custom_rnn import CustomRNN, build_activation, build_initializer
+from driver import data_gen_worker
+from objective import build_objective
+from ring_buffer import SharedRingBuffer
+from run_config import build_regularizer, load_run_config, scheduled_values
+from scalar_tensor import assign_scalar
+from sparse_regularizer import SparseRegularizer
+from validate import run_validation
+
+
+class PopulationRNN:
+    """
+    `size` independently initialized copies of the model described by a run config, trained
+    together as one batched computation.
+
+    Every weight is stacked along a new leading member axis, so each matmul of the model becomes a
+    single batched matmul over the whole population.  All members see the same batches.  The loss
+    that's optimized is the sum of the members' losses, so each member gets exactly the gradients
+    it would get if it were trained on its own, and since Adam works elementwise each member's
+    slice of the weights follows the same trajectory as an independent run.
+
+    Weights are stored by the names used in binary checkpoints (`cells.0.output_kernel`,
+    `post_layers.0.weights`, ...), with shapes `(size, *shape_in_a_single_model)`.
+    """
+
+    def __init__(
+        self,
+        config: Dict[str, Any],
+        input_dim: int,
+        output_dim: int,
+        size: int,
+        reg: SparseRegularizer,
+    ):
+        self.size = size
+        self.input_dim = input_dim
+        self.output_dim = output_dim
+        self.reg = reg
+        self.cell_configs = config["cells"]
+        self.post_layer_activation_id = config["post_layer_activation"]
+        self.regularize_post_layer = config["regularize_post_layer"]
+
+        self.weights: Dict[str, Tensor] = {}
+        self.trainable: List[str] = []
+
+        def add_weight(name: str, init: Callable[[], Tensor], trainable=True):
+            # Each member is initialized exactly as a standalone model would be
+            members = [init().numpy() for _ in range(size)]
+            self.weights[name] = Tensor(np.stack(members).astype(np.float32))
+            if trainable:
+                self.trainable.append(name)
+            else:
+                self.weights[name].requires_grad = False
+
+        self.output_activations = []
+        self.recurrent_activations = []
+        self.can_fuse = []
+        cell_input_dim = input_dim
+        for cell_ix, cell in enumerate(self.cell_configs):
+            rows = cell_input_dim + cell["state_size"]
+            prefix = f"cells.{cell_ix}"
+            kernel_init = build_initializer(cell["kernel_initializer"])
+            recurrent_init = build_initializer(cell["recurrent_initializer"])
+            bias_init = build_initializer(cell["bias_initializer"])
+            initial_state_init = build_initializer(cell["initial_state_initializer"])
+
+            add_weight(f"{prefix}.output_kernel", lambda: kernel_init((rows, cell["output_dim"])))
+            if cell["state_size"] > 0:
+                add_weight(
+                    f"{prefix}.recurrent_kernel",
+                    lambda: recurrent_init((rows, cell["state_size"])),
+                )
+            if cell["use_bias"]:
+                add_weight(f"{prefix}.output_bias", lambda: bias_init((cell["output_dim"],)))
+                if cell["state_size"] > 0:
+                    add_weight(f"{prefix}.recurrent_bias", lambda: bias_init((cell["state_size"],)))
+            if cell["state_size"] > 0:
+                add_weight(
+                    f"{prefix}.initial_state",
+                    lambda: initial_state_init((cell["state_size"],)),
+                    trainable=cell["trainable_initial_weights"],
+                )
+
+            self.output_activations.append(build_activation(cell["output_activation"]))
+            self.recurrent_activations.append(build_activation(cell["recurrent_activation"]))
+            self.can_fuse.append(
+                cell["state_size"] > 0 and cell["output_activation"] == cell["recurrent_activation"]
+            )
+            cell_input_dim = cell["output_dim"]
+
+        self.has_post_layer = cell_input_dim != output_dim
+        if self.has_post_layer:
+            post_layer_input_dim = cell_input_dim
+
+            def init_post_layer() -> Tuple[Tensor, Tensor]:
+                layer = Linear(post_layer_input_dim, output_dim, bias=True)
+                return layer.weight, layer.bias
+
+            layers = [init_post_layer() for _ in range(size)]
+            for key, ix in [("weights", 0), ("bias", 1)]:
+                name = f"post_layers.0.{key}"
+                self.weights[name] = Tensor(np.stack([layer[ix].numpy() for layer in layers]))
+                self.trainable.append(name)
+        self.post_layer_activation = build_activation(self.post_layer_activation_id)
+
+    def get_trainable_params(self) -> List[Tensor]:
+        return [self.weights[name] for name in self.trainable]
+
+    def get_weight(self, cell_ix: int, key: str) -> Optional[Tensor]:
+        return self.weights.get(f"cells.{cell_ix}.{key}")
+
+    def get_cell_params(self, cell_ix: int) -> List[Tuple[Tensor, Optional[Tensor]]]:
+        """
+        Returns the `(kernel, bias)` pairs applied by a cell, with biases reshaped to
+        `(size, 1, dim)` so they broadcast over the batch.  As in `CustomRNNCell`, the output and
+        recurrent kernels are concatenated into one when both activations match.
+        """
+        output_kernel = self.get_weight(cell_ix, "output_kernel")
+        recurrent_kernel = self.get_weight(cell_ix, "recurrent_kernel")
+        output_bias = self.get_weight(cell_ix, "output_bias")
+        recurrent_bias = self.get_weight(cell_ix, "recurrent_bias")
+
+        def batched_bias(bias: Optional[Tensor]) -> Optional[Tensor]:
+            return bias.reshape(self.size, 1, bias.shape[-1]) if bias is not None else None
+
+        if self.can_fuse[cell_ix]:
+            kernel = output_kernel.cat(recurrent_kernel, dim=2)
+            bias = output_bias.cat(recurrent_bias, dim=1) if output_bias is not None else None
+            return [(kernel, batched_bias(bias))]
+        if recurrent_kernel is None:
+            return [(output_kernel, batched_bias(output_bias))]
+        return [
+            (output_kernel, batched_bias(output_bias)),
+            (recurrent_kernel, batched_bias(recurrent_bias)),
+        ]
+
+    def forward(self, inputs: Tensor) -> Tensor:
+        """
+        Runs a `(batch, seq_len, input_dim)` batch through every member, returning outputs of
+        shape `(size, batch, seq_len, output_dim)`
+        """
+        batch_size, seq_len = inputs.shape[0], inputs.shape[1]
+        cell_params = [self.get_cell_params(cell_ix) for cell_ix in range(len(self.cell_configs))]
+        states = []
+        for cell_ix, cell in enumerate(self.cell_configs):
+            initial_state = self.get_weight(cell_ix, "initial_state")
+            states.append(
+                initial_state.reshape(self.size, 1, cell["state_size"]).expand(
+                    self.size, batch_size, cell["state_size"]
+                )
+                if initial_state is not None
+                else None
+            )
+
+        # The first cell's input projection is shared by all timesteps, so it's hoisted out of the
+        # loop as in `CustomRNN`.  The inputs are broadcast across the member axis.
+        flat_inputs = inputs.reshape(1, batch_size * seq_len, self.input_dim)
+        first_projected = []
+        for kernel, bias in cell_params[0]:
+            proj = flat_inputs.dot(kernel[:, : self.input_dim])
+            if bias is not None:
+                proj = proj + bias
+            first_projected.append(proj.reshape(self.size, batch_size, seq_len, kernel.shape[2]))
+
+        outputs = []
+        for seq_ix in range(seq_len):
+            cell_input_dim = self.input_dim
+            for cell_ix, cell in enumerate(self.cell_configs):
+                if cell_ix == 0:
+                    projected = [proj[:, :, seq_ix, :] for proj in first_projected]
+                else:
+                    projected = []
+                    for kernel, bias in cell_params[cell_ix]:
+                        proj = output.dot(kernel[:, :cell_input_dim])
+                        projected.append(proj + bias if bias is not None else proj)
+                output, states[cell_ix] = self.call_projected(
+                    cell_ix, cell_params[cell_ix], projected, states[cell_ix], cell_input_dim
+                )
+                cell_input_dim = cell["output_dim"]
+            outputs.append(output)
+        output = Tensor.stack(outputs, dim=2)
+
+        if self.has_post_layer:
+            weights = self.weights["post_layers.0.weights"]
+            bias = self.weights["post_layers.0.bias"]
+            flat_output = output.reshape(self.size, batch_size * seq_len, weights.shape[2])
+            output = flat_output.dot(weights.permute(0, 2, 1)) + bias.reshape(
+                self.size, 1, self.output_dim
+            )
+            output = self.post_layer_activation(
+                output.reshape(self.size, batch_size, seq_len, self.output_dim)
+            )
+        return output
+
+    def call_projected(
+        self,
+        cell_ix: int,
+        params: List[Tuple[Tensor, Optional[Tensor]]],
+        projected: List[Tensor],
+        prev_state: Optional[Tensor],
+        cell_input_dim: int,
+    ) -> Tuple[Tensor, Optional[Tensor]]:
+        output_dim = self.cell_configs[cell_ix]["output_dim"]
+        output_activation = self.output_activations[cell_ix]
+        if prev_state is None:
+            return output_activation(projected[0]), None
+
+        pre_activations = [
+            proj + prev_state.dot(kernel[:, cell_input_dim:])
+            for proj, (kernel, _) in zip(projected, params)
+        ]
+        if self.can_fuse[cell_ix]:
+            combined = output_activation(pre_activations[0])
+            return combined[:, :, :output_dim], combined[:, :, output_dim:]
+        return (
+            output_activation(pre_activations[0]),
+            self.recurrent_activations[cell_ix](pre_activations[1]),
+        )
+
+    def get_regularization_loss(self) -> Tensor:
+        """
+        Returns the mean regularization loss of the members.
+
+        The regularizer averages over every element of the tensor it's given, so applied to a
+        stacked weight it returns the mean of the members' penalties.
+        """
+        names = [
+            f"cells.{cell_ix}.{key}"
+            for cell_ix, cell in enumerate(self.cell_configs)
+            for key in cell["regularize"]
+            if f"cells.{cell_ix}.{key}" in self.weights
+        ]
+        if self.has_post_layer and self.regularize_post_layer:
+            names.append("post_layers.0.weights")
+
+        loss = Tensor(0.0)
+        for name in names:
+            loss = loss + self.reg(self.weights[name])
+        return loss
+
+    def select_members(self, member_ixs: List[int], opt: LAMB) -> LAMB:
+        """
+        Keeps only the given members, in the given order, returning a new optimizer whose state
+        is sliced from `opt` so that the survivors continue training exactly where they left off
+        """
+        moments = {
+            name: (m.numpy()[member_ixs], v.numpy()[member_ixs])
+            for name, m, v in zip(self.trainable, opt.m, opt.v)
+        }
+        for name, t in self.weights.items():
+            requires_grad = t.requires_grad
+            self.weights[name] = Tensor(np.ascontiguousarray(t.numpy()[member_ixs]))
+            self.weights[name].requires_grad = requires_grad
+        self.size = len(member_ixs)
+
+        new_opt = Adam(self.get_trainable_params(), 0.0)
+        for name, m, v in zip(self.trainable, new_opt.m, new_opt.v):
+            m.assign(Tensor(np.ascontiguousarray(moments[name][0]))).realize()
+            v.assign(Tensor(np.ascontiguousarray(moments[name][1]))).realize()
+        new_opt.t.assign(Tensor(opt.t.numpy())).realize()
+        new_opt.lr.assign(Tensor(opt.lr.numpy())).realize()
+        return new_opt
+
+    def get_member_weights_dict(self, member_ix: int) -> Dict[str, Any]:
+        """
+        Returns a single member in the format written by `CustomRNN.dump_weights`, with the
+        weights as arrays
+        """
+
+        def member(name: str) -> Optional[np.ndarray]:
+            t = self.weights.get(name)
+            return t.numpy()[member_ix] if t is not None else None
+
+        return {
+            "input_dim": self.input_dim,
+            "output_dim": self.output_dim,
+            "cells": [
+                {
+                    "state_size": cell["state_size"],
+                    "output_dim": cell["output_dim"],
+                    "output_kernel": member(f"cells.{cell_ix}.output_kernel"),
+                    "output_bias": member(f"cells.{cell_ix}.output_bias"),
+                    "recurrent_kernel": member(f"cells.{cell_ix}.recurrent_kernel"),
+                    "recurrent_bias": member(f"cells.{cell_ix}.recurrent_bias"),
+                    "initial_state": member(f"cells.{cell_ix}.initial_state"),
+                    "recurrent_activation": cell["recurrent_activation"],
+                    "output_activation": cell["output_activation"],
+                }
+                for cell_ix, cell in enumerate(self.cell_configs)
+            ],
+            "post_layers": (
+                [
+                    {
+                        "input_dim": self.cell_configs[-1]["output_dim"],
+                        "output_dim": self.output_dim,
+                        "weights": member("post_layers.0.weights"),
+                        "bias": member("post_layers.0.bias"),
+                        "activation": self.post_layer_activation_id,
+                    }
+                ]
+                if self.has_post_layer
+                else []
+            ),
+        }
+
+
+def prune_count(size: int, population_config: Dict[str, Any]) -> int:
+    """
+    Returns how many members to keep when pruning a population of `size`
+    """
+    keep = math.ceil(size * population_config["keep_fraction"])
+    return max(min(keep, size), population_config["min_size"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Train several independently initialized copies of a model at once, pruning "
+        "the worst of them as training goes on and keeping the best"
+    )
+    parser.add_argument(
+        "--output-dir",
+        default="output",
+        help="directory to write the best member's weights and the member losses to",
+    )
+    parser.add_argument(
+        "--config",
+        default=os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), "configs/replace_1_to_111.yaml"
+        ),
+        help="YAML or JSON run config; see `run_config.py` for the available settings",
+    )
+    parser.add_argument(
+        "--set",
+        dest="overrides",
+        action="append",
+        default=[],
+        metavar="KEY.PATH=VALUE",
+        help="override a config setting, like `--set population.size=16`; may be repeated",
+    )
+    args = parser.parse_args()
+
+    config = load_run_config(args.config, args.overrides)
+    if config["tbptt_chunk_len"] is not None:
+        raise ValueError("Population training doesn't support tbptt_chunk_len")
+    if config["data"]["dataset_path"] is not None:
+        raise ValueError("Population training doesn't support training from a dataset cache")
+    population_config = config["population"]
+    os.makedirs(args.output_dir, exist_ok=True)
+    with open(os.path.join(args.output_dir, "config.json"), "wt") as f:
+        json.dump(config, f, indent=2)
+
+    objective = build_objective(config["objective"])
+    seq_len = config["seq_len"]
+    batch_size = config["batch_size"]
+    seed = config["seed"]
+
+    np.set_printoptions(suppress=True)
+    np.random.seed(seed)
+    Tensor.manual_seed(seed)
+
+    reg = build_regularizer(config)
+    population = PopulationRNN(
+        config, objective.input_dim, objective.output_dim, population_config["size"], reg
+    )
+    opt = Adam(population.get_trainable_params(), config["learning_rate"])
+
+    def mk_train_one_batch():
+        @TinyJit
+        def train_one_batch(x: Tensor, y: Tensor) -> Tuple[Tensor, Tensor]:
+            y_pred = population.forward(x)
+            member_losses = (y_pred - y.reshape(1, *y.shape)).pow(2).mean(axis=(1, 2, 3))
+            # Scaled so that each member's gradient matches what it would be if it were trained
+            # alone with the same regularizer
+            reg_loss = population.get_regularization_loss()
+            loss = member_losses.sum() + reg_loss * population.size
+            member_losses.realize()
+            reg_loss.realize()
+
+            opt.zero_grad()
+            loss.backward()
+            opt.step()
+            return member_losses.realize(), reg_loss.reshape((1,)).realize()
+
+        return train_one_batch
+
+    multiprocessing.freeze_support()
+    data_gen_worker_count = config["data"]["workers"]
+    data_source = SharedRingBuffer(
+        slot_count=data_gen_worker_count + config["data"]["extra_slots"],
+        x_shape=(batch_size, seq_len, objective.input_dim),
+        y_shape=(batch_size, seq_len, objective.output_dim),
+    )
+    workers = [
+        multiprocessing.Process(
+            target=data_gen_worker, args=(data_source, objective, seed), daemon=True
+        )
+        for _ in range(data_gen_worker_count)
+    ]
+    for worker in workers:
+        worker.start()
+    data_source.watch_producers(workers)
+
+    # Index of each surviving member in the initial population, so that members can be followed
+    # across pruning
+    member_ids = np.arange(population.size)
+    # Loss history of every member of the initial population; pruned members stop getting entries
+    member_losses: Dict[int, List[float]] = {int(member_id): [] for member_id in member_ids}
+    reg_losses = []
+
+    def recent_losses() -> np.ndarray:
+        window = population_config["loss_window"]
+        return np.array(
+            [np.mean(member_losses[int(member_id)][-window:]) for member_id in member_ids]
+        )
+
+    try:
+        train_one_batch = mk_train_one_batch()
+        current_lr = None
+        for i in range(config["iterations"]):
+            scheduled_lr, reg.intensity = scheduled_values(config, i)
+            if scheduled_lr != current_lr:
+                current_lr = scheduled_lr
+                assign_scalar(opt.lr, current_lr)
+
+            slot_ix, _batch_ix, x, y = data_source.get()
+            losses, reg_loss = train_one_batch(Tensor(x), Tensor(y))
+            losses, reg_loss = losses.numpy(), float(reg_loss.numpy()[0])
+            data_source.release(slot_ix)
+            for member_id, loss in zip(member_ids, losses):
+                member_losses[int(member_id)].append(float(loss))
+            reg_losses.append(reg_loss)
+            print(f"[{i}]: best loss: {losses.min()}; mean reg loss: {reg_loss}")
+
+            prune_every = population_config["prune_every"]
+            if (
+                prune_every > 0
+                and (i + 1) % prune_every == 0
+                and i + 1 < config["iterations"]
+                and population.size > population_config["min_size"]
+            ):
+                # Members are ranked by their recent loss on the task; the regularizer is applied
+                # identically to all of them
+                recent = recent_losses()
+                keep_ixs = list(
+                    np.argsort(recent)[: prune_count(population.size, population_config)]
+                )
+                pruned_ids = [
+                    int(member_ids[ix]) for ix in range(len(member_ids)) if ix not in keep_ixs
+                ]
+                print(
+                    f"[{i}]: pruning members {pruned_ids}; keeping {list(member_ids[keep_ixs])} "
+                    f"with recent losses {recent[keep_ixs]}"
+                )
+                opt = population.select_members(keep_ixs, opt)
+                member_ids = member_ids[keep_ixs]
+                current_lr = None
+                # The population has a different size now, so the step is traced again
+                train_one_batch = mk_train_one_batch()
+    finally:
+        data_source.close()
+        for worker in workers:
+            worker.join()
+        data_source.unlink()
+
+    print("Done training")
+    recent = recent_losses()
+    for ix in np.argsort(recent):
+        print(f"member {member_ids[ix]}: recent loss {recent[ix]}")
+    best_ix = int(np.argmin(recent))
+    print(f"Best member: {member_ids[best_ix]}")
+
+    rnn, post_layers = CustomRNN.from_weights_dict(population.get_member_weights_dict(best_ix))
+    rnn.dump_weights(post_layers, os.path.join(args.output_dir, "weights.json"))
+    losses_path = os.path.join(args.output_dir, "losses.json")
+    with open(losses_path, "wt") as f:
+        json.dump(
+            {
+                "best_member": int(member_ids[best_ix]),
+                "members": {str(member_id): losses for member_id, losses in member_losses.items()},
+                "reg_losses": reg_losses,
+            },
+            f,
+        )
+    print(f"Saved losses to {losses_path}")
+
+    post_layer = post_layers[0] if post_layers else None
+    post_layer_activation = build_activation(config["post_layer_activation"])
+
+    def forward(x: Tensor) -> Tensor:
+        y = rnn(x)
+        if post_layer is not None:
+            y = post_layer_activation(post_layer[0](y))
+        return y
+
+    report = run_validation(objective.one_batch_examples, forward, config["validation_seq_len"])
+    report.print_summary()
+    validation_path = os.path.join(args.output_dir, "validation.json")
+    with open(validation_path, "wt") as f:
+        json.dump(report.to_dict(), f, indent=2)
+    print(f"Saved validation report to {validation_path}")
@@ -0,0 +1,160 @@
+import queue
+import threading
+from typing import Optional, Tuple, Union
+
+from tinygrad.jit import TinyJit
+from tinygrad.lazy import Device
+from tinygrad.runtime.lib import RawBufferCopyIn
+from tinygrad.tensor import Tensor
+
+from dataset_cache import CachedDataset
+from device_data import COORD_LIMIT, BatchPositions
+from objective import Objective, batch_rng
+from ring_buffer import SharedRingBuffer
+from scalar_tensor import assign_scalar, mk_scalar
+
+# Devices whose copies to the device can be issued from a background thread and are ordered after
+# kernels that were already launched.  CLANG runs kernels synchronously and OpenCL (GPU) uses a
+# single in-order queue.  CUDA and HIP contexts are bound to the thread that created them, and
+# Metal buffers are written directly through shared memory while kernels may still be reading
+# them, so batches are uploaded per step on those.
+PREFETCH_DEVICES = ["CLANG", "GPU"]
+
+
+def can_prefetch() -> bool:
+    return Device.DEFAULT in PREFETCH_DEVICES
+
+
+class DevicePrefetcher:
+    """
+    Uploads training batches to the device on a background thread, so that copying batch `k + 1`
+    overlaps with training on batch `k`.
+
+    Batches are copied into `depth` preallocated pairs of device buffers which are handed out in
+    turn.  The same tensors are passed to the jitted training step every time, so it replays with
+    them directly rather than creating new buffers for each batch.
+
+    A buffer is reused once the next batch has been requested with `get`, at which point the step
+    that read it has been run (or queued ahead of the copy).  Like the data source it wraps, each
+    batch's slot has to be passed to `release` once the device is done with it, since copies may
+    still be reading from host memory until then.
+    """
+
+    def __init__(
+        self,
+        data_source: Union[SharedRingBuffer, CachedDataset],
+        x_shape: Tuple[int, ...],
+        y_shape: Tuple[int, ...],
+        depth=2,
+    ):
+        self.data_source = data_source
+        self.buffers = [
+            (Tensor.empty(*x_shape).realize(), Tensor.empty(*y_shape).realize())
+            for _ in range(depth)
+        ]
+        for x_buf, y_buf in self.buffers:
+            if not isinstance(x_buf.lazydata.realized, RawBufferCopyIn):
+                raise ValueError(f"Can't copy batches directly to {Device.DEFAULT} buffers")
+
+        self.free_buffers: queue.Queue = queue.Queue()
+        for buf_ix in range(depth):
+            self.free_buffers.put(buf_ix)
+        self.ready: queue.Queue = queue.Queue()
+        self.in_use: Optional[int] = None
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self.upload, daemon=True)
+        self.thread.start()
+
+    def upload(self, poll_interval=0.1):
+        try:
+            while not self.stop.is_set():
+                try:
+                    buf_ix = self.free_buffers.get(timeout=poll_interval)
+                except queue.Empty:
+                    continue
+
+                batch = None
+                while batch is None and not self.stop.is_set():
+                    try:
+                        batch = self.data_source.get(timeout=poll_interval)
+                    except queue.Empty:
+                        continue
+                if batch is None:
+                    return
+
+                slot_ix, batch_ix, x, y = batch
+                x_buf, y_buf = self.buffers[buf_ix]
+                x_buf.lazydata.realized._copyin(x)
+                y_buf.lazydata.realized._copyin(y)
+                self.ready.put((buf_ix, slot_ix, batch_ix))
+        except Exception as e:
+            self.ready.put(e)
+
+    def get(self) -> Tuple[Optional[int], int, Tensor, Tensor]:
+        """
+        Blocks until the next batch is on the device and returns `(slot_ix, batch_ix, x, y)`,
+        mirroring `SharedRingBuffer.get`.  `x` and `y` are only valid until the next call.
+        """
+        if self.in_use is not None:
+            self.free_buffers.put(self.in_use)
+        item = self.ready.get()
+        if isinstance(item, Exception):
+            raise item
+        buf_ix, slot_ix, batch_ix = item
+        self.in_use = buf_ix
+        return (slot_ix, batch_ix, *self.buffers[buf_ix])
+
+    def release(self, slot_ix: Optional[int]):
+        self.data_source.release(slot_ix)
+
+    def close(self):
+        self.stop.set()
+        self.thread.join()
+
+
+class DeviceBatchSource:
+    """
+    Generates training batches directly on the device with the objective's `generate_on_device`,
+    with the same interface as `SharedRingBuffer`.  Nothing is generated on the host or copied to
+    the device other than one seed per batch.
+
+    Seeds are drawn from `batch_rng`, so like the host data stream, batch `k` only depends on the
+    seed and `k`.
+    """
+
+    def __init__(
+        self, objective: Objective, batch_size: int, seq_len: int, seed: int, start_batch_ix=0
+    ):
+        if objective.generate_on_device is None:
+            raise ValueError(f"{objective} can't be generated on the device")
+        generate = objective.generate_on_device
+        positions = BatchPositions(batch_size, seq_len, objective.input_dim)
+        self.seed = seed
+        self.batch_ix = start_batch_ix
+        self.batch_seed = mk_scalar(0.0)
+
+        # The batches are written into the same output buffers every time, which is fine since
+        # each one is only read by the step queued right after it was generated
+        @TinyJit
+        def generate_batch(batch_seed: Tensor) -> Tuple[Tensor, Tensor]:
+            x, y = generate(positions, batch_seed)
+            return x.realize(), y.realize()
+
+        self.generate_batch = generate_batch
+
+    def get(self, timeout: Optional[float] = None) -> Tuple[None, int, Tensor, Tensor]:
+        """
+        Returns `(None, batch_ix, x, y)` for the next step.  `x` and `y` are only valid until the
+        next call.
+        """
+        batch_ix = self.batch_ix
+        self.batch_ix += 1
+        # Seeds are hashed as a coordinate, so they're kept below `COORD_LIMIT` like the positions
+        assign_scalar(self.batch_seed, batch_rng(self.seed, batch_ix).random() * COORD_LIMIT)
+        return (None, batch_ix, *self.generate_batch(self.batch_seed))
+
+    def release(self, slot_ix: None):
+        pass
+
+    def close(self):
+        pass
@@ -0,0 +1,171 @@
+import contextlib
+import json
+import os
+import time
+from typing import Any, Dict, IO, List, Optional
+
+import numpy as np
+from tinygrad.helpers import GlobalCounters
+
+
+class StepProfiler:
+    """
+    Opt-in instrumentation for the training loop.
+
+    Each iteration is split into named phases timed with `phase`, and gauges like the number of
+    batches ready in the data queue are recorded with `sample`.  The number of kernels tinygrad
+    ran during the step, along with its estimates of the ops and memory traffic they took, are read
+    from `GlobalCounters` around each step.
+
+    A summary is printed every `report_every` steps.  Steps can also be streamed to a JSON lines
+    file with one object per step, and to a Chrome trace (viewable in `chrome://tracing` or
+    Perfetto) with one event per phase.
+
+    When disabled, all of this compiles down to a few no-op calls per phase.
+    """
+
+    def __init__(
+        self,
+        enabled=False,
+        report_every=100,
+        trace_path: Optional[str] = None,
+        jsonl_path: Optional[str] = None,
+    ):
+        self.enabled = enabled or trace_path is not None or jsonl_path is not None
+        self.report_every = report_every
+        self.trace_file: Optional[IO[str]] = None
+        self.jsonl_file: Optional[IO[str]] = None
+        if trace_path is not None:
+            self.trace_file = open(trace_path, "wt")
+            # The closing bracket is optional in the trace event format, so the trace stays valid
+            # even if training is killed
+            self.trace_file.write("[\n")
+        if jsonl_path is not None:
+            self.jsonl_file = open(jsonl_path, "wt")
+
+        self.pid = os.getpid()
+        self.start_ns = time.perf_counter_ns()
+        self.step: Optional[int] = None
+        self.step_start_ns = 0
+        self.step_counters: Dict[str, float] = {}
+        self.phase_ns: Dict[str, int] = {}
+        self.samples: Dict[str, float] = {}
+        # Per-step records since the last printed summary
+        self.window: List[Dict[str, Any]] = []
+
+    def read_counters(self) -> Dict[str, float]:
+        return {
+            "kernels": GlobalCounters.kernel_count,
+            "ops": GlobalCounters.global_ops,
+            "mem_bytes": GlobalCounters.global_mem,
+        }
+
+    def begin_step(self, step: int):
+        if not self.enabled:
+            return
+        self.step = step
+        self.phase_ns = {}
+        self.samples = {}
+        self.step_counters = self.read_counters()
+        self.step_start_ns = time.perf_counter_ns()
+
+    @contextlib.contextmanager
+    def timed_phase(self, name: str):
+        start_ns = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            end_ns = time.perf_counter_ns()
+            self.phase_ns[name] = self.phase_ns.get(name, 0) + end_ns - start_ns
+            if self.trace_file is not None:
+                self.write_trace_event(
+                    {
+                        "name": name,
+                        "ph": "X",
+                        "ts": (start_ns - self.start_ns) / 1000,
+                        "dur": (end_ns - start_ns) / 1000,
+                        "args": {"step": self.step},
+                    }
+                )
+
+    def phase(self, name: str):
+        """
+        Context manager that adds the time spent inside it to the given phase of the current step
+        """
+        if not self.enabled:
+            return contextlib.nullcontext()
+        return self.timed_phase(name)
+
+    def sample(self, name: str, value: Optional[float]):
+        if not self.enabled or value is None:
+            return
+        self.samples[name] = value
+        if self.trace_file is not None:
+            self.write_trace_event(
+                {
+                    "name": name,
+                    "ph": "C",
+                    "ts": (time.perf_counter_ns() - self.start_ns) / 1000,
+                    "args": {name: value},
+                }
+            )
+
+    def end_step(self):
+        if not self.enabled:
+            return
+        wall_ns = time.perf_counter_ns() - self.step_start_ns
+        counters = self.read_counters()
+        record = {
+            "step": self.step,
+            "wall_ms": wall_ns / 1e6,
+            "phases_ms": {name: ns / 1e6 for name, ns in self.phase_ns.items()},
+            **{name: counters[name] - self.step_counters[name] for name in counters},
+            **self.samples,
+        }
+        if self.jsonl_file is not None:
+            self.jsonl_file.write(json.dumps(record) + "\n")
+
+        self.window.append(record)
+        if len(self.window) >= self.report_every:
+            self.print_summary()
+            self.window = []
+
+    def print_summary(self):
+        if len(self.window) == 0:
+            return
+        wall_ms = np.mean([record["wall_ms"] for record in self.window])
+        phase_names = list(dict.fromkeys(name for r in self.window for name in r["phases_ms"]))
+        phases = ", ".join(
+            f"{name} {ms:.2f}ms ({ms / wall_ms * 100:.0f}%)"
+            for name in phase_names
+            for ms in [np.mean([r["phases_ms"].get(name, 0.0) for r in self.window])]
+        )
+        extra_keys = [key for key in self.window[-1] if key not in ["step", "wall_ms", "phases_ms"]]
+        extras = ", ".join(
+            f"{key} {np.mean([r[key] for r in self.window if key in r]):.4g}" for key in extra_keys
+        )
+        print(
+            f"[profile] steps {self.window[0]['step']}-{self.window[-1]['step']}: "
+            f"{wall_ms:.2f}ms/step; {phases}; per step: {extras}"
+        )
+
+    def write_trace_event(self, event: Dict[str, Any]):
+        event["pid"] = self.pid
+        event["tid"] = 0
+        self.trace_file.write(json.dumps(event) + ",\n")
+
+    def close(self):
+        if not self.enabled:
+            return
+        self.print_summary()
+        if self.trace_file is not None:
+            # Metadata events are allowed anywhere, which conveniently avoids a trailing comma
+            self.trace_file.write(
+                json.dumps(
+                    {"name": "process_name", "ph": "M", "pid": self.pid, "args": {"name": "train"}}
+                )
+                + "\n]\n"
+            )
+            self.trace_file.close()
+        if self.jsonl_file is not None:
+            self.jsonl_file.close()
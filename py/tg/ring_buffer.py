@@ -0,0 +1,168 @@
+import multiprocessing
+from multiprocessing import shared_memory
+import queue
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+class SharedRingBuffer:
+    """
+    Fixed-size pool of `(x, y)` float32 batch slots living in shared memory.
+
+    Producers claim a free slot along with the index of the batch to generate into it, fill it in
+    place, and publish it.  The consumer receives slots in batch index order regardless of which
+    producer finished first, reads them through zero-copy views, and releases them back to the
+    producers once it's done with them.  Only slot and batch indices ever cross process boundaries.
+
+    A producer that dies takes the batch it claimed with it, so the consumer should pass the
+    producer processes to `watch_producers` to get an error instead of waiting forever.
+    """
+
+    def __init__(
+        self,
+        slot_count: int,
+        x_shape: Tuple[int, ...],
+        y_shape: Tuple[int, ...],
+        start_batch_ix=0,
+    ):
+        self.slot_count = slot_count
+        self.x_shape = tuple(x_shape)
+        self.y_shape = tuple(y_shape)
+        self.x_size = int(np.prod(self.x_shape))
+        self.y_size = int(np.prod(self.y_shape))
+        self.slot_size = self.x_size + self.y_size
+
+        self.shm = shared_memory.SharedMemory(
+            create=True, size=slot_count * self.slot_size * np.dtype(np.float32).itemsize
+        )
+        self.slots = np.ndarray((slot_count, self.slot_size), dtype=np.float32, buffer=self.shm.buf)
+
+        self.free_slots = multiprocessing.Queue()
+        self.full_slots = multiprocessing.Queue()
+        for slot_ix in range(slot_count):
+            self.free_slots.put(slot_ix)
+        self.closed = multiprocessing.Event()
+
+        # Batch indices are handed out to producers in the same order that they claim slots.  Since
+        # a producer holds its slot until the batch is published, the next batch the consumer is
+        # waiting for can never be starved of a slot by batches queued up ahead of it.
+        self.next_batch_ix = multiprocessing.Value("q", start_batch_ix)
+        self.expected_batch_ix = start_batch_ix
+        self.pending: Dict[int, int] = {}
+        self.producers: List[multiprocessing.Process] = []
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["slots"]
+        del state["producers"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.producers = []
+        self.slots = np.ndarray(
+            (self.slot_count, self.slot_size), dtype=np.float32, buffer=self.shm.buf
+        )
+
+    def slot_views(self, slot_ix: int) -> Tuple[np.ndarray, np.ndarray]:
+        slot = self.slots[slot_ix]
+        return (
+            slot[: self.x_size].reshape(self.x_shape),
+            slot[self.x_size :].reshape(self.y_shape),
+        )
+
+    def acquire(self, poll_interval=0.1) -> Optional[Tuple[int, int]]:
+        """
+        Blocks until a free slot is available for a producer to fill and returns
+        `(slot_ix, batch_ix)`.  Returns `None` once the buffer has been closed.
+        """
+        while not self.closed.is_set():
+            try:
+                slot_ix = self.free_slots.get(timeout=poll_interval)
+            except queue.Empty:
+                continue
+
+            with self.next_batch_ix.get_lock():
+                batch_ix = self.next_batch_ix.value
+                self.next_batch_ix.value += 1
+            return slot_ix, batch_ix
+        # Nothing reads published slots after `close`, so exiting doesn't wait for them to be
+        # flushed.  That wait would never end if another producer died while writing to the queue.
+        self.full_slots.cancel_join_thread()
+        return None
+
+    def publish(self, slot_ix: int, batch_ix: int):
+        self.full_slots.put((slot_ix, batch_ix))
+
+    def watch_producers(self, producers: List[multiprocessing.Process]):
+        """
+        Makes `get` raise once any of `producers` has exited
+        """
+        self.producers = producers
+
+    def check_producers(self):
+        for producer in self.producers:
+            if producer.exitcode is not None:
+                raise RuntimeError(
+                    f"Data worker {producer.pid} exited with code {producer.exitcode}"
+                )
+
+    def get(
+        self, timeout: Optional[float] = None, poll_interval=0.1
+    ) -> Tuple[int, int, np.ndarray, np.ndarray]:
+        """
+        Blocks until the next batch in order is available and returns `(slot_ix, batch_ix, x, y)`
+        where `x` and `y` are views of the slot's contents.  The views are only valid until the
+        slot is passed to `release`.
+
+        Raises `queue.Empty` after `timeout` seconds, or `RuntimeError` if a watched producer has
+        exited.
+        """
+        # A dead producer may not have taken a batch with it, but it's still treated as fatal
+        # rather than carrying on with fewer workers
+        self.check_producers()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.expected_batch_ix not in self.pending:
+            wait = poll_interval
+            if deadline is not None:
+                wait = max(min(wait, deadline - time.monotonic()), 0.0)
+            try:
+                slot_ix, batch_ix = self.full_slots.get(timeout=wait)
+            except queue.Empty:
+                self.check_producers()
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise
+                continue
+            self.pending[batch_ix] = slot_ix
+
+        batch_ix = self.expected_batch_ix
+        slot_ix = self.pending.pop(batch_ix)
+        self.expected_batch_ix += 1
+        return (slot_ix, batch_ix, *self.slot_views(slot_ix))
+
+    def ready_count(self) -> Optional[int]:
+        """
+        Returns roughly how many batches are ready for the consumer, or `None` if that can't be
+        determined on this platform
+        """
+        try:
+            return self.full_slots.qsize() + len(self.pending)
+        except NotImplementedError:
+            return None
+
+    def release(self, slot_ix: int):
+        self.free_slots.put(slot_ix)
+
+    def close(self):
+        """
+        Signals producers to stop.  Producers blocked in `acquire` return `None` within one poll
+        interval.
+        """
+        self.closed.set()
+
+    def unlink(self):
+        del self.slots
+        self.shm.close()
+        self.shm.unlink()
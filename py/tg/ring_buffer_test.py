@@ -0,0 +1,80 @@
+import multiprocessing
+import os
+import queue
+import time
+
+import numpy as np
+import pytest
+
+from ring_buffer import SharedRingBuffer
+
+
+def fill_worker(ring: SharedRingBuffer, die_at_batch_ix: int):
+    while True:
+        claimed = ring.acquire()
+        if claimed is None:
+            return
+        slot_ix, batch_ix = claimed
+        if batch_ix == die_at_batch_ix:
+            os._exit(1)
+        # Finish batches out of order so that the consumer has to put them back in order
+        time.sleep(0.001 * (batch_ix % 3))
+        x, y = ring.slot_views(slot_ix)
+        x[:] = batch_ix
+        y[:] = -batch_ix
+        ring.publish(slot_ix, batch_ix)
+
+
+def start_workers(ring: SharedRingBuffer, worker_count: int, die_at_batch_ix=-1):
+    workers = [
+        multiprocessing.Process(target=fill_worker, args=(ring, die_at_batch_ix), daemon=True)
+        for _ in range(worker_count)
+    ]
+    for worker in workers:
+        worker.start()
+    ring.watch_producers(workers)
+    return workers
+
+
+def shut_down(ring: SharedRingBuffer, workers):
+    ring.close()
+    for worker in workers:
+        worker.join(timeout=10)
+        assert worker.exitcode is not None
+    ring.unlink()
+
+
+@pytest.mark.parametrize("start_batch_ix", [0, 1000])
+def test_delivers_batches_in_order(start_batch_ix):
+    ring = SharedRingBuffer(6, (4, 3, 2), (4, 3, 1), start_batch_ix=start_batch_ix)
+    workers = start_workers(ring, 4)
+    try:
+        for batch_ix in range(start_batch_ix, start_batch_ix + 60):
+            slot_ix, got_batch_ix, x, y = ring.get(timeout=10)
+            assert got_batch_ix == batch_ix
+            assert x.shape == (4, 3, 2) and y.shape == (4, 3, 1)
+            assert np.all(x == batch_ix) and np.all(y == -batch_ix)
+            ring.release(slot_ix)
+    finally:
+        shut_down(ring, workers)
+
+
+def test_get_times_out_without_producers():
+    ring = SharedRingBuffer(2, (1,), (1,))
+    try:
+        with pytest.raises(queue.Empty):
+            ring.get(timeout=0.2)
+    finally:
+        ring.unlink()
+
+
+def test_get_raises_when_a_producer_dies():
+    ring = SharedRingBuffer(4, (2,), (2,))
+    workers = start_workers(ring, 2, die_at_batch_ix=5)
+    try:
+        with pytest.raises(RuntimeError, match="exited with code 1"):
+            for _ in range(20):
+                slot_ix, _batch_ix, _x, _y = ring.get(timeout=10)
+                ring.release(slot_ix)
+    finally:
+        shut_down(ring, workers)
@@ -0,0 +1,261 @@
+import copy
+import json
+import math
+from typing import Any, Dict, List, Optional, Tuple
+
+import yaml
+
+from custom_rnn import CustomRNN, CustomRNNCell
+from device_data import check_batch_shape
+from objective import build_objective
+from sparse_regularizer import SparseRegularizer
+from validate import check_exhaustive_validation
+
+DEFAULT_RUN_CONFIG: Dict[str, Any] = {
+    # Objective id as accepted by `build_objective`
+    "objective": "replace_1_to_111",
+    # Seeds both the initial weights and the training data stream
+    "seed": 0,
+    "seq_len": 20,
+    "batch_size": 1024,
+    "iterations": 5000,
+    "learning_rate": 0.01,
+    # Truncated backprop through time: when set, each batch is trained as a series of chunks of
+    # this many timesteps with one optimizer step per chunk
+    "tbptt_chunk_len": None,
+    # Parameters of the `SparseRegularizer` shared by every regularized weight
+    "regularizer": {"intensity": 0.05, "threshold": 0.025, "steepness": 10, "l1": 0.001},
+    # Each entry scales the learning rate and/or regularizer intensity from the start of the given
+    # iteration onwards
+    "schedule": [],
+    # Linearly ramps the learning rate up from zero over this many iterations
+    "warmup_iterations": 0,
+    # Set to "cosine" to also anneal the learning rate over the run, down to
+    # `min_learning_rate_factor` times its scheduled value at the last iteration
+    "learning_rate_decay": None,
+    "min_learning_rate_factor": 0.0,
+    "cells": [],
+    # Activation of the dense layer that's added after the cells when the last cell's output dim
+    # doesn't match the objective's
+    "post_layer_activation": "linear",
+    "regularize_post_layer": True,
+    "data": {
+        "workers": 12,
+        # Extra ring buffer slots beyond one per worker
+        "extra_slots": 4,
+        # Directory written by `dataset_cache.py` to train from instead of generating on the fly
+        "dataset_path": None,
+        # Upload batches to the device on a background thread while the previous step runs, on
+        # devices that support it; see `prefetch.py`
+        "prefetch": True,
+        # Generate batches on the device as part of each step instead of in worker processes, for
+        # objectives that support it.  The batches follow the same distribution as the ones
+        # generated on the host but aren't the same values.
+        "generate_on_device": False,
+    },
+    "validation_seq_len": 40,
+    # When set, the trained model is also checked on every possible input sequence of this length
+    # for objectives that support it; see `validate.run_exhaustive_validation`
+    "exhaustive_validation_seq_len": None,
+    # Settings for `population.py`, which trains several independently initialized copies of the
+    # model at once and keeps the best of them
+    "population": {
+        "size": 8,
+        # Iterations between pruning the worst members; 0 to never prune
+        "prune_every": 500,
+        # Fraction of the members that are kept each time the population is pruned
+        "keep_fraction": 0.5,
+        "min_size": 1,
+        # Members are ranked by their mean loss over this many of the most recent iterations
+        "loss_window": 100,
+    },
+}
+
+DEFAULT_CELL_CONFIG: Dict[str, Any] = {
+    "output_dim": None,
+    "state_size": None,
+    # Sets both the output and recurrent activation unless they're given individually
+    "activation": None,
+    "output_activation": "tanh",
+    "recurrent_activation": "tanh",
+    "use_bias": True,
+    "trainable_initial_weights": False,
+    "kernel_initializer": "glorot_uniform",
+    "recurrent_initializer": "glorot_uniform",
+    "bias_initializer": "glorot_uniform",
+    "initial_state_initializer": "glorot_uniform",
+    # Which of `output_kernel`, `recurrent_kernel`, `output_bias`, and `recurrent_bias` the
+    # regularizer is applied to
+    "regularize": [],
+}
+
+DEFAULT_SCHEDULE_ENTRY: Dict[str, Any] = {
+    "iteration": None,
+    "learning_rate_factor": 1.0,
+    "reg_intensity_factor": 1.0,
+}
+
+REGULARIZABLE_WEIGHTS = ["output_kernel", "recurrent_kernel", "output_bias", "recurrent_bias"]
+
+
+def merge_config(defaults: Dict[str, Any], config: Dict[str, Any], path: str) -> Dict[str, Any]:
+    merged = copy.deepcopy(defaults)
+    for key, value in config.items():
+        if key not in defaults:
+            raise ValueError(f"Unknown config key: {path}{key}")
+        if isinstance(defaults[key], dict) and isinstance(value, dict):
+            merged[key] = merge_config(defaults[key], value, f"{path}{key}.")
+        else:
+            merged[key] = value
+    return merged
+
+
+def parse_override(override: str) -> Tuple[List[str], Any]:
+    """
+    Parses an override of the form `key.path=value`, where the value is YAML (or JSON).  List
+    entries are addressed by their index, like `cells.0.state_size=4`.
+    """
+    if "=" not in override:
+        raise ValueError(f"Config overrides must look like `key.path=value`, got `{override}`")
+    key_path, value = override.split("=", 1)
+    return key_path.split("."), yaml.safe_load(value)
+
+
+def apply_override(config: Dict[str, Any], key_path: List[str], value: Any):
+    target = config
+    for key in key_path[:-1]:
+        target = target[int(key)] if isinstance(target, list) else target.setdefault(key, {})
+    last = key_path[-1]
+    if isinstance(target, list):
+        target[int(last)] = value
+    else:
+        target[last] = value
+
+
+def load_run_config(path: Optional[str], overrides: List[str] = []) -> Dict[str, Any]:
+    """
+    Loads a run config from a YAML or JSON file, applies `key.path=value` overrides, and fills in
+    defaults for everything that isn't set.  With no path, only the defaults and overrides are
+    used.
+    """
+    config: Dict[str, Any] = {}
+    if path is not None:
+        with open(path, "rt") as f:
+            if path.endswith(".json"):
+                config = json.load(f)
+            else:
+                config = yaml.safe_load(f) or {}
+
+    for override in overrides:
+        apply_override(config, *parse_override(override))
+
+    config = merge_config(DEFAULT_RUN_CONFIG, config, "")
+    cells = []
+    for cell_ix, cell in enumerate(config["cells"]):
+        cell = merge_config(DEFAULT_CELL_CONFIG, cell, f"cells.{cell_ix}.")
+        if cell["activation"] is not None:
+            raw_cell = config["cells"][cell_ix]
+            for key in ["output_activation", "recurrent_activation"]:
+                if key not in raw_cell:
+                    cell[key] = cell["activation"]
+        cells.append(cell)
+    config["cells"] = cells
+    config["schedule"] = sorted(
+        [
+            merge_config(DEFAULT_SCHEDULE_ENTRY, entry, f"schedule.{entry_ix}.")
+            for entry_ix, entry in enumerate(config["schedule"])
+        ],
+        key=lambda entry: entry["iteration"],
+    )
+    validate_run_config(config)
+    return config
+
+
+def validate_run_config(config: Dict[str, Any]):
+    if len(config["cells"]) == 0:
+        raise ValueError("Run config must have at least one cell")
+    for cell_ix, cell in enumerate(config["cells"]):
+        for key in ["output_dim", "state_size"]:
+            if cell[key] is None:
+                raise ValueError(f"cells.{cell_ix}.{key} must be set")
+        for name in cell["regularize"]:
+            if name not in REGULARIZABLE_WEIGHTS:
+                raise ValueError(f"Unknown weight to regularize in cells.{cell_ix}: {name}")
+    for entry_ix, entry in enumerate(config["schedule"]):
+        if entry["iteration"] is None:
+            raise ValueError(f"schedule.{entry_ix}.iteration must be set")
+    if config["learning_rate_decay"] not in [None, "cosine"]:
+        raise ValueError(f"Unknown learning_rate_decay: {config['learning_rate_decay']}")
+    if config["tbptt_chunk_len"] is not None and config["seq_len"] % config["tbptt_chunk_len"]:
+        raise ValueError("seq_len must be a multiple of tbptt_chunk_len")
+    if config["data"]["generate_on_device"] and config["data"]["dataset_path"] is not None:
+        raise ValueError("data.generate_on_device can't be used with data.dataset_path")
+    if config["data"]["generate_on_device"]:
+        objective = build_objective(config["objective"])
+        if objective.generate_on_device is not None:
+            check_batch_shape(config["batch_size"], config["seq_len"], objective.input_dim)
+    if config["exhaustive_validation_seq_len"] is not None:
+        # Checked up front so that an impossible validation doesn't fail after a whole run
+        check_exhaustive_validation(
+            build_objective(config["objective"]), config["exhaustive_validation_seq_len"]
+        )
+    population = config["population"]
+    if population["min_size"] < 1 or population["size"] < population["min_size"]:
+        raise ValueError("population.size must be at least population.min_size, which must be >= 1")
+    if not 0.0 < population["keep_fraction"] <= 1.0:
+        raise ValueError("population.keep_fraction must be in (0, 1]")
+
+
+def build_regularizer(config: Dict[str, Any]) -> SparseRegularizer:
+    return SparseRegularizer(**config["regularizer"])
+
+
+def build_rnn(config: Dict[str, Any], input_dim: int, reg: SparseRegularizer) -> CustomRNN:
+    cells = []
+    for cell_ix, cell in enumerate(config["cells"]):
+        regularizers = {
+            f"{name}_regularizer": reg if name in cell["regularize"] else None
+            for name in REGULARIZABLE_WEIGHTS
+        }
+        cells.append(
+            CustomRNNCell(
+                input_shape=(config["batch_size"], config["seq_len"], input_dim),
+                output_dim=cell["output_dim"],
+                state_size=cell["state_size"],
+                output_activation_id=cell["output_activation"],
+                recurrent_activation_id=cell["recurrent_activation"],
+                trainable_initial_weights=cell["trainable_initial_weights"],
+                use_bias=cell["use_bias"],
+                kernel_initializer=cell["kernel_initializer"],
+                recurrent_initializer=cell["recurrent_initializer"],
+                bias_initializer=cell["bias_initializer"],
+                initial_state_initializer=cell["initial_state_initializer"],
+                cell_ix=cell_ix,
+                **regularizers,
+            )
+        )
+        input_dim = cell["output_dim"]
+    return CustomRNN(*cells)
+
+
+def scheduled_values(config: Dict[str, Any], iteration: int) -> Tuple[float, float]:
+    """
+    Returns the `(learning_rate, reg_intensity)` to train the given iteration with
+    """
+    learning_rate = config["learning_rate"]
+    reg_intensity = config["regularizer"]["intensity"]
+    for entry in config["schedule"]:
+        if entry["iteration"] <= iteration:
+            learning_rate *= entry["learning_rate_factor"]
+            reg_intensity *= entry["reg_intensity_factor"]
+
+    if config["learning_rate_decay"] == "cosine":
+        progress = iteration / max(config["iterations"] - 1, 1)
+        min_factor = config["min_learning_rate_factor"]
+        learning_rate *= min_factor + (1.0 - min_factor) * 0.5 * (
+            1.0 + math.cos(math.pi * progress)
+        )
+    if iteration < config["warmup_iterations"]:
+        learning_rate *= (iteration + 1) / config["warmup_iterations"]
+
+    return learning_rate, reg_intensity
@@ -0,0 +1,40 @@
+from tinygrad.tensor import Tensor
+
+
+def mk_scalar(value: float) -> Tensor:
+    """
+    Creates a realized one-element tensor for a hyperparameter that's read by jitted code.
+
+    Plain Python floats (and `Tensor(float)`, which becomes a constant) get baked into the kernels
+    that `TinyJit` captures, so changing them means rebuilding the JIT.  A tensor backed by its own
+    buffer is read by those kernels instead, so it can be updated in place with `assign_scalar`.
+    """
+    return Tensor([value], requires_grad=False).contiguous().realize()
+
+
+def assign_scalar(t: Tensor, value: float):
+    """
+    Writes `value` into the existing buffer of a tensor created by `mk_scalar`.
+
+    Assigning a freshly created tensor would realize into a new buffer and leave any captured
+    kernels reading the old one, so the new value is computed from `t` itself.
+    """
+    t.assign(t * 0.0 + Tensor([value], requires_grad=False)).realize()
+
+
+# Created on first use so that importing this module doesn't touch the device
+_one = None
+
+
+def device_copy(t: Tensor) -> Tensor:
+    """
+    Copies `t` into a new buffer on the device without syncing.
+
+    This is needed to hold on to the outputs of a jitted function, since it writes them into the
+    same buffers on every call.  Ops like `t + 0.0` or `t.contiguous()` are folded away and return
+    the original buffer, so `t` is multiplied by a one that's stored in a buffer instead.
+    """
+    global _one
+    if _one is None:
+        _one = mk_scalar(1.0)
+    return (t * _one).realize()
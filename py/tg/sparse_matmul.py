@@ -0,0 +1,18 @@
+import numpy as np
+from numba import jit, prange
+
+# This lives apart from `np_inference.py` so that numba is only imported (and the kernel only
+# compiled) once a sparse kernel is actually run.  Compiled kernels are cached on disk.
+
+
+@jit(nopython=True, parallel=True, cache=True)
+def sparse_matmul_kernel(x, indptr, input_ixs, weights, out):
+    """
+    Computes `x @ kernel` into `out` for a kernel stored as in `np_inference.SparseKernel`
+    """
+    for batch_ix in prange(x.shape[0]):
+        for output_ix in range(indptr.shape[0] - 1):
+            acc = np.float32(0.0)
+            for i in range(indptr[output_ix], indptr[output_ix + 1]):
+                acc += x[batch_ix, input_ixs[i]] * weights[i]
+            out[batch_ix, output_ix] = acc
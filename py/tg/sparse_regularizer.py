@@ -1,26 +1,74 @@
 from tinygrad.tensor import Tensor
-import numpy as np
+
+from scalar_tensor import assign_scalar, mk_scalar
 
 
 class SparseRegularizer:
     def __init__(self, intensity=0.1, threshold=0.1, steepness=100, l1=0.001):
-        self.intensity = intensity
-        self.threshold = threshold
-        self.steepness = steepness
-        self.y_shift = np.tanh(-self.threshold * self.steepness)
-        self.l1_intensity = l1
+        self.values = {
+            "intensity": intensity,
+            "threshold": threshold,
+            "steepness": steepness,
+            "l1_intensity": l1,
+        }
+        # The parameters are also kept as tensors that are read by the penalty's kernels, so they
+        # can be changed over the course of training without rebuilding jitted training steps
+        self.params = {name: mk_scalar(value) for name, value in self.values.items()}
+
+    def set_param(self, name: str, value: float):
+        if self.values[name] != value:
+            self.values[name] = value
+            assign_scalar(self.params[name], value)
+
+    @property
+    def intensity(self) -> float:
+        return self.values["intensity"]
+
+    @intensity.setter
+    def intensity(self, value: float):
+        self.set_param("intensity", value)
+
+    @property
+    def threshold(self) -> float:
+        return self.values["threshold"]
+
+    @threshold.setter
+    def threshold(self, value: float):
+        self.set_param("threshold", value)
+
+    @property
+    def steepness(self) -> float:
+        return self.values["steepness"]
+
+    @steepness.setter
+    def steepness(self, value: float):
+        self.set_param("steepness", value)
+
+    @property
+    def l1_intensity(self) -> float:
+        return self.values["l1_intensity"]
+
+    @l1_intensity.setter
+    def l1_intensity(self, value: float):
+        self.set_param("l1_intensity", value)
 
     def __call__(self, x: Tensor):
+        intensity = self.params["intensity"].reshape(())
+        threshold = self.params["threshold"].reshape(())
+        steepness = self.params["steepness"].reshape(())
+        l1_intensity = self.params["l1_intensity"].reshape(())
+
         # abs(x - threshold)
         abs_weights = x.abs()
-        shifted_weights = abs_weights - self.threshold
+        shifted_weights = abs_weights - threshold
 
         # tanh((x - threshold) * steepness) - tanh(-threshold * steepness)
-        tanh_weights = (shifted_weights * self.steepness).tanh() - self.y_shift
+        y_shift = (-threshold * steepness).tanh()
+        tanh_weights = (shifted_weights * steepness).tanh() - y_shift
 
         # Add a bit of l1 regularization. This seems to be important to prevent very large weights.
-        l1_weight = abs_weights.mean() * self.l1_intensity
+        l1_weight = abs_weights.mean() * l1_intensity
 
         # Sum over all elements and scale by intensity
-        penalty = tanh_weights.mean() * self.intensity + l1_weight
+        penalty = tanh_weights.mean() * intensity + l1_weight
         return penalty
@@ -0,0 +1,98 @@
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from tinygrad.nn import Linear
+from tinygrad.tensor import Tensor
+
+from custom_rnn import CustomRNN, build_activation
+
+
+class StreamingRNN:
+    """
+    Runs a trained `CustomRNN` incrementally over many concurrent input streams.
+
+    Each open stream holds the state of every cell after the last input it was fed.  `advance`
+    feeds the next step or chunk of steps for any subset of streams as one batch and picks up from
+    where each of those streams left off, so nothing is recomputed from the start of a sequence.
+    """
+
+    def __init__(
+        self,
+        rnn: CustomRNN,
+        post_layers: Optional[List[Tuple[Linear, Union[str, Dict[str, Any]]]]] = None,
+    ):
+        self.rnn = rnn
+        self.post_layers: List[Tuple[Linear, Callable[[Tensor], Tensor]]] = [
+            (layer, build_activation(activation_id)) for layer, activation_id in post_layers or []
+        ]
+        self.input_dim = rnn.cells[0].input_dim
+        self.initial_states = [
+            cell.initial_state.numpy() if cell.initial_state is not None else None
+            for cell in rnn.cells
+        ]
+        self.states: Dict[int, List[Optional[np.ndarray]]] = {}
+        self.next_stream_id = 0
+
+    def from_weights(path: str) -> "StreamingRNN":
+        rnn, post_layers = CustomRNN.load_weights(path)
+        return StreamingRNN(rnn, post_layers)
+
+    def open_stream(self) -> int:
+        stream_id = self.next_stream_id
+        self.next_stream_id += 1
+        self.reset_stream(stream_id)
+        return stream_id
+
+    def reset_stream(self, stream_id: int):
+        self.states[stream_id] = [
+            state.copy() if state is not None else None for state in self.initial_states
+        ]
+
+    def close_stream(self, stream_id: int):
+        del self.states[stream_id]
+
+    def advance(self, stream_ids: Sequence[int], inputs: np.ndarray) -> np.ndarray:
+        """
+        Feeds `inputs` of shape `(len(stream_ids), steps, input_dim)` to the given streams and
+        returns the outputs for those steps with shape `(len(stream_ids), steps, output_dim)`.
+        """
+        if inputs.shape[0] != len(stream_ids) or inputs.shape[-1] != self.input_dim:
+            raise ValueError(
+                f"expected inputs of shape ({len(stream_ids)}, steps, {self.input_dim}), got "
+                f"{inputs.shape}"
+            )
+
+        prev_states = [
+            (
+                Tensor(np.stack([self.states[stream_id][cell_ix] for stream_id in stream_ids]))
+                if state is not None
+                else None
+            )
+            for cell_ix, state in enumerate(self.initial_states)
+        ]
+
+        no_grad = Tensor.no_grad
+        Tensor.no_grad = True
+        try:
+            y, new_states = self.rnn.forward_with_state(
+                Tensor(inputs.astype(np.float32, copy=False)), prev_states
+            )
+            for layer, activation in self.post_layers:
+                y = activation(layer(y))
+            outputs = y.numpy()
+            new_states = [state.numpy() if state is not None else None for state in new_states]
+        finally:
+            Tensor.no_grad = no_grad
+
+        for stream_ix, stream_id in enumerate(stream_ids):
+            self.states[stream_id] = [
+                state[stream_ix].copy() if state is not None else None for state in new_states
+            ]
+        return outputs
+
+    def step(self, stream_ids: Sequence[int], inputs: np.ndarray) -> np.ndarray:
+        """
+        Feeds a single step of `inputs` with shape `(len(stream_ids), input_dim)` to the given
+        streams and returns outputs with shape `(len(stream_ids), output_dim)`.
+        """
+        return self.advance(stream_ids, inputs[:, None, :])[:, 0, :]
@@ -0,0 +1,374 @@
+import argparse
+import csv
+import itertools
+import json
+import math
+import os
+import queue
+import re
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import yaml
+
+from checkpoint import latest_checkpoint
+from run_config import load_run_config, merge_config
+
+DEFAULT_SWEEP_CONFIG: Dict[str, Any] = {
+    # Run config that every trial starts from, relative to the sweep config
+    "base_config": None,
+    # `key.path=value` overrides applied to every trial
+    "overrides": [],
+    # Maps run config key paths to the values to try; every combination is run as a trial
+    "parameters": {},
+    # Iteration counts at which trials are ranked and the worst of them stopped (successive
+    # halving).  Trials that survive every rung are trained for the configured number of
+    # iterations.
+    "rungs": [],
+    # Only the best `1 / reduction_factor` of the trials at each rung continue
+    "reduction_factor": 3,
+    # Trials are ranked by their mean loss over this many of their most recent iterations
+    "loss_window": 100,
+    "cores_per_job": 1,
+    # Data generation workers started by each job; defaults to one per core it's pinned to
+    "data_workers": None,
+}
+
+DRIVER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "driver.py")
+# Seconds between rewrites of `results.json` while trials are streaming losses
+SUMMARY_INTERVAL = 10.0
+LOSS_LINE_RE = re.compile(r"^\[(\d+)\]: loss: \[\s*([^\s\]]+)\s+([^\s\]]+)\s*\]")
+RESUME_LINE_RE = re.compile(r"^Resumed from .* at iteration (\d+)")
+
+
+class Trial:
+    def __init__(self, trial_ix: int, params: Dict[str, Any], output_dir: str):
+        self.trial_ix = trial_ix
+        self.params = params
+        self.output_dir = output_dir
+        self.losses: List[float] = []
+        self.status = "pending"
+        self.iterations = 0
+        self.accuracy: Optional[float] = None
+
+    def recent_loss(self, window: int) -> float:
+        if len(self.losses) == 0:
+            return math.inf
+        return float(np.mean(self.losses[-window:]))
+
+
+def load_sweep_config(path: str) -> Dict[str, Any]:
+    with open(path, "rt") as f:
+        raw_config = yaml.safe_load(f) or {}
+    # Parameter names are run config key paths, so they're checked against the run config instead
+    parameters = raw_config.pop("parameters", {})
+    config = merge_config(DEFAULT_SWEEP_CONFIG, raw_config, "")
+    config["parameters"] = parameters
+    if config["base_config"] is None:
+        raise ValueError("Sweep config must set base_config")
+    config["base_config"] = os.path.join(
+        os.path.dirname(os.path.abspath(path)), config["base_config"]
+    )
+    if config["reduction_factor"] < 1:
+        raise ValueError("reduction_factor must be at least 1")
+    return config
+
+
+def build_trial_params(parameters: Dict[str, List[Any]]) -> List[Dict[str, Any]]:
+    """
+    Returns every combination of the swept parameter values
+    """
+    keys = list(parameters.keys())
+    return [dict(zip(keys, values)) for values in itertools.product(*parameters.values())]
+
+
+def build_core_groups(cores_per_job: int, max_jobs: Optional[int]) -> List[List[int]]:
+    """
+    Splits the cores this process may run on into disjoint groups, one per concurrent job
+    """
+    if hasattr(os, "sched_getaffinity"):
+        cores = sorted(os.sched_getaffinity(0))
+    else:
+        cores = list(range(os.cpu_count() or 1))
+    groups = [
+        cores[i : i + cores_per_job]
+        for i in range(0, len(cores) - cores_per_job + 1, cores_per_job)
+    ]
+    if len(groups) == 0:
+        groups = [cores]
+    if max_jobs is not None:
+        groups = groups[:max_jobs]
+    return groups
+
+
+class SweepRunner:
+    """
+    Runs the trials of a sweep as `driver.py` processes, each pinned to its own group of cores.
+
+    Each process trains one trial up to the next rung, writing checkpoints to its own directory so
+    that surviving trials are resumed from where they stopped.  Losses are parsed from the
+    processes' output as they're printed and appended to a CSV table shared by the whole sweep.
+
+    With `resume`, a sweep is continued in an existing output directory.  Each trial's params are
+    recorded in its directory, and trials are only resumed from their checkpoints if they were
+    started with the same params.
+    """
+
+    def __init__(
+        self, config: Dict[str, Any], output_dir: str, max_jobs: Optional[int], resume=False
+    ):
+        if not resume and os.path.isdir(output_dir) and len(os.listdir(output_dir)) > 0:
+            raise ValueError(f"{output_dir} isn't empty; pass --resume to continue the sweep in it")
+        self.config = config
+        self.output_dir = output_dir
+        self.core_groups: queue.Queue = queue.Queue()
+        groups = build_core_groups(config["cores_per_job"], max_jobs)
+        for group in groups:
+            self.core_groups.put(group)
+        self.job_count = len(groups)
+
+        base_config = load_run_config(config["base_config"], config["overrides"])
+        self.iterations = base_config["iterations"]
+        self.trials = [
+            Trial(trial_ix, params, os.path.join(output_dir, f"trial-{trial_ix:04d}"))
+            for trial_ix, params in enumerate(build_trial_params(config["parameters"]))
+        ]
+        for trial in self.trials:
+            # Fails early on typos in parameter names rather than once the jobs are running
+            load_run_config(config["base_config"], self.trial_overrides(trial))
+        if resume:
+            self.load_trials()
+
+        self.results_lock = threading.Lock()
+        os.makedirs(output_dir, exist_ok=True)
+        # When resuming, iterations that a trial trained past its last checkpoint are trained
+        # again and show up in the table a second time
+        results_path = os.path.join(output_dir, "losses.csv")
+        is_new = not os.path.exists(results_path)
+        self.results_file = open(results_path, "at", newline="")
+        self.results_writer = csv.writer(self.results_file)
+        if is_new:
+            self.results_writer.writerow(["trial", "iteration", "loss", "reg_loss"])
+
+    def load_trials(self):
+        """
+        Picks up the trials of an earlier run of the sweep, checking that each of them was run
+        with the same params and restoring the losses they've trained so far
+        """
+        for trial in self.trials:
+            if not os.path.isdir(trial.output_dir):
+                continue
+            params_path = os.path.join(trial.output_dir, "params.json")
+            if not os.path.exists(params_path):
+                raise ValueError(f"{trial.output_dir} has no params.json, so it can't be resumed")
+            with open(params_path, "rt") as f:
+                recorded_params = json.load(f)
+            if recorded_params != json.loads(json.dumps(trial.params)):
+                raise ValueError(
+                    f"{trial.output_dir} was run with params {json.dumps(recorded_params)}, not "
+                    f"{json.dumps(trial.params)}"
+                )
+
+        results_path = os.path.join(self.output_dir, "losses.csv")
+        if not os.path.exists(results_path):
+            return
+        # Iterations that were trained again after resuming show up more than once, and the last
+        # of them is the one that counts
+        losses: Dict[int, Dict[int, float]] = {}
+        with open(results_path, "rt", newline="") as f:
+            for row in csv.DictReader(f):
+                trial_losses = losses.setdefault(int(row["trial"]), {})
+                trial_losses[int(row["iteration"])] = float(row["loss"])
+        for trial in self.trials:
+            trial_losses = losses.get(trial.trial_ix, {})
+            trial.losses = [trial_losses[iteration] for iteration in sorted(trial_losses)]
+            trial.iterations = len(trial.losses)
+
+    def trial_overrides(self, trial: Trial) -> List[str]:
+        return self.config["overrides"] + [
+            f"{key}={json.dumps(value)}" for key, value in trial.params.items()
+        ]
+
+    def build_command(self, trial: Trial, cores: List[int], stop_at: Optional[int]) -> List[str]:
+        data_workers = self.config["data_workers"] or len(cores)
+        command = [
+            sys.executable,
+            DRIVER_PATH,
+            "--config",
+            self.config["base_config"],
+            "--output-dir",
+            trial.output_dir,
+            "--keep-checkpoints",
+            "1",
+            "--set",
+            f"data.workers={data_workers}",
+        ]
+        for override in self.trial_overrides(trial):
+            command += ["--set", override]
+        resume_path = latest_checkpoint(os.path.join(trial.output_dir, "checkpoints"))
+        if resume_path is not None:
+            command += ["--resume", resume_path]
+        if stop_at is not None:
+            command += ["--stop-at", str(stop_at), "--no-validate"]
+        return command
+
+    def run_trial(self, trial: Trial, stop_at: Optional[int]):
+        cores = self.core_groups.get()
+        try:
+            os.makedirs(trial.output_dir, exist_ok=True)
+            with open(os.path.join(trial.output_dir, "params.json"), "wt") as f:
+                json.dump(trial.params, f)
+            env = {
+                **os.environ,
+                "OMP_NUM_THREADS": str(len(cores)),
+                "NUMBA_NUM_THREADS": str(len(cores)),
+                # Losses are streamed from the job's output, so it mustn't sit in a buffer
+                "PYTHONUNBUFFERED": "1",
+            }
+
+            def pin_to_cores():
+                if hasattr(os, "sched_setaffinity"):
+                    os.sched_setaffinity(0, cores)
+
+            trial.status = "running"
+            self.write_summary()
+            last_summary_time = time.monotonic()
+            with open(os.path.join(trial.output_dir, "log.txt"), "at") as log:
+                proc = subprocess.Popen(
+                    self.build_command(trial, cores, stop_at),
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT,
+                    text=True,
+                    env=env,
+                    preexec_fn=pin_to_cores,
+                )
+                for line in proc.stdout:
+                    log.write(line)
+                    resume_match = RESUME_LINE_RE.match(line)
+                    if resume_match is not None:
+                        # Losses past the checkpoint are about to be trained again
+                        del trial.losses[int(resume_match.group(1)) :]
+                        trial.iterations = len(trial.losses)
+                        continue
+                    match = LOSS_LINE_RE.match(line)
+                    if match is None:
+                        continue
+                    iteration, loss, reg_loss = match.groups()
+                    trial.losses.append(float(loss))
+                    trial.iterations = int(iteration) + 1
+                    with self.results_lock:
+                        self.results_writer.writerow([trial.trial_ix, iteration, loss, reg_loss])
+                    if time.monotonic() - last_summary_time >= SUMMARY_INTERVAL:
+                        self.write_summary()
+                        last_summary_time = time.monotonic()
+                proc.wait()
+
+            if proc.returncode != 0:
+                trial.status = "failed"
+                print(f"trial {trial.trial_ix} failed; see {trial.output_dir}/log.txt")
+                return
+            trial.status = "stopped" if stop_at is not None else "done"
+            if stop_at is None:
+                with open(os.path.join(trial.output_dir, "validation.json"), "rt") as f:
+                    trial.accuracy = json.load(f)["accuracy"]
+        finally:
+            self.core_groups.put(cores)
+            self.write_summary()
+
+    def run_rung(self, trials: List[Trial], stop_at: Optional[int]):
+        with ThreadPoolExecutor(max_workers=self.job_count) as pool:
+            for future in [pool.submit(self.run_trial, trial, stop_at) for trial in trials]:
+                future.result()
+        self.results_file.flush()
+
+    def run(self):
+        alive = list(self.trials)
+        window = self.config["loss_window"]
+        rungs = [rung for rung in sorted(self.config["rungs"]) if rung < self.iterations]
+        for rung in rungs:
+            print(f"Training {len(alive)} trials to iteration {rung}")
+            self.run_rung(alive, rung)
+            alive = [trial for trial in alive if trial.status != "failed"]
+            alive.sort(key=lambda trial: trial.recent_loss(window))
+            keep = max(1, math.ceil(len(alive) / self.config["reduction_factor"]))
+            for trial in alive[keep:]:
+                trial.status = f"pruned at {rung}"
+            alive = alive[:keep]
+            self.write_summary()
+
+        print(f"Training {len(alive)} trials to completion")
+        self.run_rung(alive, None)
+        self.write_summary()
+        self.results_file.close()
+
+    def write_summary(self):
+        """
+        Writes the status and recent loss of every trial to `results.json`.  This is called
+        whenever a trial starts or finishes and periodically while it's running, so the file can
+        be watched during the sweep.
+        """
+        window = self.config["loss_window"]
+        summary = sorted(
+            [
+                {
+                    "trial": trial.trial_ix,
+                    "params": trial.params,
+                    "status": trial.status,
+                    "iterations": trial.iterations,
+                    "recent_loss": trial.recent_loss(window),
+                    "accuracy": trial.accuracy,
+                }
+                for trial in self.trials
+            ],
+            key=lambda row: (
+                -(row["accuracy"] if row["accuracy"] is not None else -1.0),
+                row["recent_loss"],
+            ),
+        )
+        results_path = os.path.join(self.output_dir, "results.json")
+        with self.results_lock:
+            if not self.results_file.closed:
+                self.results_file.flush()
+            # Replaced atomically so readers never see a partially written file
+            with open(f"{results_path}.tmp", "wt") as f:
+                json.dump(summary, f, indent=2)
+            os.replace(f"{results_path}.tmp", results_path)
+        return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run a hyperparameter sweep as parallel training jobs with successive halving"
+    )
+    parser.add_argument("config", help="YAML sweep config; see `DEFAULT_SWEEP_CONFIG`")
+    parser.add_argument("--output-dir", default="output/sweep")
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="continue a sweep in a non-empty output directory, resuming trials from their "
+        "checkpoints",
+    )
+    parser.add_argument(
+        "--jobs", type=int, help="max concurrent jobs; defaults to as many as there are cores for"
+    )
+    args = parser.parse_args()
+
+    runner = SweepRunner(load_sweep_config(args.config), args.output_dir, args.jobs, args.resume)
+    print(
+        f"Running {len(runner.trials)} trials, {runner.job_count} at a time with "
+        f"{runner.config['cores_per_job']} cores each"
+    )
+    runner.run()
+
+    for row in runner.write_summary():
+        accuracy = f"{row['accuracy'] * 100:.2f}%" if row["accuracy"] is not None else "-"
+        print(
+            f"trial {row['trial']:4d}  {row['status']:16s}  iterations {row['iterations']:6d}  "
+            f"loss {row['recent_loss']:.6f}  accuracy {accuracy:>8s}  {json.dumps(row['params'])}"
+        )
+    print(f"Saved results to {args.output_dir}")
@@ -0,0 +1,170 @@
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from tinygrad.jit import TinyJit
+from tinygrad.nn import Linear
+from tinygrad.nn.optim import LAMB, Adam
+from tinygrad.tensor import Tensor
+
+from custom_rnn import build_activation
+from objective import Objective
+from run_config import build_regularizer, build_rnn
+from scalar_tensor import device_copy
+
+
+class Trainer:
+    """
+    The model, optimizer, and jitted training step described by a run config.
+
+    This holds everything about training that doesn't involve the data pipeline, so it's shared
+    by `driver.py` and the benchmarks.
+    """
+
+    def __init__(self, config: Dict[str, Any], objective: Objective):
+        self.config = config
+        self.seq_len = config["seq_len"]
+        # Truncated backprop through time: when set, each batch is trained as a series of chunks of
+        # this many timesteps with one optimizer step per chunk.  The state is carried from one
+        # chunk to the next, but gradients don't flow back across chunk boundaries.
+        self.tbptt_chunk_len = config["tbptt_chunk_len"]
+
+        self.reg = build_regularizer(config)
+        self.rnn = build_rnn(config, objective.input_dim, self.reg)
+
+        self.dense = (
+            Linear(self.rnn.cells[-1].output_dim, objective.output_dim, bias=True)
+            if self.rnn.cells[-1].output_dim != objective.output_dim
+            else None
+        )
+        self.dense_activation = build_activation(config["post_layer_activation"])
+        self.post_layers = (
+            [(self.dense, config["post_layer_activation"])] if self.dense is not None else []
+        )
+
+        trainable_params = self.rnn.get_trainable_params() + (
+            [self.dense.weight, self.dense.bias] if self.dense else []
+        )
+        self.opt = Adam(
+            trainable_params,
+            config["learning_rate"],
+        )
+
+    def forward_with_state(
+        self, x: Tensor, initial_states: Optional[List[Optional[Tensor]]] = None
+    ) -> Tuple[Tensor, List[Optional[Tensor]]]:
+        y, states = self.rnn.forward_with_state(x, initial_states)
+        if self.dense is not None:
+            y = self.dense_activation(self.dense(y))
+        return y, states
+
+    def forward(self, x: Tensor) -> Tensor:
+        return self.forward_with_state(x)[0]
+
+    def compute_loss(self, y_pred: Tensor, y_true: Tensor) -> Tensor:
+        return (y_pred - y_true).pow(2).mean()
+
+    def mk_sub_optimizer(self, params: List[Tensor]) -> LAMB:
+        """
+        Returns an optimizer that only steps `params`, a subset of the trainable params.  It shares
+        its moment estimates, step count, and learning rate with `self.opt`, so it's equivalent to
+        stepping `self.opt` with the other params left untouched.
+        """
+        opt = Adam(params, self.config["learning_rate"])
+        param_ixs = {id(param): ix for ix, param in enumerate(self.opt.params)}
+        opt.m = [self.opt.m[param_ixs[id(param)]] for param in opt.params]
+        opt.v = [self.opt.v[param_ixs[id(param)]] for param in opt.params]
+        opt.t = self.opt.t
+        opt.lr = self.opt.lr
+        return opt
+
+    def train_step(
+        self,
+        x: Tensor,
+        y: Tensor,
+        initial_states: Optional[List[Optional[Tensor]]] = None,
+        opt: Optional[LAMB] = None,
+    ) -> Tuple[Tensor, List[Optional[Tensor]]]:
+        """
+        Trains on one batch with `opt`, which defaults to `self.opt`.  Every param it steps has to
+        take part in the graph.
+        """
+        opt = opt or self.opt
+        y_pred, states = self.forward_with_state(x, initial_states)
+        raw_loss = self.compute_loss(y_pred, y)
+        reg_loss = self.rnn.get_regularization_loss()
+        if self.dense is not None and self.config["regularize_post_layer"]:
+            reg_loss = reg_loss + self.reg(self.dense.weight)
+        loss = raw_loss + reg_loss
+        # Realized before the optimizer updates the weights in place, since otherwise whether the
+        # reported losses are computed from the old or new weights depends on the device
+        raw_loss.realize()
+        reg_loss.realize()
+
+        opt.zero_grad()
+        loss.backward()
+        opt.step()
+
+        losses = raw_loss.reshape((1,)).cat(reg_loss.reshape((1,))).realize()
+        return losses, [state.realize() if state is not None else None for state in states]
+
+    def mk_train_one_batch(self) -> Callable[[Tensor, Tensor], Tensor]:
+        """
+        Returns a function that trains on one batch and returns the `[raw_loss, reg_loss]` it was
+        trained with.  It should be created once and reused, since the steps are jitted.
+        """
+        seq_len = self.seq_len
+        tbptt_chunk_len = self.tbptt_chunk_len
+        train_step = self.train_step
+
+        if tbptt_chunk_len is None:
+
+            @TinyJit
+            def train_one_batch(x: Tensor, y: Tensor) -> Tensor:
+                return train_step(x, y)[0]
+
+            return train_one_batch
+
+        assert seq_len % tbptt_chunk_len == 0, "seq_len must be a multiple of tbptt_chunk_len"
+
+        # The first chunk starts from the cells' (trainable) initial states while later chunks
+        # start from states carried over as inputs, so they're two different graphs.  Both have
+        # a fixed size no matter how long the sequences are.
+        @TinyJit
+        def train_first_chunk(x: Tensor, y: Tensor):
+            return train_step(x, y)
+
+        # Later chunks don't read the cells' trainable initial states, so they're left out of those
+        # steps entirely.  Stepping them with zero gradients would still move them by Adam's
+        # momentum once per chunk.
+        initial_state_ids = {
+            id(cell.initial_state) for cell in self.rnn.cells if cell.initial_state is not None
+        }
+        next_chunk_opt = self.mk_sub_optimizer(
+            [param for param in self.opt.params if id(param) not in initial_state_ids]
+        )
+
+        @TinyJit
+        def train_next_chunk(x: Tensor, y: Tensor, *states: Optional[Tensor]):
+            return train_step(x, y, list(states), next_chunk_opt)
+
+        def train_one_batch_truncated(x: Tensor, y: Tensor) -> Tensor:
+            chunk_losses = []
+            states = None
+            for chunk_start in range(0, seq_len, tbptt_chunk_len):
+                chunk = slice(chunk_start, chunk_start + tbptt_chunk_len)
+                x_chunk, y_chunk = x[:, chunk, :].contiguous(), y[:, chunk, :].contiguous()
+                if states is None:
+                    losses, states = train_first_chunk(x_chunk, y_chunk)
+                else:
+                    losses, states = train_next_chunk(x_chunk, y_chunk, *states)
+
+                # Detach the states from this chunk's graph and copy them (and the losses) out of
+                # the JIT's output buffers, which get overwritten on the next call.  This stays on
+                # the device so that chunks don't wait for each other.
+                states = [
+                    device_copy(state.detach()) if state is not None else None for state in states
+                ]
+                chunk_losses.append(device_copy(losses))
+
+            return Tensor.stack(chunk_losses).mean(axis=0).realize()
+
+        return train_one_batch_truncated
@@ -1,15 +1,195 @@
-from typing import Callable, Tuple
+import argparse
+import json
+import queue
+import threading
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
 from tinygrad.tensor import Tensor
 from tinygrad.helpers import dtypes
 import numpy as np
 
+from custom_rnn import CustomRNN, build_activation
+from objective import Objective, build_objective
+
 
 def f32_to_int(x: Tensor) -> Tensor:
     # return (x + 0.5).floor().cast(dtypes.int32)
     return (x > 0.0).cast(dtypes.float32).mul(2.0).sub(1.0).cast(dtypes.int32)
 
 
-def validate(
+def f32_to_int_np(x: np.ndarray) -> np.ndarray:
+    """
+    NumPy version of `f32_to_int`
+    """
+    return np.where(x > 0.0, 1, -1).astype(np.int32)
+
+
+class ValidationReport:
+    """
+    Accumulates the results of validating a model over any number of batches.
+
+    Outputs are compared after being rounded to ±1 with `f32_to_int`.  A timestep is correct if
+    every output at that timestep is, and a sequence is correct if every timestep is.
+    """
+
+    def __init__(self, seq_len: int):
+        self.seq_len = seq_len
+        self.sequence_count = 0
+        self.output_count = 0
+        self.incorrect_output_count = 0
+        # Number of sequences with an error at each position
+        self.error_counts = np.zeros(seq_len, dtype=np.int64)
+        # Number of sequences whose first error is at each position
+        self.first_error_counts = np.zeros(seq_len, dtype=np.int64)
+        # The first failing sequence seen, for debugging
+        self.example_failure: Optional[Dict[str, Any]] = None
+
+    def add_batch(self, x: np.ndarray, expected: np.ndarray, y_pred: np.ndarray):
+        """
+        Adds a batch of `(batch, seq_len, dim)` inputs, expected outputs, and raw predictions
+        """
+        incorrect = f32_to_int_np(y_pred) != f32_to_int_np(expected)
+        timestep_errors = incorrect.any(axis=2)
+        failing = timestep_errors.any(axis=1)
+        # `argmax` finds the first `True`; sequences without errors are masked out by `failing`
+        first_error_ixs = timestep_errors.argmax(axis=1)[failing]
+
+        self.sequence_count += x.shape[0]
+        self.output_count += incorrect.size
+        self.incorrect_output_count += int(np.count_nonzero(incorrect))
+        self.error_counts += timestep_errors.sum(axis=0)
+        self.first_error_counts += np.bincount(first_error_ixs, minlength=self.seq_len)
+
+        if self.example_failure is None and len(first_error_ixs) > 0:
+            seq_ix = int(np.argmax(failing))
+            self.example_failure = {
+                "inputs": x[seq_ix].tolist(),
+                "expected": f32_to_int_np(expected[seq_ix]).tolist(),
+                "actual": f32_to_int_np(y_pred[seq_ix]).tolist(),
+                "first_error_ix": int(first_error_ixs[0]),
+            }
+
+    @property
+    def failing_sequence_count(self) -> int:
+        return int(self.first_error_counts.sum())
+
+    @property
+    def passed(self) -> bool:
+        return self.failing_sequence_count == 0
+
+    @property
+    def accuracy(self) -> float:
+        """
+        Fraction of all output values predicted correctly
+        """
+        if self.output_count == 0:
+            return 1.0
+        return 1.0 - self.incorrect_output_count / self.output_count
+
+    @property
+    def per_timestep_accuracy(self) -> np.ndarray:
+        return 1.0 - self.error_counts / max(self.sequence_count, 1)
+
+    @property
+    def timestep_accuracy(self) -> float:
+        return float(self.per_timestep_accuracy.mean())
+
+    @property
+    def sequence_accuracy(self) -> float:
+        return 1.0 - self.failing_sequence_count / max(self.sequence_count, 1)
+
+    def first_error_stats(self) -> Dict[str, Optional[float]]:
+        if self.passed:
+            return {"min": None, "mean": None, "median": None}
+        positions = np.arange(self.seq_len)
+        cumulative = np.cumsum(self.first_error_counts)
+        return {
+            "min": int(positions[self.first_error_counts > 0][0]),
+            "mean": float((positions * self.first_error_counts).sum() / cumulative[-1]),
+            "median": int(np.searchsorted(cumulative, cumulative[-1] / 2)),
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "passed": self.passed,
+            "seq_len": self.seq_len,
+            "sequence_count": self.sequence_count,
+            "failing_sequence_count": self.failing_sequence_count,
+            "accuracy": self.accuracy,
+            "timestep_accuracy": self.timestep_accuracy,
+            "sequence_accuracy": self.sequence_accuracy,
+            "per_timestep_accuracy": self.per_timestep_accuracy.tolist(),
+            "error_counts": self.error_counts.tolist(),
+            "first_error_counts": self.first_error_counts.tolist(),
+            "first_error": self.first_error_stats(),
+            "example_failure": self.example_failure,
+        }
+
+    def print_summary(self):
+        if self.passed:
+            print(f"VALIDATION PASS for {self.sequence_count} examples")
+            return
+
+        print(
+            f"validation FAIL; {self.failing_sequence_count} of {self.sequence_count} sequences "
+            f"had errors"
+        )
+        print(
+            f"accuracy: {self.accuracy * 100:.2f}%; timestep accuracy: "
+            f"{self.timestep_accuracy * 100:.2f}%; sequence accuracy: "
+            f"{self.sequence_accuracy * 100:.2f}%"
+        )
+        print(f"first error position: {self.first_error_stats()}")
+        print(f"errors by position: {self.error_counts.tolist()}")
+        failure = self.example_failure
+        print(f"expected: {failure['expected']}")
+        print(f"actual: {failure['actual']}")
+        print(f"first error at index {failure['first_error_ix']}")
+
+
+def prefetch_batches(
+    make_batch: Callable[[int], Tuple[np.ndarray, np.ndarray]],
+    batch_count: int,
+    depth=2,
+) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Yields `make_batch(batch_ix)` for each of `batch_count` batches, generating up to `depth` of
+    them ahead on a background thread so that data generation overlaps with evaluating the model
+    """
+    batches: queue.Queue = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        # Gives up once the consumer has stopped, since nothing will take items off the queue
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def generate():
+        try:
+            for batch_ix in range(batch_count):
+                if not put(make_batch(batch_ix)):
+                    return
+        except Exception as e:
+            put(e)
+
+    thread = threading.Thread(target=generate, daemon=True)
+    thread.start()
+    try:
+        for _ in range(batch_count):
+            batch = batches.get()
+            if isinstance(batch, Exception):
+                raise batch
+            yield batch
+    finally:
+        stop.set()
+        thread.join()
+
+
+def run_validation(
     one_batch_examples: Callable[
         [int, int],
         Tuple[np.ndarray, np.ndarray],
@@ -17,49 +197,141 @@ def validate(
     forward: Callable[[Tensor], Tensor],
     seq_len: int,
     test_count: int = 50000,
+    batch_size: int = 10000,
+    stop_on_failure=False,
+) -> ValidationReport:
+    """
+    Validates the model on `test_count` random examples in batches of up to `batch_size`, returning
+    a report rather than printing.  Predictions are read back from the device once per batch and
+    all stats are computed on the host.  With `stop_on_failure`, stops after the first batch that
+    has an error.
+    """
+    report = ValidationReport(seq_len)
+    batch_size = min(batch_size, test_count)
+    batch_count = -(-test_count // batch_size)
+    batches = prefetch_batches(lambda _: one_batch_examples(batch_size, seq_len), batch_count)
+    for x, expected in batches:
+        y_pred = forward(Tensor(x, dtype=dtypes.float32)).numpy()
+        report.add_batch(x, expected, y_pred)
+        if stop_on_failure and not report.passed:
+            break
+    return report
+
+
+def enumerate_sign_sequences(start: int, end: int, seq_len: int, input_dim: int) -> np.ndarray:
+    """
+    Returns input sequences `start` to `end` out of all `2^(seq_len * input_dim)` sequences of
+    ±1 values, with shape `(end - start, seq_len, input_dim)`.  Bit `i` of a sequence's index is
+    the `i`th value in row-major order, with 1 bits mapped to 1 and 0 bits to -1.
+    """
+    ixs = np.arange(start, end, dtype=np.int64)
+    bits = (ixs[:, None] >> np.arange(seq_len * input_dim, dtype=np.int64)) & 1
+    return (bits * 2 - 1).astype(np.float32).reshape(end - start, seq_len, input_dim)
+
+
+def check_exhaustive_validation(
+    objective: Objective, seq_len: int, max_sequence_count: int = 2**26
 ):
-    batch_size = int(test_count / 50)
-    batch_count = int(test_count / batch_size)
+    """
+    Raises a `ValueError` if `run_exhaustive_validation` can't be run for `objective` at `seq_len`
+    """
+    if objective.compute_targets is None:
+        raise ValueError(f"{objective} doesn't support exhaustive validation")
+    bit_count = seq_len * objective.input_dim
+    if bit_count >= 63 or 2**bit_count > max_sequence_count:
+        raise ValueError(
+            f"Exhaustive validation of {objective} at seq_len {seq_len} would need "
+            f"2^{bit_count} sequences, more than max_sequence_count ({max_sequence_count})"
+        )
 
-    print("\n\n\nRunning Validation...\n\n")
 
-    for batch_ix in range(batch_count):
-        x, expected = one_batch_examples(batch_size, seq_len)
+def run_exhaustive_validation(
+    objective: Objective,
+    forward: Callable[[Tensor], Tensor],
+    seq_len: int,
+    batch_size: int = 65536,
+    max_sequence_count: int = 2**26,
+) -> ValidationReport:
+    """
+    Checks the model on every possible input sequence of length `seq_len`, stopping after the
+    first batch that contains a counterexample.  If the report passes, the model is correct for
+    all inputs of up to `seq_len` timesteps, since outputs only depend on the inputs before them.
 
-        y_pred = f32_to_int(forward(Tensor(x, dtype=dtypes.float32)))
-        expected = f32_to_int(Tensor(expected, dtype=dtypes.float32))
+    Only works for objectives with `compute_targets`, whose inputs are random signs.  There are
+    `2^(seq_len * input_dim)` sequences, which must be at most `max_sequence_count`.
+    """
+    check_exhaustive_validation(objective, seq_len, max_sequence_count)
+    sequence_count = 2 ** (seq_len * objective.input_dim)
+    batch_size = min(batch_size, sequence_count)
+    batch_count = -(-sequence_count // batch_size)
 
-        incorrect_count = (y_pred.realize() != expected.realize()).sum().numpy()
+    def make_batch(batch_ix: int) -> Tuple[np.ndarray, np.ndarray]:
+        start = batch_ix * batch_size
+        end = min(start + batch_size, sequence_count)
+        x = enumerate_sign_sequences(start, end, seq_len, objective.input_dim)
+        expected = np.empty((end - start, seq_len, objective.output_dim), dtype=np.float32)
+        objective.compute_targets(x, expected)
+        return x, expected
 
-        if incorrect_count == 0:
-            if batch_ix % 10 == 0:
-                print(f"validation PASS; batch {batch_ix} of {batch_count}")
-            continue
+    report = ValidationReport(seq_len)
+    for x, expected in prefetch_batches(make_batch, batch_count):
+        y_pred = forward(Tensor(x, dtype=dtypes.float32)).numpy()
+        report.add_batch(x, expected, y_pred)
+        if not report.passed:
+            break
+    return report
 
-        total_count = batch_size * seq_len
-        acc = 1 - (incorrect_count / total_count)
-        print("incorrect_count", incorrect_count)
-        print(f"validation FAIL; accuracy: {acc*100:.2f}%")
 
-        # find index of sequence with first error
-        for seq_ix in range(batch_size):
-            seq_expected = expected[seq_ix]
-            seq_pred = y_pred[seq_ix]
+def validate(
+    one_batch_examples: Callable[
+        [int, int],
+        Tuple[np.ndarray, np.ndarray],
+    ],
+    forward: Callable[[Tensor], Tensor],
+    seq_len: int,
+    test_count: int = 50000,
+) -> float:
+    """
+    Runs `run_validation` and prints a summary, returning the fraction of output values predicted
+    correctly
+    """
+    print("\n\n\nRunning Validation...\n\n")
+    report = run_validation(one_batch_examples, forward, seq_len, test_count)
+    report.print_summary()
+    return report.accuracy
 
-            if (seq_expected != seq_pred).sum().numpy() > 0:
-                print(f"expected: {seq_expected.numpy()}")
-                print(f"actual: {seq_pred.numpy()}")
 
-                seq_expected = seq_expected.numpy()
-                seq_pred = seq_pred.numpy()
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Validate a model written by `dump_weights`")
+    parser.add_argument("weights", help="weights JSON written by `CustomRNN.dump_weights`")
+    parser.add_argument("--objective", default="replace_1_to_111", help="objective id")
+    parser.add_argument("--seq-len", type=int, default=20)
+    parser.add_argument(
+        "--exhaustive",
+        action="store_true",
+        help="check every possible input sequence rather than random samples",
+    )
+    parser.add_argument("--test-count", type=int, default=50000)
+    parser.add_argument("--output", help="path to write the JSON report to")
+    args = parser.parse_args()
 
-                for i in range(seq_len):
-                    if seq_expected[i] != seq_pred[i]:
-                        print(
-                            f"first error at index {i}; expected {seq_expected[i]}, got {seq_pred[i]}"
-                        )
-                        break
+    objective = build_objective(args.objective)
+    rnn, post_layers = CustomRNN.load_weights(args.weights)
+    post_layer_activations = [build_activation(activation) for _, activation in post_layers]
 
-                return
+    def forward(x: Tensor) -> Tensor:
+        y = rnn(x)
+        for (layer, _), activation in zip(post_layers, post_layer_activations):
+            y = activation(layer(y))
+        return y
 
-    print(f"VALIDATION PASS for {test_count} examples")
+    if args.exhaustive:
+        report = run_exhaustive_validation(objective, forward, args.seq_len)
+    else:
+        report = run_validation(
+            objective.one_batch_examples, forward, args.seq_len, args.test_count
+        )
+    report.print_summary()
+    if args.output is not None:
+        with open(args.output, "wt") as f:
+            json.dump(report.to_dict(), f, indent=2)